@@ -0,0 +1,97 @@
+"""
+Fixtures shared by the Toyz tests
+"""
+from __future__ import print_function, division
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# The package was written for Python 2 (for example ``core.create_paths`` checks for a
+# ``basestring`` ), so the tests can also run with Python 3
+try:
+    basestring
+except NameError:
+    import builtins
+    builtins.basestring = str
+
+# Process-wide caches that are created the first time they are needed
+process_caches = ['file_cache', 'tile_cache', 'tile_store', 'block_cache']
+
+class WebSettings:
+    """
+    ``web`` section of the application settings. Any setting that is not set uses the
+    value from ``core.default_settings`` (see :py:func:`toyz.utils.core.get_setting` ).
+    """
+    def __init__(self, **settings):
+        for key, value in settings.items():
+            setattr(self, key, value)
+
+class Settings:
+    """
+    Application settings with only a ``web`` section
+    """
+    def __init__(self, **web_settings):
+        self.web = WebSettings(**web_settings)
+
+def reset_caches():
+    from toyz.web import tile_pool
+    tile_pool.close_tile_pool()
+    for cache in process_caches:
+        setattr(session_vars, cache, None)
+    session_vars.pyramids = OrderedDict()
+    session_vars.integral_images = OrderedDict()
+    session_vars.frame_stats = OrderedDict()
+
+@pytest.fixture
+def web_settings():
+    """
+    Function that sets the web settings used by the current process. The process-wide
+    caches are removed before and after each test.
+    """
+    reset_caches()
+    def set_web_settings(**settings):
+        session_vars.toyz_settings = Settings(**settings)
+        return session_vars.toyz_settings
+    set_web_settings()
+    yield set_web_settings
+    reset_caches()
+    session_vars.toyz_settings = None
+
+@pytest.fixture
+def fits_path(tmpdir):
+    """
+    Path of a 1000x1000 FITS image with random pixel values and a block of NaN pixels
+    """
+    from astropy.io import fits
+    data = np.random.RandomState(0).rand(1000, 1000).astype(np.float32)
+    data[100:140, 300:340] = np.nan
+    filepath = os.path.join(str(tmpdir), 'image.fits')
+    fits.PrimaryHDU(data).writeto(filepath)
+    return filepath
+
+def get_viewer_info(filepath, scale, save_path, width=800, height=800, tile_size=64):
+    """
+    Get the ``file_info`` , ``img_info`` and new tiles for a viewer at ``scale`` in the
+    upper left corner of an image, using square tiles with ``tile_size`` pixels
+    """
+    from toyz.web import viewer
+    file_info = viewer.get_file_info({'filepath': filepath, 'img_type': 'image',
+        'tile_width': tile_size, 'tile_height': tile_size})
+    img_info = viewer.get_img_info(file_info, {
+        'frame': file_info['frame'],
+        'save_path': save_path,
+        'viewer': {
+            'x_center': width//2,
+            'y_center': height//2,
+            'width': width,
+            'height': height,
+            'scale': scale
+        }
+    })
+    all_tiles, new_tiles = viewer.get_tile_info(file_info, img_info)
+    return file_info, img_info, new_tiles
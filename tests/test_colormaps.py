@@ -0,0 +1,53 @@
+from __future__ import division
+import numpy as np
+import pytest
+
+from toyz.web import colormaps
+from toyz.utils.errors import ToyzJobError
+
+def get_colormap(**settings):
+    colormap = {'name': 'viridis', 'px_min': 0., 'px_max': 1., 'invert_color': False}
+    colormap.update(settings)
+    return colormap
+
+def test_lut():
+    lut = colormaps.get_lut('viridis')
+    assert lut.shape == (colormaps.LUT_SIZE+1, 4)
+    assert lut.dtype == np.uint8
+    # The last entry is transparent (for pixels that are not finite)
+    assert (lut[-1] == 0).all()
+    assert (lut[:-1,3] == 255).all()
+    # Tables are only created once for each colormap
+    assert colormaps.get_lut('viridis') is lut
+    inverted = colormaps.get_lut('viridis', invert_color=True)
+    assert np.array_equal(inverted[:-1], lut[-2::-1])
+
+def test_lut_errors():
+    with pytest.raises(ToyzJobError):
+        colormaps.get_lut('not_a_colormap')
+    with pytest.raises(ToyzJobError):
+        colormaps.get_lut('viridis', color_scale='cubic')
+
+def test_quantize():
+    data = np.array([[-1, 0, .5], [1, 2, np.nan], [np.inf, -np.inf, .25]])
+    idx = colormaps.quantize(data, get_colormap())
+    top = colormaps.LUT_SIZE-1
+    assert idx.dtype == np.uint16
+    assert idx.tolist() == [
+        [0, 0, top//2],
+        [top, top, colormaps.LUT_SIZE],
+        [colormaps.LUT_SIZE, colormaps.LUT_SIZE, top//4]]
+    # A colormap with no range maps every finite pixel to the first color
+    idx = colormaps.quantize(data, get_colormap(px_min=1., px_max=1.))
+    assert idx.tolist()[0] == [0, 0, 0]
+    assert idx[1,2] == colormaps.LUT_SIZE
+
+def test_colorize():
+    data = np.array([[0, np.nan], [1, .5]])
+    colormap = get_colormap(color_scale='sqrt')
+    img = colormaps.colorize(data, colormap)
+    lut = colormaps.get_lut('viridis', color_scale='sqrt')
+    assert img.shape == (2, 2, 4)
+    assert (img[0,1] == 0).all()
+    assert np.array_equal(img[0,0], lut[0])
+    assert np.array_equal(img[1,0], lut[colormaps.LUT_SIZE-1])
@@ -0,0 +1,109 @@
+from __future__ import division
+import json
+import os
+import sqlite3
+import struct
+import pytest
+
+from toyz.utils import core
+from toyz.utils import db as db_utils
+from toyz.utils.errors import ToyzJobError
+
+def decode_binary_frame(frame):
+    """
+    Split a binary websocket message into its header and payload (the same way as the
+    client)
+    """
+    header_size = struct.unpack('<I', frame[:4])[0]
+    header = json.loads(frame[4:4+header_size].decode('utf-8'))
+    return header, frame[4+header_size:]
+
+def test_encode_binary_frame():
+    header = {'id': 'tile', 'idx': '1,2', 'row': 1, 'col': 2}
+    frame = core.encode_binary_frame(header, b'\x89PNG\x00\xff')
+    assert decode_binary_frame(frame) == (header, b'\x89PNG\x00\xff')
+    assert decode_binary_frame(core.encode_binary_frame({'id': 'data'}, b'')) == (
+        {'id': 'data'}, b'')
+
+def test_build_result():
+    job_id = {'user_id': 'admin', 'session_id': 's', 'request_id': 3}
+    response = {
+        'id': 'tiles created',
+        'binary_frames': [({'id': 'tile', 'idx': 'a'}, b'1'), ({'id': 'tile', 'idx': 'b'}, b'22')]
+    }
+    result = core.build_result(job_id, response)
+    assert result['response'] == {'id': 'tiles created', 'request_id': 3}
+    # The request is added to the header of every binary message
+    assert [decode_binary_frame(frame) for frame in result['binary_frames']] == [
+        ({'id': 'tile', 'idx': 'a', 'request_id': 3}, b'1'),
+        ({'id': 'tile', 'idx': 'b', 'request_id': 3}, b'22')]
+    assert 'update_app' not in result
+
+@pytest.fixture
+def toyz_settings(tmpdir):
+    """
+    Settings with a new (sqlite) database for a user ``user`` that can run the ``json``
+    module
+    """
+    core.clear_module_cache()
+    db_settings = core.ToyzClass({
+        'interface_name': 'toyz.utils.db_interfaces.sqlite_interface',
+        'path': str(tmpdir.join('toyz.db'))
+    })
+    db_utils.create_toyz_database(db_settings)
+    db_utils.update_param(db_settings, 'modules', user_id='user', modules=['json'])
+    yield core.ToyzClass({
+        'db': db_settings,
+        'config': core.ToyzClass({'approved_modules': []})
+    })
+    core.clear_module_cache()
+
+@pytest.fixture
+def module_checks(monkeypatch):
+    """
+    Modules checked in the database by ``core.check_user_modules``
+    """
+    checks = []
+    check_user_modules = core.check_user_modules
+    def count_checks(toyz_settings, user_id, module):
+        checks.append(module)
+        return check_user_modules(toyz_settings, user_id, module)
+    monkeypatch.setattr(core, 'check_user_modules', count_checks)
+    return checks
+
+def test_module_cache(toyz_settings, module_checks):
+    assert core.get_toyz_module(toyz_settings, 'user', 'json') is json
+    assert core.get_toyz_module(toyz_settings, 'user', 'json') is json
+    assert module_checks == ['json']
+    # Changing the permissions clears the cache
+    db_utils.update_param(toyz_settings.db, 'modules', user_id='user', modules=['struct'])
+    assert core.get_toyz_module(toyz_settings, 'user', 'struct') is struct
+    assert module_checks == ['json', 'struct']
+    db_utils.delete_param(toyz_settings.db, 'modules', user_id='user', module='json')
+    with pytest.raises(ToyzJobError):
+        core.get_toyz_module(toyz_settings, 'user', 'json')
+    assert module_checks == ['json', 'struct', 'json']
+
+def test_module_cache_db_changed(toyz_settings, module_checks):
+    core.get_toyz_module(toyz_settings, 'user', 'json')
+    # Permissions removed by another process (which cannot clear this process's cache)
+    db = sqlite3.connect(toyz_settings.db.path)
+    db.execute("delete from modules where module='json';")
+    db.commit()
+    db.close()
+    mtime = os.path.getmtime(toyz_settings.db.path)
+    os.utime(toyz_settings.db.path, (mtime+10, mtime+10))
+    with pytest.raises(ToyzJobError):
+        core.get_toyz_module(toyz_settings, 'user', 'json')
+
+def test_user_toy_cache(toyz_settings, tmpdir):
+    toy_path = tmpdir.mkdir('my_toy')
+    toy_path.join('tasks.py').write('value = 1\n')
+    db_utils.update_param(toyz_settings.db, 'toyz', user_id='user',
+        toyz={'my_toy': str(toy_path)})
+    toy = core.get_toyz_module(toyz_settings, 'user', 'my_toy.tasks')
+    assert toy.value == 1
+    assert core.get_toyz_module(toyz_settings, 'user', 'my_toy.tasks') is toy
+    # The toy is loaded again when its source changes
+    toy_path.join('tasks.py').write('value = 22\n')
+    assert core.get_toyz_module(toyz_settings, 'user', 'my_toy.tasks').value == 22
@@ -0,0 +1,81 @@
+from __future__ import print_function, division
+import os
+
+import numpy as np
+import pytest
+
+from toyz.web import compressed
+from toyz.web import frame_stats
+from toyz.web import viewer
+
+@pytest.fixture
+def compressed_path(tmpdir):
+    """
+    Path of a 2048x1024 tile compressed FITS image with one compression tile per row
+    """
+    from astropy.io import fits
+    data = np.random.RandomState(2).normal(100, 10, (2048, 1024)).astype(np.float32)
+    hdulist = fits.HDUList([fits.PrimaryHDU(),
+        fits.CompImageHDU(data, compression_type='GZIP_1', tile_shape=(1, 1024))])
+    filepath = os.path.join(str(tmpdir), 'compressed.fits')
+    hdulist.writeto(filepath)
+    return filepath
+
+def test_sample(web_settings, fits_path):
+    web_settings()
+    data = viewer.get_frame_data({'filepath': fits_path, 'ext': 'fits'}, '0')
+    sample = frame_stats.get_sample(data, 10000)
+    assert 8000 <= sample.size <= 10000
+    assert np.all(np.isfinite(sample))
+
+def test_compressed_sample(web_settings, compressed_path):
+    """
+    Sampling a tile compressed image only decompresses a bounded number of blocks
+    """
+    web_settings()
+    data = viewer.get_frame_data({'filepath': compressed_path, 'ext': 'fits'}, '1')
+    assert isinstance(data, compressed.CompressedSection)
+    assert data.block_rows==256
+    block_cache = compressed.get_block_cache()
+    sample = frame_stats.get_sample(data, 500000)
+    # Each block has 256x1024 pixels, so two blocks (out of 8) are needed
+    assert block_cache.get_stats()['misses']==2
+    assert sample.size==2*256*1024
+    assert np.mean(sample)==pytest.approx(100, abs=0.5)
+    block_cache.clear()
+    frame_stats.get_sample(data, 1000)
+    assert block_cache.get_stats()['misses']==3
+
+def test_frame_stats(web_settings, fits_path):
+    web_settings(stats_sample_size=2000000)
+    file_info = {'filepath': fits_path, 'ext': 'fits'}
+    data = viewer.get_frame_data(file_info, '0')
+    stats = frame_stats.get_frame_stats(file_info, '0', data)
+    assert stats['exact']
+    values = np.asarray(data)
+    values = values[np.isfinite(values)]
+    assert stats['min']==pytest.approx(values.min())
+    assert stats['max']==pytest.approx(values.max())
+    assert stats['percentiles']['50']==pytest.approx(np.median(values))
+    assert frame_stats.get_frame_stats(file_info, '0', data) is stats
+
+def test_frame_stats_cache(web_settings, fits_path, monkeypatch):
+    """
+    Statistics are stored for at most ``max_frame_stats`` frames and removed when their
+    file is closed
+    """
+    from toyz.web import session_vars
+    from toyz.web.file_cache import get_file_cache
+    web_settings()
+    monkeypatch.setattr(frame_stats, 'max_frame_stats', 2)
+    file_info = {'filepath': fits_path, 'ext': 'fits'}
+    data = viewer.get_frame_data(file_info, '0')
+    for frame in ['a', 'b', 'c']:
+        frame_stats.get_frame_stats(file_info, frame, data[:100, :100])
+    mtime = os.path.getmtime(fits_path)
+    assert list(session_vars.frame_stats)==[(fits_path, 'b', mtime), (fits_path, 'c', mtime)]
+    frame_stats.get_frame_stats(file_info, 'b', data[:100, :100])
+    frame_stats.get_frame_stats(file_info, 'a', data[:100, :100])
+    assert list(session_vars.frame_stats)==[(fits_path, 'b', mtime), (fits_path, 'a', mtime)]
+    get_file_cache().clear()
+    assert len(session_vars.frame_stats)==0
@@ -0,0 +1,91 @@
+from __future__ import print_function, division
+import os
+
+import numpy as np
+import pytest
+
+from toyz.web import integral
+from toyz.web import session_vars
+from toyz.web import viewer
+from toyz.web.file_cache import get_file_cache
+
+@pytest.fixture
+def cube_path(tmpdir):
+    """
+    Path of a FITS file with two 200x300 image extensions
+    """
+    from astropy.io import fits
+    random = np.random.RandomState(1)
+    hdulist = fits.HDUList([fits.PrimaryHDU()]+
+        [fits.ImageHDU(random.normal(10, 2, (200, 300))) for n in range(2)])
+    filepath = os.path.join(str(tmpdir), 'frames.fits')
+    hdulist.writeto(filepath)
+    return filepath
+
+def get_table(filepath, frame):
+    file_info = {'filepath': filepath, 'ext': 'fits'}
+    data = viewer.get_frame_data(file_info, frame)
+    return integral.get_integral_image(file_info, frame, data), data
+
+def test_region_stats(web_settings, cube_path):
+    web_settings(integral_images=True)
+    table, data = get_table(cube_path, '1')
+    data = np.array(data)
+    data[20:30, 40:45] = np.nan
+    table = integral.IntegralImage(cube_path, data)
+    for x0, y0, xf, yf in [(0, 0, 300, 200), (35, 15, 60, 50), (-10, 190, 5, 400)]:
+        expected = integral.calculate_region_stats(data, x0, y0, xf, yf)
+        stats = table.get_stats(x0, y0, xf, yf)
+        assert stats['npix']==expected['npix']
+        assert stats['nan_count']==expected['nan_count']
+        for key in ['sum', 'mean', 'std_dev']:
+            assert stats[key]==pytest.approx(expected[key], rel=1e-9, abs=1e-9)
+
+def test_disabled(web_settings, cube_path):
+    web_settings(integral_images=False)
+    table, data = get_table(cube_path, '1')
+    assert table is None
+
+def test_frames_are_kept(web_settings, cube_path):
+    """
+    Alternating between the frames of a file must not rebuild the tables
+    """
+    web_settings(integral_images=True)
+    table1, data = get_table(cube_path, '1')
+    table2, data = get_table(cube_path, '2')
+    assert table1 is not table2
+    for n in range(3):
+        assert get_table(cube_path, '1')[0] is table1
+        assert get_table(cube_path, '2')[0] is table2
+    assert len(session_vars.integral_images)==2
+
+def test_modified_file(web_settings, cube_path):
+    """
+    Tables for older versions of a file are removed
+    """
+    web_settings(integral_images=True)
+    table1, data = get_table(cube_path, '1')
+    stat = os.stat(cube_path)
+    os.utime(cube_path, (stat.st_atime, stat.st_mtime+10))
+    table2, data = get_table(cube_path, '1')
+    assert table2 is not table1
+    assert list(session_vars.integral_images)==[(cube_path, '1', stat.st_mtime+10)]
+
+def test_lru_and_file_cache_size(web_settings, cube_path, monkeypatch):
+    web_settings(integral_images=True)
+    monkeypatch.setattr(integral, 'max_integral_images', 1)
+    file_cache = get_file_cache()
+    file_info = {'filepath': cube_path, 'ext': 'fits'}
+    data1 = viewer.get_frame_data(file_info, '1')
+    data2 = viewer.get_frame_data(file_info, '2')
+    data_size = file_cache.size
+    table1 = integral.get_integral_image(file_info, '1', data1)
+    assert file_cache.size==data_size+table1.get_size()
+    table2 = integral.get_integral_image(file_info, '2', data2)
+    # The least recently used table is removed and no longer counts against the cache
+    assert list(session_vars.integral_images)==[
+        (cube_path, '2', os.path.getmtime(cube_path))]
+    assert file_cache.size==data_size+table2.get_size()
+    # Closing the file removes its tables
+    file_cache.clear()
+    assert len(session_vars.integral_images)==0
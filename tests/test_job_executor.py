@@ -0,0 +1,153 @@
+from __future__ import division
+import threading
+import time
+import pytest
+
+from toyz.utils import core
+from toyz.web import job_executor
+
+class Pipe:
+    """
+    Pipe that stores the results sent by an executor
+    """
+    def __init__(self):
+        self.results = []
+
+    def send(self, result):
+        self.results.append(result)
+
+    def wait_for(self, count, timeout=5):
+        end = time.time()+timeout
+        while len(self.results)<count and time.time()<end:
+            time.sleep(.005)
+        assert len(self.results) >= count
+        return self.results
+
+class Jobs:
+    """
+    Replacement for ``core.run_job`` that records the jobs that are run. Jobs with a
+    ``request_id`` in ``blocked`` wait until the request is released.
+    """
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self.cancelled = []
+        self.blocked = {}
+
+    def block(self, request_id):
+        self.blocked[request_id] = threading.Event()
+
+    def release(self, request_id):
+        self.blocked[request_id].set()
+
+    def run_job(self, toyz_settings, pipe, job):
+        request_id = job['id']['request_id']
+        self.started.append(request_id)
+        if request_id in self.blocked:
+            assert self.blocked[request_id].wait(5)
+        if core.job_cancelled(job['id']):
+            self.cancelled.append(request_id)
+        self.finished.append(request_id)
+        return core.build_result(job['id'], {'id': 'done', 'params': job['parameters']})
+
+@pytest.fixture
+def jobs(monkeypatch):
+    jobs = Jobs()
+    monkeypatch.setattr(core, 'run_job', jobs.run_job)
+    return jobs
+
+def get_job(request_id, task='get_img_data', **params):
+    return {
+        'id': {'user_id': 'admin', 'session_id': 's', 'request_id': request_id},
+        'module': 'toyz.web.tasks',
+        'task': task,
+        'parameters': params
+    }
+
+def wait_until(condition, timeout=5):
+    end = time.time()+timeout
+    while not condition() and time.time()<end:
+        time.sleep(.005)
+    assert condition()
+
+def test_get_job_lane():
+    assert job_executor.get_job_lane(get_job(1)) is None
+    assert job_executor.get_job_lane(get_job(1, viewer_id=3)) == ('admin', 's', 'viewer_id', '3')
+    assert job_executor.get_supersede_key(get_job(1, viewer_id=3)) is None
+    assert job_executor.get_supersede_key(get_job(1, 'update_viewport', src_id=3)) is None
+    assert job_executor.get_supersede_key(get_job(1, 'update_viewport', viewer_id=3)) == (
+        'admin', 's', 'viewer_id', '3', 'toyz.web.tasks', 'update_viewport')
+
+def test_lanes(jobs):
+    pipe = Pipe()
+    executor = job_executor.JobExecutor(pipe, 4)
+    jobs.block(1)
+    executor.submit(None, get_job(1, viewer_id=1))
+    wait_until(lambda: jobs.started==[1])
+    # Jobs in other lanes run while the lane is busy
+    executor.submit(None, get_job(2, viewer_id=1))
+    executor.submit(None, get_job(3, viewer_id=2))
+    executor.submit(None, get_job(4))
+    pipe.wait_for(2)
+    assert sorted(jobs.finished) == [3, 4]
+    assert 2 not in jobs.started
+    jobs.release(1)
+    pipe.wait_for(4)
+    assert jobs.finished.index(2) > jobs.finished.index(1)
+    assert all([result['job_finished'] for result in pipe.results])
+    executor.close(1)
+
+def test_supersede(jobs):
+    pipe = Pipe()
+    executor = job_executor.JobExecutor(pipe, 2)
+    jobs.block(1)
+    executor.submit(None, get_job(1, 'update_viewport', viewer_id=1))
+    wait_until(lambda: jobs.started==[1])
+    executor.submit(None, get_job(2, 'update_viewport', viewer_id=1,
+        file_info='file', img_info='img', viewer='a'))
+    # A job for a different task in the same lane is not superseded
+    executor.submit(None, get_job(3, 'get_img_data', viewer_id=1))
+    executor.submit(None, get_job(4, 'update_viewport', viewer_id=1, viewer='b'))
+    # The queued job is cancelled and its viewer registration moved to the newest job
+    results = pipe.wait_for(1)
+    assert results[0]['id']['request_id'] == 2
+    assert results[0]['response'] == {'id': 'cancelled', 'request_id': 2}
+    jobs.release(1)
+    results = pipe.wait_for(4)
+    assert jobs.started == [1, 3, 4]
+    # The running job was flagged as cancelled
+    assert jobs.cancelled == [1]
+    params = [result['response']['params'] for result in results
+        if result['id']['request_id']==4][0]
+    assert params == {'viewer_id': 1, 'file_info': 'file', 'img_info': 'img', 'viewer': 'b'}
+    executor.close(1)
+
+def test_cancel(jobs):
+    pipe = Pipe()
+    executor = job_executor.JobExecutor(pipe, 1)
+    jobs.block(1)
+    executor.submit(None, get_job(1))
+    wait_until(lambda: jobs.started==[1])
+    executor.submit(None, get_job(2))
+    executor.submit(None, get_job(3))
+    executor.cancel('admin', 's', [1, 2])
+    assert pipe.wait_for(1)[0]['response']['id'] == 'cancelled'
+    jobs.release(1)
+    pipe.wait_for(3)
+    assert jobs.started == [1, 3]
+    assert jobs.cancelled == [1]
+    # Cancelled jobs are only flagged while they are running
+    wait_until(lambda: len(core.session_vars.cancelled_jobs)==0)
+    executor.close(1)
+
+def test_merge_superseded():
+    job = get_job(3, 'update_viewport', viewer_id=1)
+    job_executor.merge_superseded(job, [
+        get_job(1, img_info='old', file_info='old'),
+        get_job(2, img_info='new', file_info='new', loaded=[]),
+        get_job(4)])
+    assert job['parameters'] == {'viewer_id': 1, 'img_info': 'new', 'file_info': 'new',
+        'loaded': []}
+    job = get_job(5, img_info='own')
+    job_executor.merge_superseded(job, [get_job(2, img_info='new', file_info='new')])
+    assert job['parameters'] == {'img_info': 'own'}
@@ -0,0 +1,65 @@
+from __future__ import division
+import numpy as np
+import pytest
+
+from toyz.web import pyramid
+from toyz.web import session_vars
+
+@pytest.mark.parametrize('scale, level', [(2, 0), (1, 0), (.75, 0), (.5, 1), (.3, 1),
+    (.25, 2), (.1, 3), (1/64, 6), (0, 0)])
+def test_get_level_number(scale, level):
+    assert pyramid.get_level_number(scale) == level
+
+def test_downsample():
+    data = np.arange(6*5, dtype=np.float32).reshape(6, 5)
+    data[0,0] = np.nan
+    data[2:4,2:4] = np.nan
+    level = pyramid.downsample(data, block_rows=1)
+    assert level.shape == (3, 2)
+    # NaN pixels are ignored and blocks where every pixel is NaN stay NaN
+    assert level[0,0] == (1+5+6)/3
+    assert level[0,1] == (2+3+7+8)/4
+    assert np.isnan(level[1,1])
+    assert level[2,0] == (20+21+25+26)/4
+
+def test_get_level(web_settings):
+    data = np.random.RandomState(1).rand(400, 600).astype(np.float32)
+    file_info = {'filepath': 'image.fits', 'resampling': 'NEAREST'}
+    img_info = {'frame': 0, 'width': 600, 'height': 400, 'scale': .3}
+    level_data, level_info = pyramid.get_level(file_info, img_info, data)
+    assert level_info['pyramid_level'] == 1
+    assert level_data.shape == (200, 300)
+    assert (level_info['width'], level_info['height']) == (300, 200)
+    assert level_info['scale'] == pytest.approx(.6)
+    assert img_info['scale'] == .3
+    np.testing.assert_allclose(level_data, pyramid.downsample(data))
+    # Levels are only built once
+    assert pyramid.get_level(file_info, img_info, data)[0] is level_data
+    # MAX and MEDIAN use the full resolution image
+    file_info['resampling'] = 'MAX'
+    assert pyramid.get_level(file_info, img_info, data)[0] is data
+    file_info['resampling'] = 'NEAREST'
+    web_settings(image_pyramid=False)
+    assert pyramid.get_level(file_info, img_info, data) == (data, img_info)
+
+def test_get_level_tile():
+    tile_info = {'x0_idx': 100, 'xf_idx': 301, 'y0_idx': 30, 'yf_idx': 90, 'idx': 'a'}
+    level_info = {'pyramid_level': 2, 'width': 70, 'height': 100}
+    level_tile = pyramid.get_level_tile(level_info, tile_info)
+    assert (level_tile['x0_idx'], level_tile['xf_idx']) == (25, 70)
+    assert (level_tile['y0_idx'], level_tile['yf_idx']) == (7, 23)
+    assert level_tile['idx'] == 'a'
+    assert tile_info['x0_idx'] == 100
+    assert pyramid.get_level_tile({'pyramid_level': 0}, tile_info) is tile_info
+
+def test_pyramid_lru(web_settings, monkeypatch):
+    monkeypatch.setattr(pyramid, 'max_pyramids', 2)
+    data = np.zeros((4, 4), dtype=np.float32)
+    pyramids = [pyramid.get_pyramid({'filepath': 'image.fits'}, frame, data)
+        for frame in range(3)]
+    assert list(session_vars.pyramids) == [('image.fits', '1'), ('image.fits', '2')]
+    assert pyramid.get_pyramid({'filepath': 'image.fits'}, 2, data) is pyramids[2]
+    pyramid.clear_pyramids('other.fits')
+    assert len(session_vars.pyramids) == 2
+    pyramid.clear_pyramids('image.fits')
+    assert len(session_vars.pyramids) == 0
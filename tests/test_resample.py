@@ -0,0 +1,62 @@
+from __future__ import division
+import numpy as np
+import pytest
+
+from toyz.web import resample
+
+def dense_mean(data, shape):
+    """
+    Reference mean using the full matrix of area weights along each axis
+    """
+    def weights(size_in, size_out):
+        edges = np.arange(size_out+1)*(size_in/size_out)
+        idx = np.arange(size_in)
+        lower = np.maximum(edges[:-1,None], idx[None,:])
+        upper = np.minimum(edges[1:,None], idx[None,:]+1)
+        return np.clip(upper-lower, 0, None)
+    y_weights = weights(data.shape[0], shape[0])
+    x_weights = weights(data.shape[1], shape[1]).T
+    valid = np.isfinite(data)
+    values = np.dot(np.dot(y_weights, np.where(valid, data, 0)), x_weights)
+    counts = np.dot(np.dot(y_weights, valid.astype(float)), x_weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts>0, values/counts, np.nan)
+
+@pytest.fixture
+def data():
+    return np.random.RandomState(3).normal(100, 10, (300, 457)).astype(np.float32)
+
+@pytest.mark.parametrize('shape', [(150, 457), (100, 100), (199, 301), (7, 5), (1, 1),
+    (300, 228)])
+def test_reduce_mean(data, shape):
+    result = resample.reduce_mean(data, shape)
+    assert result.shape == shape
+    np.testing.assert_allclose(result, dense_mean(data, shape), rtol=1e-5)
+
+@pytest.mark.parametrize('shape', [(150, 200), (101, 97), (30, 40)])
+def test_reduce_mean_nan(data, shape):
+    data[50:80, 100:180] = np.nan
+    data[::17, ::23] = np.inf
+    result = resample.reduce_mean(data, shape)
+    expected = dense_mean(data, shape)
+    assert np.array_equal(np.isnan(result), np.isnan(expected))
+    assert np.isnan(result).any()
+    np.testing.assert_allclose(result, expected, rtol=1e-5)
+
+def test_area_sum():
+    values = np.arange(10, dtype=np.float32)[:,None]
+    # Each output pixel covers 10/4=2.5 input pixels
+    sums = resample.area_sum(values, 4, 0)
+    np.testing.assert_allclose(sums[:,0], [0+1+1, 1+3+4, 5+6+3.5, 3.5+8+9])
+    np.testing.assert_allclose(resample.area_sum(values.T, 4, 1), sums.T)
+    assert sums.sum() == values.sum()
+
+@pytest.mark.parametrize('method', resample.methods)
+def test_block_reduce(data, method):
+    assert resample.block_reduce(data, (120, 170), method).shape == (120, 170)
+    rgb = np.dstack([data, data, data])
+    result = resample.block_reduce(rgb, (120, 170), method)
+    assert result.shape == (120, 170, 3)
+    np.testing.assert_allclose(result[:,:,1], resample.block_reduce(data, (120, 170), method))
+    # The output is never larger than the input
+    assert resample.block_reduce(data, (600, 900), method).shape == data.shape
@@ -0,0 +1,48 @@
+from __future__ import print_function, division
+import multiprocessing
+import pickle
+
+import numpy as np
+
+from toyz.web import session_pool
+from toyz.web import session_vars
+from conftest import Settings
+
+def start_worker(**web_settings):
+    pipe, remote_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=session_pool.worker_process,
+        args=(0, remote_pipe, pipe))
+    process.start()
+    remote_pipe.close()
+    pipe.send({'toyz_settings': Settings(**web_settings)})
+    return pipe, process
+
+def export_session(pipe, session):
+    pipe.send({
+        'import_session': session.session_id,
+        'session': pickle.dumps(session, pickle.HIGHEST_PROTOCOL)
+    })
+    pipe.send({'export_session': session.session_id})
+    assert pipe.poll(30)
+    return pipe.recv()
+
+def test_export_session():
+    pipe, process = start_worker(session_move_size=1)
+    try:
+        session = session_vars.Session(('user', 'small'))
+        session.data_sources['src'] = np.zeros(1000)
+        result = export_session(pipe, session)
+        assert result['session_state']==('user', 'small')
+        assert result['moved']
+        moved = pickle.loads(result['session'])
+        assert np.array_equal(moved.data_sources['src'], session.data_sources['src'])
+        # Sessions larger than session_move_size stay on the worker
+        session = session_vars.Session(('user', 'large'))
+        session.data_sources['src'] = np.zeros(1024*1024)
+        result = export_session(pipe, session)
+        assert not result['moved']
+        assert result['session'] is None
+    finally:
+        pipe.close()
+        process.join(30)
+    assert process.exitcode==0
@@ -0,0 +1,26 @@
+from __future__ import division
+
+from conftest import get_viewer_info
+from toyz.web import tasks
+from toyz.web import viewer
+
+def test_get_img_tiles_stream(web_settings, fits_path, tmpdir):
+    file_info, img_info, tiles = get_viewer_info(fits_path, 1, str(tmpdir))
+    tid = {'user_id': 'admin', 'session_id': 's', 'request_id': 1}
+    response = tasks.get_img_tiles(web_settings(), tid, {
+        'file_info': file_info,
+        'img_info': img_info,
+        'tiles': tiles,
+        'stream': True
+    })
+    assert response['id'] == 'tiles created'
+    assert set(response['tiles']) == set(tiles)
+    frames = dict([(header['idx'], (header, tile))
+        for header, tile in response['binary_frames']])
+    assert set(frames) == set(tiles)
+    encoded = viewer.encode_tiles(file_info, img_info, tiles)
+    for tile_idx, (header, tile) in frames.items():
+        assert header['id'] == 'tile'
+        assert (header['row'], header['col']) == (tiles[tile_idx]['row'], tiles[tile_idx]['col'])
+        assert header['format'] == file_info['tile_format']
+        assert tile == encoded[tile_idx]
@@ -0,0 +1,75 @@
+from __future__ import division
+import os
+
+from conftest import get_viewer_info
+from toyz.web import tile_cache
+from toyz.web import tile_store
+from toyz.web import viewer
+
+def test_tile_cache_lru():
+    cache = tile_cache.TileCache(10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'
+    # 'b' is the least recently used tile
+    cache.set('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    assert cache.get('c') == b'1234'
+    # Tiles larger than the cache are not stored
+    cache.set('d', b'x'*11)
+    assert cache.get('d') is None
+    stats = cache.get_stats()
+    assert stats['size'] == 8
+    assert stats['tiles'] == 2
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+
+def test_tile_store_quota(tmpdir):
+    store = tile_store.TileStore(str(tmpdir.join('store')), 1000)
+    tile_keys = [('image.fits', n) for n in range(6)]
+    for n, tile_key in enumerate(tile_keys[:5]):
+        store.set(tile_key, b'x'*200)
+        # The last access time of a tile decides which tiles are removed
+        os.utime(store.get_tile_path(tile_key), (n, n))
+    assert store.get_stats()['size'] == 1000
+    assert store.get(tile_keys[0]) == b'x'*200
+    # The store is full, so the least recently used tiles are removed until it is 90% full
+    store.set(tile_keys[5], b'x'*200)
+    assert store.get_stats()['size'] == 800
+    assert store.get(tile_keys[1]) is None
+    assert store.get(tile_keys[2]) is None
+    for n in [0, 3, 4, 5]:
+        assert store.get(tile_keys[n]) == b'x'*200
+
+def test_tile_key_file_stat(web_settings, fits_path, tmpdir):
+    file_info, img_info, tiles = get_viewer_info(fits_path, 1, str(tmpdir))
+    tile_info = list(tiles.values())[0]
+    tile_key = viewer.get_tile_key(file_info, img_info, tile_info)
+    file_stat = os.stat(fits_path)
+    assert viewer.get_tile_key(file_info, img_info, tile_info, file_stat) == tile_key
+    os.utime(fits_path, (file_stat.st_atime, file_stat.st_mtime+10))
+    assert viewer.get_tile_key(file_info, img_info, tile_info) != tile_key
+
+def test_iter_tiles_stats_once(web_settings, fits_path, tmpdir, monkeypatch):
+    file_info, img_info, tiles = get_viewer_info(fits_path, 1, str(tmpdir))
+    assert len(tiles) > 1
+    created, encoded = viewer.create_tiles(file_info, img_info, tiles, stream=True)
+    assert set(encoded) == set(tiles)
+    stats = []
+    os_stat = os.stat
+    def count_stat(path, *args, **kwargs):
+        if path==fits_path:
+            stats.append(path)
+        return os_stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', count_stat)
+    # The image is checked the same number of times for one tile as for all of the tiles
+    tile_idx = list(tiles)[0]
+    viewer.create_tiles(file_info, img_info, {tile_idx: tiles[tile_idx]}, stream=True)
+    one_tile = len(stats)
+    del stats[:]
+    hits = tile_cache.get_tile_cache().get_stats()['hits']
+    assert viewer.create_tiles(file_info, img_info, tiles, stream=True)[1] == encoded
+    assert len(stats) == one_tile
+    assert tile_cache.get_tile_cache().get_stats()['hits'] == hits+len(tiles)
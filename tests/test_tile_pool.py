@@ -0,0 +1,37 @@
+from __future__ import print_function, division
+
+import pytest
+
+from toyz.web import tile_pool
+from toyz.web import viewer
+from conftest import get_viewer_info
+
+@pytest.mark.parametrize('scale', [0.5, 0.3, 0.25, 0.1])
+@pytest.mark.parametrize('resampling', ['NEAREST', 'MEAN'])
+def test_pool_matches_render_tiles(web_settings, fits_path, tmpdir, scale, resampling):
+    """
+    Tiles rendered by the tile pool from a shared pyramid level must be identical to the
+    tiles rendered in the session's process
+    """
+    toyz_settings = web_settings(tile_workers=2)
+    tile_pool.start_tile_pool(toyz_settings)
+    file_info, img_info, tiles = get_viewer_info(fits_path, scale, str(tmpdir))
+    file_info['resampling'] = resampling
+    assert len(tiles)>1
+    direct = viewer.encode_tiles(file_info, img_info, tiles)
+    pooled = {}
+    for encoded in tile_pool.iter_encoded_tiles(file_info, img_info, tiles):
+        pooled.update(encoded)
+    assert sorted(pooled)==sorted(direct)
+    for tile_idx in direct:
+        assert pooled[tile_idx]==direct[tile_idx]
+    # The tiles were rendered from a pyramid level shared with the workers
+    assert len(tile_pool.shared_levels)==1
+
+def test_split_tiles():
+    tiles = {'{0},{1}'.format(col, row): {'col': col, 'row': row}
+        for col in range(3) for row in range(3)}
+    chunks = tile_pool.split_tiles(tiles, 4)
+    assert len(chunks)==3
+    assert sorted(idx for chunk in chunks for idx in chunk)==sorted(tiles)
+    assert sorted(chunks[0])==['0,0', '1,0', '2,0']
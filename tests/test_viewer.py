@@ -0,0 +1,72 @@
+from __future__ import division
+import sys
+import numpy as np
+import pytest
+
+from toyz.web import viewer
+from toyz.utils.errors import ToyzJobError
+
+def test_scale_data_without_scipy(monkeypatch):
+    # Importing a module set to None in sys.modules raises an ImportError
+    monkeypatch.setitem(sys.modules, 'scipy.ndimage', None)
+    data = np.arange(100*200, dtype=np.float32).reshape(100, 200)
+    file_info = {'resampling': 'NEAREST', 'tile_width': 64, 'tile_height': 64}
+    img_info = {'scale': 0.5, 'width': 200, 'height': 100}
+    tile_info = {'x0_idx': 0, 'xf_idx': 128, 'y0_idx': 0, 'yf_idx': 100}
+    tile = viewer.scale_data(file_info, img_info, tile_info, data)
+    assert tile.shape == (49, 64)
+    assert tile[0,0] == data[0,0]
+    assert tile[-1,-1] == data[99,128]
+
+def decode_region(header, payload):
+    """
+    Convert a binary region back into pixel values (the same way as the client)
+    """
+    values = np.frombuffer(payload, dtype='<'+np.dtype(header['dtype']).str[1:])
+    values = values.reshape(header['shape']).astype(np.float64)
+    if 'nan_value' in header:
+        nan_pixels = values==header['nan_value']
+        values = header['offset']+header['scale']*values
+        values[nan_pixels] = np.nan
+    return values
+
+def get_region():
+    data = np.random.RandomState(2).normal(50, 5, (30, 40))
+    data[3:6, 10:20] = np.nan
+    data[0,0] = np.inf
+    return data
+
+def test_get_region_stats():
+    data = get_region()
+    values = data[np.isfinite(data)]
+    stats = viewer.get_region_stats(data)
+    assert stats['min'] == values.min()
+    assert stats['max'] == values.max()
+    assert stats['median'] == np.median(values)
+    np.testing.assert_allclose(stats['mean'], values.mean())
+    np.testing.assert_allclose(stats['std_dev'], values.std())
+    assert viewer.get_region_stats(np.array([np.nan]))['mean'] == 0
+
+@pytest.mark.parametrize('dtype', viewer.region_dtypes)
+def test_encode_region(dtype):
+    data = get_region()
+    stats = viewer.get_region_stats(data)
+    header, payload = viewer.encode_region(data, dtype, stats)
+    assert header['id'] == 'data'
+    assert header['shape'] == [30, 40]
+    assert header['byteorder'] == 'little'
+    assert len(payload) == data.size*np.dtype(dtype).itemsize
+    values = decode_region(header, payload)
+    finite = np.isfinite(data)
+    if dtype.startswith('float'):
+        assert np.array_equal(values[finite], data[finite].astype(dtype))
+        assert np.isinf(values[0,0])
+    else:
+        # Quantized values are within half a step of the pixel values
+        assert header['nan_value'] == np.iinfo(dtype).max
+        assert np.abs(values[finite]-data[finite]).max() <= header['scale']/2+1e-9
+        assert np.array_equal(np.isnan(values), ~finite)
+
+def test_encode_region_errors():
+    with pytest.raises(ToyzJobError):
+        viewer.encode_region(get_region(), 'int32', {'min': 0, 'max': 1})
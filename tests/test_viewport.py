@@ -0,0 +1,55 @@
+from __future__ import division
+
+from conftest import get_viewer_info
+from toyz.web import viewport
+
+def move(viewer, dx, dy):
+    """
+    Position of a viewer moved by ``dx`` and ``dy`` pixels
+    """
+    viewer = dict(viewer)
+    for key in ['x_center', 'left', 'right']:
+        viewer[key] += dx
+    for key in ['y_center', 'top', 'bottom']:
+        viewer[key] += dy
+    return viewer
+
+def test_viewport_update(web_settings, fits_path, tmpdir):
+    file_info, img_info, tiles = get_viewer_info(fits_path, 1, str(tmpdir),
+        width=256, height=256, tile_size=64)
+    viewer = img_info['viewer']
+    view = viewport.Viewport(file_info, dict(img_info, viewer=dict(viewer)))
+    entered, left = view.update(viewer)
+    assert set(entered) == set([tuple(int(n) for n in idx.split(','))
+        for idx in tiles])
+    assert left == []
+    # Tiles are sent in row order
+    assert entered == sorted(entered, key=lambda tile: (tile[1], tile[0]))
+    # Nothing changes if the viewer has not moved
+    assert view.update(viewer) == ([], [])
+
+    # Move two tiles to the right
+    old_visible = view.visible
+    entered, left = view.update(move(viewer, 128, 0))
+    assert len(entered) > 0 and len(left) > 0
+    assert set(entered) == view.visible-old_visible
+    assert set(left) == old_visible-view.visible
+    assert min([col for col, row in entered]) > max([col for col, row in old_visible])
+    assert max([col for col, row in left]) < min([col for col, row in view.visible])
+
+    # Tiles that were already sent are not sent again when the viewer moves back
+    entered, left = view.update(viewer)
+    assert entered == []
+    assert len(left) > 0
+    # unless they were unloaded
+    view.unload(left)
+    assert sorted(view.update(move(viewer, 128, 0))[0]) == sorted(left)
+
+def test_viewport_loaded(web_settings, fits_path, tmpdir):
+    file_info, img_info, tiles = get_viewer_info(fits_path, 1, str(tmpdir),
+        width=256, height=256, tile_size=64)
+    view = viewport.Viewport(file_info, img_info, loaded=list(tiles))
+    entered, left = view.update(img_info['viewer'])
+    assert entered == []
+    assert set(view.get_tiles([(0, 0)])) == set(['0,0'])
+    assert viewport.flatten([(1, 2), (3, 4)]) == [1, 2, 3, 4]
@@ -15,6 +15,7 @@ except ImportError:
     import pickle
 from collections import OrderedDict
 import multiprocessing
+import threading
 
 from toyz.utils import db as db_utils
 from toyz.utils.errors import ToyzError, ToyzDbError, ToyzWebError, ToyzJobError, ToyzWarning
@@ -23,6 +24,13 @@ from toyz.web import session_vars
 # Path that toyz has been installed in
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),os.pardir))
 
+# Lock for the count of jobs running in a session
+job_lock = threading.Lock()
+
+# Modules resolved by get_toyz_module for each (user_id, module)
+module_cache = {}
+module_cache_lock = threading.Lock()
+
 # Default settings for a new toyz instance (these can be modified later through the web app)
 default_settings = {
     'config': {
@@ -39,6 +47,55 @@ default_settings = {
     'web': {
         'port': 8888,
         'cookie_secret': base64.b64encode(uuid.uuid4().bytes + uuid.uuid4().bytes),
+        # Maximum size (in MB) of the in-memory cache of encoded image tiles
+        'tile_cache_size': 256,
+        # Use downsampled image pyramids to render tiles when the viewer is zoomed out
+        'image_pyramid': True,
+        # Method used to read FITS images ('load', 'memmap' or 'section')
+        'fits_access': 'memmap',
+        # Send viewer tiles to the client as binary websocket messages instead of temp files
+        'stream_tiles': True,
+        # Number of worker processes used by each session to render tiles 
+        # (0 renders tiles in the session's job process)
+        'tile_workers': 0,
+        # Number of tiles around the viewer to prefetch (0 disables prefetching)
+        'prefetch_ring': 1,
+        # Prefetch the tiles for the next and previous zoom levels
+        'prefetch_zoom': True,
+        # Frames with more pixels than this use sampled statistics until the exact
+        # statistics have been calculated in the background
+        'stats_sample_size': 1000000,
+        # Maximum size (in MB) of the cache of decompressed blocks of tile compressed
+        # FITS images
+        'decompressed_cache_size': 256,
+        # Build summed-area tables (24 bytes per pixel) to calculate region statistics
+        # in constant time
+        'integral_images': False,
+        # Maximum size (in MB) of the decoded image data kept by each session's cache of
+        # open files, the maximum number of files kept open and the maximum number of
+        # frames (for example planes of a data cube) kept for each file
+        'file_cache_size': 512,
+        'file_cache_files': 8,
+        'file_cache_frames': 8,
+        # Maximum size (in MB) of the persistent tile store shared by all sessions
+        # (0 disables the tile store)
+        'tile_store_size': 0,
+        # Directory of the tile store (by default 'tile_store' in the Toyz root path)
+        'tile_store_path': '',
+        # Number of threads used to run the jobs from each session concurrently
+        # (1 runs jobs one at a time in the order they are received)
+        'job_workers': 4,
+        # Maximum number of worker processes shared by all of the sessions
+        # (0 starts a separate process for each session)
+        'session_workers': 0,
+        # Number of seconds every thread of a shared worker must be busy before a session
+        # sending a new job is moved to another worker (the session's files and tiles
+        # cached by its old worker are not moved)
+        'session_move_delay': 5,
+        # Maximum size (in MB) of the variables of a session moved to another worker.
+        # Sessions with larger variables (for example large data sources) are never moved,
+        # since their variables are sent through the application's event loop.
+        'session_move_size': 64,
         #'static_path': os.path.join(ROOT_DIR, 'web', 'static'),
         #'template_path': os.path.join(ROOT_DIR, 'web', 'templates'),
     },
@@ -198,6 +255,44 @@ def check4keys(myDict,keys):
     if error!="":
         raise ToyzError("Missing parameters: "+error)
 
+def get_setting(toyz_settings, section, key):
+    """
+    Get a setting from the application settings. Settings added in newer versions of Toyz
+    may not be present in a saved configuration, in which case the value from
+    ``default_settings`` is used.
+    
+    Parameters
+        - toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ): Settings for the 
+          application
+        - section (*string* ): Section of the settings (for example ``'web'`` )
+        - key (*string* ): Name of the setting
+    
+    Returns
+        - value: Value of the setting
+    """
+    if toyz_settings is not None and hasattr(toyz_settings, section):
+        settings = getattr(toyz_settings, section)
+        if hasattr(settings, key):
+            return getattr(settings, key)
+    return default_settings[section][key]
+
+def get_memory_usage():
+    """
+    Get the resident memory (in bytes) used by the current process. If psutil is not 
+    installed, the peak resident memory of the process is returned instead.
+    """
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        import resource
+        import platform
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on OSX and kB on linux
+        if platform.system() != 'Darwin':
+            rss *= 1024
+        return rss
+
 def is_number(str_in):
     """
     Check whether or not a string is a number
@@ -366,9 +461,9 @@ def get_all_user_toyz(toyz_settings, user_id):
     user_toyz.update(db_utils.get_param(toyz_settings.db, 'toyz', user_id=user_id))
     return user_toyz
 
-def get_user_toyz(toyz_settings, user_id, toy):
+def get_user_toyz_path(toyz_settings, user_id, toy):
     """
-    If a toy is contained in a users toyz paths, get the module and return it
+    If a toy is contained in a users toyz paths, get the path of its source file
     
     Parameters
         toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ):
@@ -378,23 +473,67 @@ def get_user_toyz(toyz_settings, user_id, toy):
         toy ( *string* ): name of the toy to search for
     
     Returns
-        toy ( *module* ): python module if it exists, otherwise ``None``.
+        path ( *string* ): path of the python source file if it exists, otherwise ``None``.
     """
     user_toyz = get_all_user_toyz(toyz_settings, user_id)
     if toy in user_toyz:
-        return imp.load_source(toy, user_toyz[toy])
+        return user_toyz[toy]
     elif toy.endswith('.tasks') and toy[:-6] in user_toyz:
-        return imp.load_source(toy, os.path.join(user_toyz[toy[:-6]], 'tasks.py'))
+        return os.path.join(user_toyz[toy[:-6]], 'tasks.py')
     elif toy.endswith('.config') and toy[:-7] in user_toyz:
-        return imp.load_source(toy, os.path.join(user_toyz[toy[:-7]],'config.py'))
+        return os.path.join(user_toyz[toy[:-7]],'config.py')
     return None
 
+def get_user_toyz(toyz_settings, user_id, toy):
+    """
+    If a toy is contained in a users toyz paths, get the module and return it
+    
+    Parameters
+        toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ):
+            - Settings for the application runnning the job (may be needed to load user info 
+              or check permissions)
+        user_id ( *string* ): id of the current user
+        toy ( *string* ): name of the toy to search for
+    
+    Returns
+        toy ( *module* ): python module if it exists, otherwise ``None``.
+    """
+    path = get_user_toyz_path(toyz_settings, user_id, toy)
+    if path is not None:
+        return imp.load_source(toy, path)
+    return None
+
+def get_file_version(path):
+    """
+    Get the modification time and size of a file (or ``None`` if the file does not exist),
+    used to check if a file has changed
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime, stat.st_size
+
+def clear_module_cache(user_id=None):
+    """
+    Remove the modules resolved for a user (or for all users if ``user_id`` is ``None`` )
+    from the module cache, for example when their permissions change
+    """
+    with module_cache_lock:
+        for key in list(module_cache):
+            if user_id is None or key[0]==user_id:
+                del module_cache[key]
+
 def get_toyz_module(toyz_settings, user_id, module):
     """
     Get a toyz module from either installed modules or one in a users toyz paths.
     An uninstalled toy will take precedence if it is in the toy paths as opposed to installed
     modules.
     
+    Resolved modules are cached for each user, so the database is only read and a toy's
+    source is only loaded again when the database (where permissions are stored), the
+    toy's source file or the application settings change.
+    
     Parameters
         toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ):
             - Settings for the application runnning the job (may be needed to load user info 
@@ -409,13 +548,28 @@ def get_toyz_module(toyz_settings, user_id, module):
         Raises a :py:class:`toyz.utils.errors.ToyzJobError` if the module is not found
         in the users approved modules
     """
-    toyz_module = get_user_toyz(toyz_settings, user_id, module)
-    if toyz_module is not None:
-        return toyz_module
-    if toyz_module is None and check_user_modules(toyz_settings, user_id, module):
-        return importlib.import_module(module)
+    key = (user_id, module)
+    db_version = get_file_version(getattr(toyz_settings.db, 'path', None))
+    with module_cache_lock:
+        cached = module_cache.get(key, None)
+    if cached is not None:
+        toyz_module, settings, cached_db_version, path, source_version = cached
+        if (settings is toyz_settings and cached_db_version==db_version and
+                (path is None or get_file_version(path)==source_version)):
+            return toyz_module
+    
+    path = get_user_toyz_path(toyz_settings, user_id, module)
+    if path is not None:
+        source_version = get_file_version(path)
+        toyz_module = imp.load_source(module, path)
+    elif check_user_modules(toyz_settings, user_id, module):
+        source_version = None
+        toyz_module = importlib.import_module(module)
     else:
         raise ToyzJobError(module+" not found in " +user_id+"'s approved modules")
+    with module_cache_lock:
+        module_cache[key] = (toyz_module, toyz_settings, db_version, path, source_version)
+    return toyz_module
 
 def run_job(toyz_settings, pipe, job):
     """
@@ -435,7 +589,8 @@ def run_job(toyz_settings, pipe, job):
             - Settings for the application runnning the job (may be needed to load user info 
               or check permissions)
         pipe: *multiprocessing.Pipe*
-            - Communication with the parent process.
+            - Communication with the parent process (or any object with a ``send`` method,
+              for example a :py:class:`toyz.web.job_executor.JobExecutor` ).
             - It may be useful to pass progress notifications to a client as a job
               is run. To send a notifaction the pipe requires a dictionary that is of the
               same form as the result (see Returns below), but usually with 
@@ -462,6 +617,13 @@ def run_job(toyz_settings, pipe, job):
               the key **id**, which is used by the client to identify the type of response it is 
               receiving. Including the key **request_completed** with a *True* value tells the
               client that the current request has finished and may be removed from the queue.
+            - A task may also include the key **binary_frames** in its response, a list of 
+              ``(header, payload)`` tuples that are sent to the client as binary websocket
+              messages (see :py:func:`toyz.utils.core.encode_binary_frame` ) before
+              the response.
+            - A task may also include the key **update_app** , a list of attributes of the
+              application that the task changed (see 
+              :py:meth:`toyz.web.app.ToyzWebApp.update` ), so that the application reloads them.
     
     Example
     
@@ -515,6 +677,11 @@ def run_job(toyz_settings, pipe, job):
     import traceback
     session_vars.toyz_settings = toyz_settings
     session_vars.pipe = pipe
+    session_vars.set_session((job['id']['user_id'], job['id']['session_id']))
+    # Let background work in the session (for example prefetching tiles) know a job is running.
+    # Several jobs from the same session may run at once (see :py:mod:`toyz.web.job_executor` )
+    with job_lock:
+        session_vars.jobs_running = getattr(session_vars, 'jobs_running', 0)+1
     response={}
     try:
         try:
@@ -540,18 +707,97 @@ def run_job(toyz_settings, pipe, job):
             'traceback':traceback.format_exc()
         }
         print(traceback.format_exc())
+    with job_lock:
+        session_vars.jobs_running -= 1
+    result = build_result(job['id'], response)
+    
+    #logging.info("sent message:%r",response['id'])
+    return result
+
+def build_result(job_id, response):
+    """
+    Build the result sent from a job process to the application for a given ``response``
+    (see :py:func:`toyz.utils.core.run_job` ).
+    
+    Parameters
+        - job_id (*dict* ): ``id`` of the job that created the response
+        - response (*dict* ): Response sent to the client
+    
+    Returns
+        - result (*dict* ): Result with the keys ``id``, ``response`` and ``binary_frames``
+          (and ``update_app`` if the job changed properties of the application)
+    """
+    # Attributes of the application changed by the job are not sent to the client
+    update_app = response.pop('update_app', [])
+    # Binary messages are sent to the client separately from the JSON response
+    binary_frames = []
+    if 'binary_frames' in response:
+        for header, payload in response.pop('binary_frames'):
+            header['request_id'] = job_id['request_id']
+            binary_frames.append(encode_binary_frame(header, payload))
     if response != {}:
-        response['request_id'] = job['id']['request_id']
-        #self.write_message(response)
+        response['request_id'] = job_id['request_id']
     
     result = {
-        'id': job['id'],
+        'id': job_id,
         'response': response,
+        'binary_frames': binary_frames
     }
-    
-    #logging.info("sent message:%r",response['id'])
+    if len(update_app)>0:
+        result['update_app'] = update_app
     return result
 
+def send_response(job_id, response):
+    """
+    Send a response to the client before the current job has finished. This allows
+    a job to send partial results (for example tiles as they are rendered) while it
+    is still running. The last response is the one returned by the task itself.
+    
+    Parameters
+        - job_id (*dict* ): ``id`` of the job that is running (the tasks ``tid`` )
+        - response (*dict* ): Response sent to the client
+    """
+    from toyz.web import session_vars
+    if hasattr(session_vars, 'pipe'):
+        session_vars.pipe.send(build_result(job_id, response))
+
+def get_job_key(job_id):
+    """
+    Get the key used to identify a job in a session: ``(user_id, session_id, request_id)``
+    """
+    return (job_id['user_id'], job_id['session_id'], job_id['request_id'])
+
+def job_cancelled(job_id):
+    """
+    Check if a running job has been cancelled by the client or superseded by a newer job
+    (see :py:class:`toyz.web.job_executor.JobExecutor` ). Tasks that run for a long time
+    (for example tasks that send partial responses) should check this regularly and,
+    if the job was cancelled, stop and return a response with ``id='cancelled'`` .
+    
+    Parameters
+        - job_id (*dict* ): ``id`` of the job that is running (the tasks ``tid`` )
+    """
+    return get_job_key(job_id) in session_vars.cancelled_jobs
+
+def encode_binary_frame(header, payload):
+    """
+    Encode a binary message sent to the client over the websocket. The message is a 
+    little-endian uint32 with the length of the header, the JSON encoded ``header`` 
+    and the ``payload`` bytes.
+    
+    Parameters
+        - header (*dict* ): Information about the payload. This should contain
+          (at a minimum) the key **id**, used by the client to identify the type of message.
+        - payload (*bytes* ): Binary data sent to the client
+    
+    Returns
+        - frame (*bytes* ): Binary websocket message
+    """
+    import json
+    import struct
+    header = json.dumps(header).encode('utf-8')
+    return struct.pack('<I', len(header))+header+payload
+
 def progress_log(msg):
     """
     Send a notification to the client to update on the progress of a job
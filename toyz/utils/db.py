@@ -19,6 +19,9 @@ VALID_CHARS = '^[a-zA-z0-9_]+$'
 # Types of users used in the Toyz Franework 
 user_types = ['user_id', 'group_id']
 
+# Parameters that change the modules and toyz a user is allowed to run
+module_params = ['groups', 'users', 'modules', 'toyz']
+
 # Required functions for a db interface
 api_functions = [
     'init',
@@ -179,12 +182,24 @@ def create_toyz_database(db_settings):
     db_module = importlib.import_module(db_settings.interface_name)
     return db_module.create_toyz_database(db_settings)
 
+def clear_module_cache(param_type):
+    """
+    Clear the modules resolved for each user in the current process (see
+    :py:func:`toyz.utils.core.get_toyz_module` ) if ``param_type`` changes the modules 
+    users are allowed to run. Other processes check if the database has been modified.
+    """
+    if param_type in module_params:
+        from toyz.utils import core
+        core.clear_module_cache()
+
 def update_param(db_settings, param_type, **params):
     """
     Update a parameter with a single value, list of values, or dictionary.
     """
     db_module = importlib.import_module(db_settings.interface_name)
-    return db_module.update_param(db_settings, param_type, **params)
+    result = db_module.update_param(db_settings, param_type, **params)
+    clear_module_cache(param_type)
+    return result
 
 def update_all_params(db_settings, param_type, **params):
     """
@@ -193,7 +208,9 @@ def update_all_params(db_settings, param_type, **params):
     in the database not contained in ``params`` .
     """
     db_module = importlib.import_module(db_settings.interface_name)
-    return db_module.update_all_params(db_settings, param_type, **params)
+    result = db_module.update_all_params(db_settings, param_type, **params)
+    clear_module_cache(param_type)
+    return result
 
 def get_param(db_settings, param_type, **params):
     """
@@ -209,7 +226,9 @@ def delete_param(db_settings, param_type, **params):
     Delete a parameter from the database.
     """
     db_module = importlib.import_module(db_settings.interface_name)
-    return db_module.delete_param(db_settings, param_type, **params)
+    result = db_module.delete_param(db_settings, param_type, **params)
+    clear_module_cache(param_type)
+    return result
 
 def get_all_ids(db_settings, user_type):
     """
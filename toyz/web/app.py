@@ -275,18 +275,40 @@ class AuthToyz3rdPartyHandler(AuthHandler, Toyz3rdPartyHandler):
 def job_process(session_id, pipe, websocket_pipe):
     """
     Process created for the websocket. When a job is received from the Toyz
-    Application it is run in this process and a response is sent.
+    Application it is queued and run by the session's
+    :py:class:`toyz.web.job_executor.JobExecutor` , which sends the response when the
+    job has finished. The application settings are sent to the process when it starts
+    and again whenever they change (see :py:meth:`toyz.web.app.ToyzWebApp.update` ).
     """
+    from toyz.web.job_executor import JobExecutor
+    from toyz.web import tile_pool
     websocket_pipe.close()
+    executor = None
+    toyz_settings = None
     while True:
         try:
             msg = pipe.recv()    # Read from the output pipe and do nothing
-            job = msg['job']
-            toyz_settings = msg['toyz_settings']
-            result = core.run_job(toyz_settings, pipe, job)
-            pipe.send(result)
         except EOFError:
             break
+        # The settings are only sent when the session starts and when they change
+        if 'toyz_settings' in msg:
+            toyz_settings = msg['toyz_settings']
+            # The tile pool is forked before the job threads are started
+            if executor is None:
+                tile_pool.start_tile_pool(toyz_settings)
+            continue
+        if 'cancel' in msg:
+            if executor is not None:
+                executor.cancel(msg['user_id'], msg['session_id'], msg['cancel'])
+            continue
+        job = msg['job']
+        if executor is None:
+            workers = core.get_setting(toyz_settings, 'web', 'job_workers')
+            executor = JobExecutor(pipe, workers)
+        executor.submit(toyz_settings, job)
+    if executor is not None:
+        executor.close()
+    tile_pool.close_tile_pool()
     print('job_process {0} finished'.format(session_id))
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
@@ -325,6 +347,8 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
         The user and session information is then extracted and processed before running the 
         job initiated by the client. Only ``modules`` and ``toyz`` that the user has permission
         to view are accepted, all others return a :py:class:`toyz.utils.errors.ToyzJobError` .
+        A message with the key ``cancel`` (a list of ``request_id`` s) cancels jobs sent
+        earlier by the client instead of starting a new job.
         
         Parameters
             - message (*JSON unicode string* ): see(
@@ -341,18 +365,47 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
                 'traceback':''
             })
         session_id = decoded['id']['session_id']
-        self.job_pipe.send({
-            'job': decoded,
-            'toyz_settings': self.application.toyz_settings
-        })
+        # Cancel jobs that the client no longer needs
+        if 'cancel' in decoded:
+            msg = {
+                'cancel': decoded['cancel'],
+                'user_id': self.session['user_id'],
+                'session_id': self.session['session_id']
+            }
+            if self.application.session_pool is not None:
+                self.application.session_pool.cancel_jobs(
+                    (self.session['user_id'], self.session['session_id']), msg)
+            else:
+                self.job_pipe.send(msg)
+            return
+        # The settings are not sent with each job, the job process already has the 
+        # latest settings (see ToyzWebApp.update)
+        msg = {'job': decoded}
+        if self.application.session_pool is not None:
+            self.application.session_pool.send_job(
+                (self.session['user_id'], self.session['session_id']), msg)
+        else:
+            self.job_pipe.send(msg)
     
     def send_response(self, remote_pipe, events, error=None):
         if events & tornado.ioloop.IOLoop.READ:
             result = remote_pipe.recv()
             #print("Result:", result)
-            self.write_message(result['response'])
+            self.write_result(result)
         elif events & tornado.ioloop.IOLoop.ERROR:
             print("ERROR: ", error)    
+    
+    def write_result(self, result):
+        """
+        Send the result of a job to the client
+        """
+        # The job may have changed properties of the application (for example its settings)
+        for attr in result.get('update_app', []):
+            self.application.update(attr)
+        if 'binary_frames' in result:
+            for frame in result['binary_frames']:
+                self.write_message(frame, binary=True)
+        self.write_message(result['response'])
 
 class MainHandler(ToyzHandler, tornado.web.RequestHandler):
     """
@@ -406,6 +459,12 @@ class ToyzWebApp(tornado.web.Application):
         # Check that the database is up to date with the current version of Toyz
         core.check_version(self.toyz_settings.db)
         
+        # Remove old tiles from the persistent tile store if it is larger than its quota
+        from toyz.web import tile_store
+        store = tile_store.get_tile_store(self.toyz_settings)
+        if store is not None:
+            store.enforce_quota()
+        
         # If the user has specified a port, use it
         if tornado.options.options.port is not None:
             self.toyz_settings.web.port = tornado.options.options.port
@@ -428,6 +487,14 @@ class ToyzWebApp(tornado.web.Application):
         
         self.user_sessions = {}
         
+        # If sessions share a pool of worker processes, the workers are started as needed
+        session_workers = core.get_setting(self.toyz_settings, 'web', 'session_workers')
+        if session_workers>0:
+            from toyz.web.session_pool import SessionPool
+            self.session_pool = SessionPool(self, session_workers)
+        else:
+            self.session_pool = None
+        
         if platform.system() == 'Windows':
             file_path = os.path.splitdrive(core.ROOT_DIR)
         else:
@@ -495,14 +562,18 @@ class ToyzWebApp(tornado.web.Application):
         core.create_paths(websocket.session['path'])
         
         #initialize process for session jobs
-        websocket.job_pipe, remote_pipe = multiprocessing.Pipe()
-        websocket.process = multiprocessing.Process(
-            target = job_process, args=(session_id, remote_pipe, websocket.job_pipe))
-        websocket.process.start()
-        remote_pipe.close()
-        process_events = (tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
-        tornado.ioloop.IOLoop.current().add_handler(
-            websocket.job_pipe, websocket.send_response, process_events)
+        if self.session_pool is not None:
+            self.session_pool.add_session((user_id, session_id))
+        else:
+            websocket.job_pipe, remote_pipe = multiprocessing.Pipe()
+            websocket.process = multiprocessing.Process(
+                target = job_process, args=(session_id, remote_pipe, websocket.job_pipe))
+            websocket.process.start()
+            remote_pipe.close()
+            websocket.job_pipe.send(self.get_settings_msg())
+            process_events = (tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
+            tornado.ioloop.IOLoop.current().add_handler(
+                websocket.job_pipe, websocket.send_response, process_events)
         
         websocket.write_message({
             'id': 'initialize',
@@ -519,9 +590,12 @@ class ToyzWebApp(tornado.web.Application):
         """
         shutil.rmtree(session['path'])
         # Close process for current session
-        tornado.ioloop.IOLoop.current().remove_handler(
-            self.user_sessions[session['user_id']][session['session_id']].job_pipe)
-        self.user_sessions[session['user_id']][session['session_id']].job_pipe.close()
+        if self.session_pool is not None:
+            self.session_pool.remove_session((session['user_id'], session['session_id']))
+        else:
+            tornado.ioloop.IOLoop.current().remove_handler(
+                self.user_sessions[session['user_id']][session['session_id']].job_pipe)
+            self.user_sessions[session['user_id']][session['session_id']].job_pipe.close()
         # Delete the current session
         del self.user_sessions[session['user_id']][session['session_id']]
         # If all of the users sessions have completed, delete the users temp directory
@@ -532,6 +606,20 @@ class ToyzWebApp(tornado.web.Application):
             del self.user_sessions[session['user_id']]
         #print('active users remaining:', self.user_sessions.keys())
     
+    def get_websocket(self, user_id, session_id):
+        """
+        Get the websocket for a session (or ``None`` if the session has been closed)
+        """
+        if user_id in self.user_sessions:
+            return self.user_sessions[user_id].get(session_id, None)
+        return None
+    
+    def get_settings_msg(self):
+        """
+        Message used to send the current settings to job processes
+        """
+        return {'toyz_settings': self.toyz_settings}
+    
     def update(self, attr):
         """
         Certain properties of the application may be changed by an external job,
@@ -539,12 +627,26 @@ class ToyzWebApp(tornado.web.Application):
         a setting may be changed, etc. When this happens the job notifies the application
         that something has changed and this function is called to reload the property.
         
+        When the settings are reloaded, they are sent to the job process of every open
+        session, or to every worker if sessions share a pool of workers. Settings are
+        sent through the same pipe as the jobs, so every job received after the update
+        runs with the new settings.
+        
         Parameters
             - attr (*string* ): Name of attribute that needs to be updated. So far 
               only **toyz_settings** is supported
         """
         if attr == 'toyz_settings':
+            port = self.toyz_settings.web.port
             self.toyz_settings = core.ToyzSettings(self.toyz_settings.root_path)
+            self.toyz_settings.web.port = port
+            msg = self.get_settings_msg()
+            if self.session_pool is not None:
+                self.session_pool.update_settings(msg)
+            else:
+                for sessions in self.user_sessions.values():
+                    for websocket in sessions.values():
+                        websocket.job_pipe.send(msg)
 
 def init_web_app():
     """
@@ -0,0 +1,135 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Colormap lookup tables used to convert image data into RGBA tiles. Instead of building a
+matplotlib ``ScalarMappable`` for each tile, a uint8 lookup table (LUT) is created once
+for each colormap, inversion and color scale, and tiles are colorized by quantizing the
+data and indexing into the LUT.
+"""
+from __future__ import print_function, division
+import numpy as np
+
+from toyz.utils.errors import ToyzJobError
+
+# Number of entries in each lookup table
+LUT_SIZE = 4096
+
+# Lookup tables that have already been created, keyed by
+# (colormap name, invert_color, color_scale)
+luts = {}
+
+def linear_scale(x):
+    return x
+
+def log_scale(x, a=1000):
+    return np.log10(a*x+1)/np.log10(a+1)
+
+def sqrt_scale(x):
+    return np.sqrt(x)
+
+def asinh_scale(x, a=10):
+    return np.arcsinh(a*x)/np.arcsinh(a)
+
+# Transforms from normalized pixel values (0 to 1) to normalized colormap values (0 to 1)
+color_scales = {
+    'linear': linear_scale,
+    'log': log_scale,
+    'sqrt': sqrt_scale,
+    'asinh': asinh_scale
+}
+
+def get_colormap(name):
+    """
+    Get a matplotlib colormap by name. Newer versions of matplotlib (where ``cm.get_cmap``
+    was removed) use the ``matplotlib.colormaps`` registry.
+    """
+    try:
+        import matplotlib
+        from matplotlib import cm as cmap
+    except ImportError:
+        raise ToyzJobError("You must have matplotlib installed to load FITS images")
+    try:
+        if hasattr(matplotlib, 'colormaps'):
+            return matplotlib.colormaps[name]
+        return getattr(cmap, name)
+    except (KeyError, AttributeError, ValueError):
+        raise ToyzJobError("Unrecognized colormap '{0}'".format(name))
+
+def get_lut(name, invert_color=False, color_scale='linear'):
+    """
+    Get the lookup table for a colormap, creating it if it has not been used yet.
+
+    Parameters
+        - name (*string* ): Name of a matplotlib colormap
+        - invert_color (*bool*, optional): Whether or not to reverse the colormap
+        - color_scale (*string*, optional): Scale used to map pixel values to colors
+          (``linear``, ``log``, ``sqrt`` or ``asinh`` )
+
+    Returns
+        - lut (*numpy array* ): ``(LUT_SIZE+1, 4)`` array of uint8 RGBA values. The last
+          entry is transparent and used for pixels that are not finite.
+    """
+    key = (name, invert_color, color_scale)
+    if key not in luts:
+        if color_scale not in color_scales:
+            raise ToyzJobError("Unrecognized color scale '{0}'".format(color_scale))
+        colormap = get_colormap(name)
+        x = np.linspace(0, 1, LUT_SIZE)
+        x = np.clip(color_scales[color_scale](x), 0, 1)
+        if invert_color:
+            x = 1-x
+        lut = np.zeros((LUT_SIZE+1, 4), dtype=np.uint8)
+        lut[:LUT_SIZE] = np.uint8(colormap(x)*255)
+        luts[key] = lut
+    return luts[key]
+
+def quantize(data, colormap):
+    """
+    Convert an array of data into indices of a colormap lookup table. Pixels that are not 
+    finite (for example NaN's) are given the index ``LUT_SIZE`` (transparent).
+
+    Parameters
+        - data (*numpy array* ): 2D array of image data
+        - colormap (*dict* ): Colormap settings from an ``img_info`` dict. This must
+          contain the keys ``px_min`` and ``px_max``
+
+    Returns
+        - idx (*numpy array* ): uint16 array of lookup table indices
+    """
+    px_min = colormap['px_min']
+    px_max = colormap['px_max']
+    if px_max > px_min:
+        norm = (LUT_SIZE-1)/(px_max-px_min)
+    else:
+        norm = 0
+    values = np.subtract(data, px_min, dtype=np.float32)
+    values *= norm
+    bad = ~np.isfinite(values)
+    values[bad] = 0
+    np.clip(values, 0, LUT_SIZE-1, out=values)
+    idx = values.astype(np.uint16)
+    idx[bad] = LUT_SIZE
+    return idx
+
+def get_colormap_lut(colormap):
+    """
+    Get the lookup table for the colormap settings from an ``img_info`` dict
+    """
+    return get_lut(colormap['name'], colormap['invert_color'],
+        colormap.get('color_scale', 'linear'))
+
+def colorize(data, colormap):
+    """
+    Convert an array of data into an RGBA image using a colormap lookup table.
+    Pixels that are not finite (for example NaN's) are transparent.
+
+    Parameters
+        - data (*numpy array* ): 2D array of image data
+        - colormap (*dict* ): Colormap settings from an ``img_info`` dict. This must
+          contain the keys ``name``, ``px_min``, ``px_max`` and ``invert_color`` and may
+          also contain ``color_scale``
+
+    Returns
+        - img (*numpy array* ): ``data.shape+(4,)`` array of uint8 RGBA values
+    """
+    return get_colormap_lut(colormap)[quantize(data, colormap)]
@@ -0,0 +1,206 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Access to tile compressed FITS images (``CompImageHDU`` ) without decompressing the
+entire image. The image is divided into blocks aligned with the compression tiles and
+only the blocks that intersect a requested region are decompressed. Decompressed blocks
+are stored in a least recently used cache with a maximum size set by the
+``decompressed_cache_size`` web setting (in MB), so the time needed to render a tile
+does not depend on the size of the image.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import math
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Minimum number of rows and columns in a block of decompressed data. Blocks are rounded
+# up to a whole number of compression tiles.
+min_block_size = 256
+
+class BlockCache:
+    """
+    Least recently used (LRU) cache of decompressed blocks with a maximum size in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a decompressed block from the cache. Returns ``None`` if the block is not cached.
+        """
+        with self.lock:
+            if key in self.blocks:
+                block = self.blocks.pop(key)
+                self.blocks[key] = block
+                self.hits += 1
+                return block
+            self.misses += 1
+        return None
+
+    def set(self, key, block):
+        """
+        Add a decompressed block to the cache, removing the least recently used blocks if
+        the cache is full
+        """
+        with self.lock:
+            if key in self.blocks:
+                self.size -= self.blocks.pop(key).nbytes
+            while self.size+block.nbytes > self.max_bytes and len(self.blocks)>0:
+                old_key, old_block = self.blocks.popitem(last=False)
+                self.size -= old_block.nbytes
+            self.blocks[key] = block
+            self.size += block.nbytes
+
+    def clear(self, filepath=None):
+        """
+        Remove the blocks for the image at ``filepath`` or, if no ``filepath`` is given,
+        all of the blocks in the cache
+        """
+        with self.lock:
+            for key in list(self.blocks):
+                if filepath is None or key[0]==filepath:
+                    self.size -= self.blocks.pop(key).nbytes
+
+    def get_stats(self):
+        """
+        Get the hit/miss counters and current size of the cache
+        """
+        with self.lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'blocks': len(self.blocks),
+                'size': self.size,
+                'max_size': self.max_bytes
+            }
+        return stats
+
+def get_block_cache():
+    """
+    Get the cache of decompressed blocks for the current process, creating it the first
+    time it is needed
+    """
+    with session_vars.cache_lock:
+        if getattr(session_vars, 'block_cache', None) is None:
+            toyz_settings = getattr(session_vars, 'toyz_settings', None)
+            cache_size = core.get_setting(toyz_settings, 'web', 'decompressed_cache_size')
+            session_vars.block_cache = BlockCache(int(cache_size*1024*1024))
+    return session_vars.block_cache
+
+def is_compressed(hdu):
+    """
+    Check if an HDU is a tile compressed image
+    """
+    return 'compimagehdu' in hdu.__class__.__name__.lower()
+
+def get_compression_tile(hdu):
+    """
+    Get the ``(rows, columns)`` of each compression tile of an HDU. The tile size is
+    stored in the ``ZTILEn`` keywords of the compressed (binary table) header, and by
+    default each row of the image is a separate tile.
+    """
+    shape = hdu.shape
+    for attr in ['_bintable', '_header']:
+        header = getattr(hdu, attr, None)
+        if attr=='_bintable' and header is not None:
+            header = header.header
+        if header is not None and 'ZTILE1' in header:
+            return int(header.get('ZTILE2', 1)), int(header['ZTILE1'])
+    return 1, shape[-1]
+
+def get_index(key, length):
+    """
+    Convert an index or slice along one axis into the range of pixels that must be read
+    and the indices of the requested pixels in that range.
+
+    Returns
+        - start, stop (*int* ): Range of pixels to read
+        - idx (*slice* or *int* or *numpy array* ): Indices in the range
+    """
+    if isinstance(key, slice):
+        start, stop, step = key.indices(length)
+        if step==1:
+            return start, max(start, stop), slice(None)
+        pixels = np.arange(start, stop, step)
+        if pixels.size==0:
+            return 0, 0, slice(None)
+        return int(pixels.min()), int(pixels.max())+1, pixels-pixels.min()
+    key = int(key)
+    if key<0:
+        key += length
+    if key<0 or key>=length:
+        raise IndexError("Index {0} is out of bounds for axis with size {1}".format(
+            key, length))
+    return key, key+1, 0
+
+class CompressedSection:
+    """
+    Array-like wrapper for a tile compressed image HDU that only decompresses the blocks
+    of the image that intersect the region sliced from it
+    """
+    def __init__(self, hdu, filepath, frame):
+        self.hdu = hdu
+        self.key = (filepath, str(frame))
+        self.shape = tuple(hdu.shape)
+        self.ndim = len(self.shape)
+        tile_rows, tile_cols = get_compression_tile(hdu)
+        self.block_rows = int(math.ceil(min_block_size/tile_rows))*tile_rows
+        self.block_cols = min(int(math.ceil(min_block_size/tile_cols))*tile_cols,
+            self.shape[1])
+
+    def read_block(self, block_row, block_col):
+        """
+        Decompress a block of the image (or load it from the block cache)
+        """
+        block_cache = get_block_cache()
+        key = self.key+(block_row, block_col)
+        block = block_cache.get(key)
+        if block is None:
+            y0 = block_row*self.block_rows
+            x0 = block_col*self.block_cols
+            if hasattr(self.hdu, 'section'):
+                block = self.hdu.section[y0:y0+self.block_rows, x0:x0+self.block_cols]
+            else:
+                # Older versions of astropy can only decompress the entire image
+                block = self.hdu.data[y0:y0+self.block_rows, x0:x0+self.block_cols]
+            block = np.array(block)
+            block_cache.set(key, block)
+        return block
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key)>2:
+            raise IndexError("Compressed images must be sliced with 2 indices")
+        key = key+(slice(None),)*(2-len(key))
+        y0, yf, y_idx = get_index(key[0], self.shape[0])
+        x0, xf, x_idx = get_index(key[1], self.shape[1])
+        data = None
+        if yf>y0 and xf>x0:
+            for block_row in range(y0//self.block_rows, (yf-1)//self.block_rows+1):
+                for block_col in range(x0//self.block_cols, (xf-1)//self.block_cols+1):
+                    block = self.read_block(block_row, block_col)
+                    if data is None:
+                        data = np.empty((yf-y0, xf-x0), dtype=block.dtype)
+                    by0 = block_row*self.block_rows
+                    bx0 = block_col*self.block_cols
+                    ry0 = max(y0, by0)
+                    ryf = min(yf, by0+block.shape[0])
+                    rx0 = max(x0, bx0)
+                    rxf = min(xf, bx0+block.shape[1])
+                    data[ry0-y0:ryf-y0, rx0-x0:rxf-x0] = (
+                        block[ry0-by0:ryf-by0, rx0-bx0:rxf-bx0])
+        if data is None:
+            data = np.empty((yf-y0, xf-x0))
+        if isinstance(y_idx, np.ndarray) and isinstance(x_idx, np.ndarray):
+            return data[y_idx[:,None], x_idx[None,:]]
+        return data[y_idx, x_idx]
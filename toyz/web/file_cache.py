@@ -0,0 +1,242 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Cache of open image files and their decoded frames for the current process. Each file
+stays open until the cache is larger than the ``file_cache_size`` web setting (in MB)
+or holds more than ``file_cache_files`` files, when the least recently used files are
+closed. Files that have been modified since they were opened are reloaded, so a
+workspace with several viewers (or blinking between images) never has to re-read an
+image it has already opened.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import os
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+def get_data_size(data):
+    """
+    Get the number of bytes of memory used by an array. Memory mapped arrays are paged by
+    the operating system, so they do not count against the size of the cache.
+    """
+    if not isinstance(data, np.ndarray):
+        return 0
+    base = data
+    while base is not None:
+        if isinstance(base, np.memmap):
+            return 0
+        base = getattr(base, 'base', None)
+        if not isinstance(base, np.ndarray):
+            break
+    return data.nbytes
+
+def close_file(img_file):
+    """
+    Close an image file (if the file type supports it)
+    """
+    if hasattr(img_file, 'close'):
+        try:
+            img_file.close()
+        except Exception as error:
+            print('Error closing file:', error)
+
+class OpenFile:
+    """
+    An open image file along with the frames that have been read from it
+    """
+    def __init__(self, img_file, mtime):
+        self.img_file = img_file
+        self.mtime = mtime
+        self.frames = OrderedDict()
+        # Only the frames (including decoded non-FITS images) and the data built from them
+        # (see :py:meth:`toyz.web.file_cache.FileCache.add_size` ) count against the size
+        # of the cache
+        self.size = 0
+
+class FileCache:
+    """
+    Least recently used (LRU) cache of open image files with a maximum memory footprint
+    """
+    def __init__(self, max_bytes, max_files, max_frames):
+        """
+        Initialize an empty cache
+
+        Parameters
+            - max_bytes (*int* ): Maximum number of bytes of decoded image data stored in
+              the cache
+            - max_files (*int* ): Maximum number of files that are kept open
+            - max_frames (*int* ): Maximum number of frames (for example planes of a data
+              cube) stored for each file
+        """
+        self.max_bytes = max_bytes
+        self.max_files = max(1, max_files)
+        self.max_frames = max(1, max_frames)
+        self.files = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Files may be requested by more than one thread (for example when prefetching)
+        self.lock = threading.RLock()
+
+    def get(self, filepath):
+        """
+        Get an open file from the cache. Returns ``None`` if the file is not cached or
+        has been modified since it was opened.
+        """
+        mtime = os.path.getmtime(filepath)
+        with self.lock:
+            if filepath in self.files:
+                if self.files[filepath].mtime==mtime:
+                    open_file = self.files.pop(filepath)
+                    self.files[filepath] = open_file
+                    self.hits += 1
+                    return open_file
+                self.remove(filepath)
+            self.misses += 1
+        return None
+
+    def set(self, filepath, img_file):
+        """
+        Add a newly opened file to the cache, closing the least recently used files if
+        the cache is full
+        """
+        open_file = OpenFile(img_file, os.path.getmtime(filepath))
+        with self.lock:
+            if filepath in self.files:
+                self.remove(filepath)
+            self.files[filepath] = open_file
+            self.size += open_file.size
+            self.evict()
+        return open_file
+
+    def get_frame(self, filepath, frame):
+        """
+        Get the data for a frame of an open file. Returns ``None`` if the frame has not
+        been stored.
+        """
+        with self.lock:
+            if filepath not in self.files or frame not in self.files[filepath].frames:
+                return None
+            frames = self.files[filepath].frames
+            data = frames.pop(frame)
+            frames[frame] = data
+            return data
+
+    def set_frame(self, filepath, frame, data):
+        """
+        Store the data for a frame of an open file, removing the least recently used
+        frames of the file if it has more than ``max_frames`` frames
+        """
+        with self.lock:
+            if filepath not in self.files:
+                return
+            open_file = self.files[filepath]
+            if frame in open_file.frames:
+                return
+            open_file.frames[frame] = data
+            data_size = get_data_size(data)
+            while len(open_file.frames) > self.max_frames:
+                old_frame, old_data = open_file.frames.popitem(last=False)
+                data_size -= get_data_size(old_data)
+            open_file.size += data_size
+            self.size += data_size
+            self.evict()
+
+    def add_size(self, filepath, nbytes):
+        """
+        Count data built from an open file that is stored outside of the cache (for
+        example the levels of an image pyramid) against the size of the cache, closing
+        the least recently used files if the cache is full. Returns the open file the
+        data is counted against (``None`` if the file is not in the cache), which is
+        needed to release the data with :py:meth:`toyz.web.file_cache.FileCache.release_size` .
+        """
+        with self.lock:
+            open_file = self.files.get(filepath, None)
+            if open_file is None:
+                return None
+            open_file.size += nbytes
+            self.size += nbytes
+            self.evict()
+        return open_file
+
+    def release_size(self, filepath, open_file, nbytes):
+        """
+        Stop counting data added with :py:meth:`toyz.web.file_cache.FileCache.add_size`
+        that was removed while its file is still open
+        """
+        with self.lock:
+            if open_file is not None and self.files.get(filepath, None) is open_file:
+                open_file.size -= nbytes
+                self.size -= nbytes
+
+    def remove(self, filepath):
+        """
+        Close a file and remove it (and any pyramids, integral images, frame statistics or
+        decompressed blocks built from it) from the cache
+        """
+        from toyz.web import frame_stats
+        from toyz.web import pyramid
+        from toyz.web import integral
+        from toyz.web import compressed
+        with self.lock:
+            open_file = self.files.pop(filepath)
+            self.size -= open_file.size
+            pyramid.clear_pyramids(filepath)
+            integral.clear_integral_images(filepath)
+            frame_stats.clear_frame_stats(filepath)
+            compressed.get_block_cache().clear(filepath)
+            close_file(open_file.img_file)
+
+    def evict(self):
+        """
+        Close the least recently used files until the cache is within its limits.
+        The most recently used file is always kept open.
+        """
+        with self.lock:
+            while ((self.size > self.max_bytes or len(self.files) > self.max_files) and
+                    len(self.files)>1):
+                self.remove(next(iter(self.files)))
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Close all of the files in the cache
+        """
+        with self.lock:
+            for filepath in list(self.files):
+                self.remove(filepath)
+
+    def get_stats(self):
+        """
+        Get the hit/miss counters and current size of the cache
+        """
+        with self.lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'files': len(self.files),
+                'size': self.size,
+                'max_size': self.max_bytes
+            }
+        return stats
+
+def get_file_cache():
+    """
+    Get the file cache for the current process, creating it the first time it is needed.
+    The size of the cache is set by the ``file_cache_size`` (in MB),
+    ``file_cache_files`` and ``file_cache_frames`` web settings.
+    """
+    with session_vars.cache_lock:
+        if getattr(session_vars, 'file_cache', None) is None:
+            toyz_settings = getattr(session_vars, 'toyz_settings', None)
+            cache_size = core.get_setting(toyz_settings, 'web', 'file_cache_size')
+            max_files = core.get_setting(toyz_settings, 'web', 'file_cache_files')
+            max_frames = core.get_setting(toyz_settings, 'web', 'file_cache_frames')
+            session_vars.file_cache = FileCache(
+                int(cache_size*1024*1024), int(max_files), int(max_frames))
+    return session_vars.file_cache
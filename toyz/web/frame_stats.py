@@ -0,0 +1,242 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Cached statistics (min, max, percentiles and zscale) for image frames. Statistics are
+computed once for each file, frame and modification time. For large frames a fast
+estimate is calculated from a sample of the image and the exact values are computed in
+a background thread, so that they can be returned by later requests.
+All statistics ignore pixels that are not finite (for example NaN's). The statistics for
+at most ``max_frame_stats`` frames are stored, and the statistics for a file are removed
+when the file is closed by the file cache (see :py:class:`toyz.web.file_cache.FileCache` ).
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import math
+import os
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Percentiles included in the statistics for each frame
+percentiles = [0.5, 1, 5, 25, 50, 75, 95, 99, 99.5]
+
+# Number of histogram bins used to calculate exact percentiles
+hist_bins = 65536
+
+# Set the default values for the sessions global variables if they have not already been set
+if not hasattr(session_vars, 'frame_stats'):
+    session_vars.frame_stats = OrderedDict()
+
+# Maximum number of frames with stored statistics (for example when stepping through the
+# planes of a data cube). The least recently used statistics are removed first.
+max_frame_stats = 256
+
+# Frame statistics are requested by every job running in the process, so only one job
+# calculates the statistics for a frame
+frame_stats_lock = threading.Lock()
+
+def iter_row_blocks(data, block_rows=512):
+    """
+    Iterate over the finite pixels in blocks of rows of an image, so that large
+    (memory mapped or section) images never need to be loaded into memory all at once.
+    """
+    for y0 in range(0, data.shape[0], block_rows):
+        block = np.asarray(data[y0:y0+block_rows])
+        yield block[np.isfinite(block)]
+
+def get_block_sample(data, sample_size):
+    """
+    Get (approximately) ``sample_size`` finite pixels from a tile compressed image
+    (see :py:class:`toyz.web.compressed.CompressedSection` ) using whole blocks from an
+    evenly spaced grid of blocks, so that only the compression tiles in those blocks are
+    decompressed.
+    """
+    height, width = data.shape
+    rows = int(math.ceil(height/data.block_rows))
+    cols = int(math.ceil(width/data.block_cols))
+    count = min(rows*cols, int(math.ceil(sample_size/(data.block_rows*data.block_cols))))
+    sample_cols = min(cols, count, max(1, int(round(math.sqrt(count*cols/rows)))))
+    sample_rows = min(rows, int(math.ceil(count/sample_cols)))
+    sample = np.concatenate([data.read_block(block_row, block_col).ravel()
+        for block_row in np.unique(np.linspace(0, rows-1, sample_rows).astype(int))
+        for block_col in np.unique(np.linspace(0, cols-1, sample_cols).astype(int))])
+    sample = sample[np.isfinite(sample)]
+    return sample[::max(1, sample.size//sample_size)]
+
+def get_sample(data, sample_size):
+    """
+    Get (approximately) ``sample_size`` finite pixels from an image, using evenly spaced
+    rows (so that only those rows need to be read from the file) and columns. Tile
+    compressed images are sampled using whole blocks
+    (see :py:func:`toyz.web.frame_stats.get_block_sample` ).
+    """
+    from toyz.web import compressed
+    if isinstance(data, compressed.CompressedSection):
+        return get_block_sample(data, sample_size)
+    height, width = data.shape
+    step = max(1, int(np.sqrt(height*width/sample_size)))
+    sample = np.concatenate([np.asarray(data[y])[::step] for y in range(0, height, step)])
+    return sample[np.isfinite(sample)]
+
+def zscale(samples, contrast=0.25, krej=2.5, max_iter=5):
+    """
+    Calculate the IRAF zscale range of an array of samples. A line is fit to the sorted
+    samples (with iterative sigma rejection) and the slope, scaled by ``contrast``, is
+    used to set the range around the median.
+
+    Returns
+        - z1, z2 (*float* ): Minimum and maximum of the zscale range
+    """
+    samples = np.sort(samples)
+    npix = samples.size
+    if npix==0:
+        return 0., 0.
+    center = npix//2
+    median = float(np.median(samples))
+    if npix<3:
+        return float(samples[0]), float(samples[-1])
+    x = np.arange(npix)
+    good = np.ones(npix, dtype=bool)
+    slope = 0
+    for n in range(max_iter):
+        slope, intercept = np.polyfit(x[good], samples[good], 1)
+        residuals = samples-(slope*x+intercept)
+        sigma = np.std(residuals[good])
+        new_good = np.abs(residuals) < krej*sigma
+        if new_good.sum() < npix//2 or np.array_equal(new_good, good):
+            break
+        good = new_good
+    slope = slope/contrast
+    z1 = max(float(samples[0]), median-(center-1)*slope)
+    z2 = min(float(samples[-1]), median+(npix-center)*slope)
+    return z1, z2
+
+def calculate_stats(values, px_min=None, px_max=None):
+    """
+    Calculate the statistics for an array of finite pixel values. If ``px_min`` and
+    ``px_max`` are given they are used instead of the range of ``values`` .
+    """
+    if values.size==0:
+        return {
+            'min': 0.,
+            'max': 0.,
+            'percentiles': {str(p): 0. for p in percentiles},
+            'zscale': [0., 0.]
+        }
+    if px_min is None:
+        px_min = float(values.min())
+        px_max = float(values.max())
+    stats = {
+        'min': px_min,
+        'max': px_max,
+        'percentiles': {str(p): float(v)
+            for p, v in zip(percentiles, np.percentile(values, percentiles))},
+        'zscale': list(zscale(values))
+    }
+    return stats
+
+def calculate_exact_stats(data, sample_size):
+    """
+    Calculate the exact min, max and percentiles of an image one block of rows at a time.
+    The percentiles are calculated from a histogram of the image, so they are accurate
+    to ``(max-min)/hist_bins`` .
+    """
+    px_min = None
+    px_max = None
+    for block in iter_row_blocks(data):
+        if block.size>0:
+            if px_min is None:
+                px_min = float(block.min())
+                px_max = float(block.max())
+            else:
+                px_min = min(px_min, float(block.min()))
+                px_max = max(px_max, float(block.max()))
+    if px_min is None:
+        return calculate_stats(np.array([]))
+    stats = calculate_stats(get_sample(data, sample_size), px_min, px_max)
+    if px_max>px_min:
+        hist = np.zeros(hist_bins, dtype=np.int64)
+        for block in iter_row_blocks(data):
+            hist += np.histogram(block, bins=hist_bins, range=(px_min, px_max))[0]
+        cumulative = np.cumsum(hist)/float(hist.sum())
+        bin_width = (px_max-px_min)/hist_bins
+        for p in percentiles:
+            idx = int(np.searchsorted(cumulative, p/100.))
+            stats['percentiles'][str(p)] = px_min+(idx+.5)*bin_width
+    return stats
+
+class StatsThread(threading.Thread):
+    """
+    Thread that calculates the exact statistics for a frame and stores them in the cache
+    """
+    def __init__(self, key, data, sample_size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.key = key
+        self.data = data
+        self.sample_size = sample_size
+
+    def run(self):
+        stats = calculate_exact_stats(self.data, self.sample_size)
+        stats['exact'] = True
+        with frame_stats_lock:
+            # The estimate may have been removed while the exact statistics were calculated
+            if self.key in session_vars.frame_stats:
+                session_vars.frame_stats[self.key] = stats
+
+def set_frame_stats(key, stats):
+    """
+    Store the statistics for a frame, removing the least recently used statistics if more
+    than ``max_frame_stats`` frames are stored. This must be called with the
+    ``frame_stats_lock`` held.
+    """
+    session_vars.frame_stats[key] = stats
+    while len(session_vars.frame_stats) > max_frame_stats:
+        session_vars.frame_stats.popitem(last=False)
+
+def clear_frame_stats(filepath=None):
+    """
+    Remove the statistics stored for the image at ``filepath`` or, if no ``filepath`` is
+    given, the statistics for all of the images
+    """
+    with frame_stats_lock:
+        session_vars.frame_stats = OrderedDict([(key, stats) for key, stats
+            in session_vars.frame_stats.items() if filepath is not None and key[0]!=filepath])
+
+def get_frame_stats(file_info, frame, data):
+    """
+    Get the statistics for a frame of an image. If the frame is larger than the
+    ``stats_sample_size`` web setting, the first request returns statistics estimated
+    from a sample of the image and the exact statistics are calculated in the background.
+
+    Parameters
+        - file_info (*dict* ): File info for the image
+        - frame (*string* ): Frame of the image
+        - data (*array-like* ): Data for the frame
+
+    Returns
+        - stats (*dict* ): Statistics with the keys ``min``, ``max``, ``percentiles``,
+          ``zscale`` and ``exact`` (*True* if the statistics use every pixel in the frame)
+    """
+    filepath = file_info['filepath']
+    key = (filepath, str(frame), os.path.getmtime(filepath))
+    with frame_stats_lock:
+        if key in session_vars.frame_stats:
+            stats = session_vars.frame_stats.pop(key)
+            session_vars.frame_stats[key] = stats
+            return stats
+        toyz_settings = getattr(session_vars, 'toyz_settings', None)
+        sample_size = int(core.get_setting(toyz_settings, 'web', 'stats_sample_size'))
+        if data.shape[0]*data.shape[1] <= sample_size:
+            values = np.asarray(data[:])
+            stats = calculate_stats(values[np.isfinite(values)])
+            stats['exact'] = True
+            set_frame_stats(key, stats)
+        else:
+            stats = calculate_stats(get_sample(data, sample_size))
+            stats['exact'] = False
+            set_frame_stats(key, stats)
+            StatsThread(key, data, sample_size).start()
+    return stats
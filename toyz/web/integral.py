@@ -0,0 +1,220 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Summed-area tables (integral images) used to calculate the sum, mean and standard
+deviation of any rectangle in an image frame in constant time. Tables are built the
+first time a region of a frame is requested (if the ``integral_images`` web setting is
+*True* ) and cached for each file, frame and modification time. Each table uses 24 bytes
+per pixel, so they are disabled by default. The tables count against the size of the
+file cache (see :py:class:`toyz.web.file_cache.FileCache` ) and are removed when the
+file is closed by the cache, or when more than ``max_integral_images`` tables are stored.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import os
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Set the default values for the sessions global variables if they have not already been set
+if not hasattr(session_vars, 'integral_images'):
+    session_vars.integral_images = OrderedDict()
+
+# Maximum number of integral images stored by a process. The least recently used tables
+# are removed first.
+max_integral_images = 4
+
+# Integral images may be requested by more than one thread (for example when prefetching)
+integral_lock = threading.Lock()
+
+class IntegralImage:
+    """
+    Summed-area tables of the pixel values, squared pixel values and number of pixels
+    that are not finite in a 2D image. Pixels that are not finite are excluded from the
+    sums.
+    """
+    def __init__(self, filepath, data, block_rows=512):
+        """
+        Build the tables from the image ``data`` of the file at ``filepath`` , reading
+        ``block_rows`` rows at a time so that memory mapped or section based images are
+        never fully loaded into memory.
+        """
+        height, width = data.shape
+        self.filepath = filepath
+        self.shape = (height, width)
+        # Open file (in the file cache) the tables are counted against
+        self.open_file = None
+        self.sums = np.zeros((height+1, width+1), dtype=np.float64)
+        self.squares = np.zeros((height+1, width+1), dtype=np.float64)
+        self.nan_counts = np.zeros((height+1, width+1), dtype=np.int64)
+        # Pixel values are shifted by an offset (the mean of the first block of finite
+        # pixels) to reduce the loss of precision in the sum of squares
+        self.offset = None
+        for y0 in range(0, height, block_rows):
+            yf = min(y0+block_rows, height)
+            block = np.array(data[y0:yf], dtype=np.float64)
+            valid = np.isfinite(block)
+            if self.offset is None:
+                self.offset = float(block[valid].mean()) if valid.any() else 0.
+            block -= self.offset
+            block[~valid] = 0
+            for table, values in [
+                    (self.sums, block),
+                    (self.squares, block*block),
+                    (self.nan_counts, ~valid)]:
+                table[y0+1:yf+1, 1:] = (np.cumsum(np.cumsum(values, axis=1), axis=0)+
+                    table[y0, 1:])
+
+    def get_size(self):
+        """
+        Get the number of bytes used by the tables
+        """
+        return self.sums.nbytes+self.squares.nbytes+self.nan_counts.nbytes
+
+    def charge(self):
+        """
+        Count the tables against the size of the file cache. This must not be called with
+        the ``integral_lock`` held.
+        """
+        from toyz.web.file_cache import get_file_cache
+        self.open_file = get_file_cache().add_size(self.filepath, self.get_size())
+
+    def release(self):
+        """
+        Stop counting the tables against the size of the file cache (when they are
+        removed). This must not be called with the ``integral_lock`` held.
+        """
+        from toyz.web.file_cache import get_file_cache
+        if self.open_file is not None:
+            get_file_cache().release_size(self.filepath, self.open_file, self.get_size())
+            self.open_file = None
+
+    def get_total(self, table, x0, y0, xf, yf):
+        """
+        Get the total of a table in the rectangle ``[y0:yf, x0:xf]``
+        """
+        return table[yf, xf]-table[y0, xf]-table[yf, x0]+table[y0, x0]
+
+    def get_stats(self, x0, y0, xf, yf):
+        """
+        Get the statistics of the finite pixels in the rectangle ``[y0:yf, x0:xf]`` .
+        The rectangle is clipped to the edges of the image.
+
+        Returns
+            - stats (*dict* ): ``sum``, ``mean`` and ``std_dev`` of the finite pixels,
+              the number of finite pixels ``npix`` and the number of pixels that are not
+              finite ``nan_count``
+        """
+        height, width = self.shape
+        x0 = int(min(max(x0, 0), width))
+        xf = int(min(max(xf, x0), width))
+        y0 = int(min(max(y0, 0), height))
+        yf = int(min(max(yf, y0), height))
+        nan_count = int(self.get_total(self.nan_counts, x0, y0, xf, yf))
+        npix = (xf-x0)*(yf-y0)-nan_count
+        if npix==0:
+            return {'sum': 0., 'mean': 0., 'std_dev': 0., 'npix': 0, 'nan_count': nan_count}
+        total = self.get_total(self.sums, x0, y0, xf, yf)
+        squares = self.get_total(self.squares, x0, y0, xf, yf)
+        mean = total/npix
+        return {
+            'sum': float(total+npix*self.offset),
+            'mean': float(mean+self.offset),
+            'std_dev': float(np.sqrt(max(squares/npix-mean**2, 0))),
+            'npix': npix,
+            'nan_count': nan_count
+        }
+
+def calculate_region_stats(data, x0, y0, xf, yf):
+    """
+    Calculate the same statistics as :py:meth:`toyz.web.integral.IntegralImage.get_stats`
+    directly from the pixels in the rectangle ``[y0:yf, x0:xf]`` of ``data``
+    """
+    x0 = int(max(x0, 0))
+    y0 = int(max(y0, 0))
+    values = np.array(data[y0:max(int(yf), y0), x0:max(int(xf), x0)], dtype=np.float64)
+    valid = np.isfinite(values)
+    nan_count = int(values.size-valid.sum())
+    values = values[valid]
+    if values.size==0:
+        return {'sum': 0., 'mean': 0., 'std_dev': 0., 'npix': 0, 'nan_count': nan_count}
+    return {
+        'sum': float(values.sum()),
+        'mean': float(values.mean()),
+        'std_dev': float(values.std()),
+        'npix': int(values.size),
+        'nan_count': nan_count
+    }
+
+def get_integral_image(file_info, frame, data):
+    """
+    Get the integral image for a frame of an image, building it if necessary. Returns
+    ``None`` if integral images are disabled (using the ``integral_images`` web setting)
+    or the frame is not a 2D image.
+    """
+    toyz_settings = getattr(session_vars, 'toyz_settings', None)
+    if not core.get_setting(toyz_settings, 'web', 'integral_images') or len(data.shape)!=2:
+        return None
+    filepath = file_info['filepath']
+    mtime = os.path.getmtime(filepath)
+    key = (filepath, str(frame), mtime)
+    with integral_lock:
+        integral_image = session_vars.integral_images.pop(key, None)
+        if integral_image is not None:
+            session_vars.integral_images[key] = integral_image
+            return integral_image
+    # The table is built without holding the integral_lock, so jobs from other sessions
+    # are not blocked while the image is scanned
+    new_image = IntegralImage(filepath, data)
+    removed = []
+    with integral_lock:
+        # Another thread may have built the same table
+        integral_image = session_vars.integral_images.pop(key, None)
+        if integral_image is None:
+            integral_image = new_image
+            # Remove the tables for older versions of the file (tables for the other
+            # frames of the file are kept)
+            removed = remove_integral_images(
+                lambda old_key: old_key[0]==filepath and old_key[2]!=mtime)
+            while len(session_vars.integral_images) >= max_integral_images:
+                removed.append(session_vars.integral_images.popitem(last=False)[1])
+        session_vars.integral_images[key] = integral_image
+    # The file cache may be waiting for the integral_lock to remove tables
+    for table in removed:
+        table.release()
+    if integral_image is new_image:
+        integral_image.charge()
+    return integral_image
+
+def remove_integral_images(match):
+    """
+    Remove the integral images where ``match(key)`` is *True* and return them. This must
+    be called with the ``integral_lock`` held.
+    """
+    removed = [table for key, table in session_vars.integral_images.items() if match(key)]
+    session_vars.integral_images = OrderedDict([(key, table) for key, table
+        in session_vars.integral_images.items() if not match(key)])
+    return removed
+
+def clear_integral_images(filepath=None):
+    """
+    Remove the integral images stored for the image at ``filepath`` or, if no
+    ``filepath`` is given, all of the integral images stored for the current session
+    """
+    with integral_lock:
+        removed = remove_integral_images(
+            lambda key: filepath is None or key[0]==filepath)
+    for table in removed:
+        table.release()
+
+def get_region_stats(file_info, frame, data, x0, y0, xf, yf):
+    """
+    Get the sum, mean and standard deviation of a rectangle in a frame, using the frame's
+    integral image if integral images are enabled.
+    """
+    integral_image = get_integral_image(file_info, frame, data)
+    if integral_image is None:
+        return calculate_region_stats(data, x0, y0, xf, yf)
+    return integral_image.get_stats(x0, y0, xf, yf)
@@ -0,0 +1,228 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Runs the jobs sent by a session (websocket connection) concurrently in a pool of threads
+in the session's job process, so a slow job (for example loading a large data file) does
+not block the other requests from the same browser tab. All of the threads share the
+session's ``session_vars`` , so cached files, tiles and data sources are available to
+every job. Responses are sent as soon as each job finishes (tagged with the
+``request_id`` of the job), so they may reach the client in a different order than the
+requests were sent.
+
+Jobs that change the state of a single viewer or data source (identified by the
+``viewer_id`` or ``src_id`` parameter) in the same session are placed in the same *lane*
+and run one at a time in the order they were received. Jobs in different lanes run
+concurrently. An executor may run the jobs for several sessions when worker processes
+are shared by sessions (see :py:mod:`toyz.web.session_pool` ).
+
+The client can cancel jobs by sending the ``request_id`` of each job to cancel. Jobs that
+have not started are removed from the queue and running jobs are flagged
+(see :py:func:`toyz.utils.core.job_cancelled` ) so they can stop early. A job for one of
+the ``superseded_tasks`` also cancels the older jobs for the same task and viewer, so
+the tiles for the latest position of a viewer are rendered first. If a dropped job
+registered the viewer (sent its ``file_info`` and ``img_info`` ), those parameters are
+moved to the job that superseded it. The client receives
+a response with ``id='cancelled'`` for every job that was cancelled before it started.
+CPU intensive tile rendering is run in the session's process pool
+(see :py:mod:`toyz.web.tile_pool` ).
+"""
+from __future__ import print_function, division
+import threading
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Parameters that identify the session state modified by a job
+lane_keys = ['viewer_id', 'src_id']
+
+# Tasks where a newer job for the same viewer (``viewer_id`` parameter) makes any older
+# jobs for the viewer obsolete
+superseded_tasks = ['update_viewport', 'get_tile_info']
+
+# Parameters that register (or reset) the state of a viewer. These are only sent by the
+# client when the image, frame, scale or colormap change, so they are copied to the job
+# that supersedes the job they were sent with.
+register_keys = ['file_info', 'img_info', 'loaded']
+
+def get_job_lane(job):
+    """
+    Get the lane of a job. Jobs in the same lane run in order, jobs with no lane
+    (``None`` ) may run at any time.
+    """
+    params = job.get('parameters', None)
+    if isinstance(params, dict):
+        for key in lane_keys:
+            if key in params:
+                return (job['id']['user_id'], job['id']['session_id'], key, str(params[key]))
+    return None
+
+def get_supersede_key(job):
+    """
+    Get the key of the jobs superseded by ``job`` , or ``None`` if the job does not
+    supersede older jobs
+    """
+    lane = get_job_lane(job)
+    if lane is None or lane[2]!='viewer_id' or job.get('task') not in superseded_tasks:
+        return None
+    return lane+(job.get('module'), job['task'])
+
+def merge_superseded(job, superseded):
+    """
+    Copy the parameters that register a viewer from the newest of the ``superseded`` jobs
+    that has them into ``job`` (unless ``job`` registers the viewer itself), so the
+    viewer state is not lost when the jobs are dropped
+    """
+    params = job['parameters']
+    if 'img_info' in params:
+        return
+    for old_job in reversed(superseded):
+        old_params = old_job['parameters']
+        if 'img_info' in old_params:
+            for key in register_keys:
+                if key in old_params:
+                    params[key] = old_params[key]
+            return
+
+def cancelled_result(job_id):
+    """
+    Build the result sent to the client for a job that was cancelled before it started
+    """
+    result = core.build_result(job_id, {'id': 'cancelled'})
+    result['job_finished'] = True
+    return result
+
+class JobExecutor:
+    """
+    Queue of jobs run by a pool of threads in a session's job process
+    """
+    def __init__(self, pipe, workers):
+        """
+        Parameters
+            - pipe (*multiprocessing.Connection* ): Pipe used to send results to the
+              application
+            - workers (*int* ): Number of threads used to run jobs. If ``workers`` is 1 all
+              jobs run one at a time in the order they were received.
+        """
+        self.pipe = pipe
+        self.queue = []
+        self.running = set()
+        # Jobs that are running, with the key of each job
+        self.active = {}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.threads = []
+        for n in range(max(1, int(workers))):
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, result):
+        """
+        Send a result to the application. Results from different threads are never
+        interleaved in the pipe.
+        """
+        with self.send_lock:
+            try:
+                self.pipe.send(result)
+            except (EOFError, IOError, OSError):
+                # The websocket was closed while the job was running
+                pass
+
+    def submit(self, toyz_settings, job):
+        """
+        Add a job to the queue, cancelling any jobs it supersedes
+        """
+        supersede_key = get_supersede_key(job)
+        cancelled = []
+        with self.condition:
+            if supersede_key is not None:
+                cancelled = self.remove_jobs(
+                    lambda queued: get_supersede_key(queued)==supersede_key)
+                merge_superseded(job, cancelled)
+            self.queue.append((get_job_lane(job), toyz_settings, job))
+            self.condition.notify()
+        self.send_cancelled(cancelled)
+
+    def cancel(self, user_id, session_id, request_ids):
+        """
+        Cancel the jobs with the given ``request_ids`` sent by a session
+        """
+        keys = set([(user_id, session_id, request_id) for request_id in request_ids])
+        with self.condition:
+            cancelled = self.remove_jobs(lambda queued: core.get_job_key(queued['id']) in keys)
+        self.send_cancelled(cancelled)
+
+    def remove_jobs(self, match):
+        """
+        Remove the queued jobs where ``match(job)`` is *True* and flag the running jobs
+        that match as cancelled. This must be called with the ``condition`` lock held.
+        Returns the jobs removed from the queue.
+        """
+        cancelled = [job for lane, toyz_settings, job in self.queue if match(job)]
+        self.queue = [queued for queued in self.queue if not match(queued[2])]
+        for key, job in self.active.items():
+            if match(job):
+                session_vars.cancelled_jobs.add(key)
+        return cancelled
+
+    def send_cancelled(self, jobs):
+        """
+        Let the client know that jobs were cancelled before they started
+        """
+        for job in jobs:
+            self.send(cancelled_result(job['id']))
+
+    def next_job(self):
+        """
+        Remove the first job in the queue that can run (its lane is not running a job) and
+        mark its lane as running. Waits until a job is available and returns ``None``
+        when the executor is closed.
+        """
+        with self.condition:
+            while not self.closed:
+                for n, (lane, toyz_settings, job) in enumerate(self.queue):
+                    if lane is None or lane not in self.running:
+                        del self.queue[n]
+                        if lane is not None:
+                            self.running.add(lane)
+                        self.active[core.get_job_key(job['id'])] = job
+                        return lane, toyz_settings, job
+                self.condition.wait()
+        return None
+
+    def run(self):
+        """
+        Run jobs from the queue until the executor is closed
+        """
+        while True:
+            queued = self.next_job()
+            if queued is None:
+                break
+            lane, toyz_settings, job = queued
+            try:
+                result = core.run_job(toyz_settings, self, job)
+                # Let the application know the job has finished (partial responses sent
+                # while the job is running do not have this flag)
+                result['job_finished'] = True
+                self.send(result)
+            finally:
+                with self.condition:
+                    self.running.discard(lane)
+                    key = core.get_job_key(job['id'])
+                    del self.active[key]
+                    session_vars.cancelled_jobs.discard(key)
+                    # The next job in the lane may be waiting for this one to finish
+                    self.condition.notify_all()
+
+    def close(self, timeout=None):
+        """
+        Remove any jobs that have not started and wait for the running jobs to finish
+        """
+        with self.condition:
+            self.closed = True
+            self.queue = []
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
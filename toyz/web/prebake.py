@@ -0,0 +1,236 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Render the viewer tiles for a directory of images into the persistent tile store
+(see :py:mod:`toyz.web.tile_store` ) ahead of time, so the first time an image is viewed
+its tiles are loaded from the store instead of being rendered. Tiles are rendered with
+the default settings for each image (the same tiles the viewer creates when the image
+is opened) using the same code as the viewer, at each of the viewer's zoom levels at
+or below full resolution.
+
+The images are rendered in parallel by a pool of processes. A manifest in the tile store
+records the modification time of every image that has been rendered, so a run that is
+interrupted can be resumed and later runs only render new or modified images.
+"""
+from __future__ import print_function, division
+import os
+import json
+import multiprocessing
+import time
+
+from toyz.utils import core
+from toyz.utils.errors import ToyzError
+from toyz.web import session_vars
+
+# Name of the manifest of rendered images in the tile store directory
+manifest_filename = 'prebake.json'
+
+# File extensions (other than FITS) of images that are rendered
+raster_extensions = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'bmp', 'gif']
+
+def is_image(filename):
+    """
+    Check if a file is an image that can be opened in the viewer
+    """
+    file_split = filename.lower().split('.')
+    return 'fits' in file_split[1:] or file_split[-1] in raster_extensions
+
+def find_images(path, recursive=True):
+    """
+    Get the paths of all of the images in a directory
+    """
+    images = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        images += [os.path.join(root, f) for f in sorted(files) if is_image(f)]
+        if not recursive:
+            break
+    return images
+
+def load_manifest(store_path):
+    """
+    Load the manifest of rendered images from the tile store
+    """
+    manifest_path = os.path.join(store_path, manifest_filename)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(store_path, manifest):
+    """
+    Save the manifest of rendered images (replacing the old manifest in a single step)
+    """
+    manifest_path = os.path.join(store_path, manifest_filename)
+    with open(manifest_path+'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_path+'.tmp', manifest_path)
+
+def init_worker(toyz_settings):
+    """
+    Initialize a worker process with the application settings
+    """
+    session_vars.toyz_settings = toyz_settings
+
+def get_viewers(options):
+    """
+    Get the viewer parameters for each scale rendered for an image. If the size of the
+    client's viewer is given, the scale used by the viewer to fit the image is included.
+    """
+    viewers = [{'x_center': 0, 'y_center': 0, 'width': 0, 'height': 0, 'scale': scale}
+        for scale in options['scales']]
+    if options['viewer'] is not None:
+        viewers.append({
+            'x_center': 0,
+            'y_center': 0,
+            'width': options['viewer'][0],
+            'height': options['viewer'][1],
+            'scale': -1
+        })
+    return viewers
+
+def bake_image(args):
+    """
+    Render all of the tiles for an image (in a worker process)
+
+    Returns
+        - filepath (*string* ): Path of the image
+        - mtime (*float* ): Modification time of the image when it was rendered
+        - tiles (*int* ): Number of tiles rendered (or loaded from the store)
+        - error (*string* ): Error message if the image could not be rendered
+    """
+    import toyz.web.viewer as viewer
+    filepath, options = args
+    mtime = os.path.getmtime(filepath)
+    tiles_created = 0
+    try:
+        file_info = viewer.get_file_info({'filepath': filepath})
+        if options['all_frames']:
+            frames = list(file_info['images'])
+        else:
+            frames = [file_info['frame']]
+        for frame in frames:
+            for img_viewer in get_viewers(options):
+                img_info = {
+                    'frame': frame,
+                    'viewer': img_viewer,
+                    'save_path': ''
+                }
+                img_info = viewer.get_img_info(file_info, img_info)
+                # Render one row of tiles at a time to limit the memory used by each worker
+                for row in range(img_info['rows']):
+                    tiles = {}
+                    for col in range(img_info['columns']):
+                        tile = viewer.get_tile(file_info, img_info, col, row)
+                        tiles[tile['idx']] = tile
+                    for created, encoded in viewer.iter_tiles(
+                            file_info, img_info, tiles, stream=True):
+                        tiles_created += len(created)
+    except Exception as error:
+        return filepath, mtime, tiles_created, str(error)
+    return filepath, mtime, tiles_created, None
+
+def prebake(toyz_settings, path, options):
+    """
+    Render the tiles for every new or modified image in ``path`` into the tile store
+
+    Parameters
+        - toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ): Settings for the
+          application
+        - path (*string* ): Directory of images
+        - options (*dict* ): ``scales`` (list of scales to render), ``viewer``
+          (``[width, height]`` of the client's viewer, or ``None`` ), ``all_frames``
+          (render every frame instead of the default frame), ``recursive``, ``workers``
+          and ``force`` (render images even if they have not changed)
+    """
+    from toyz.web import tile_store
+    store = tile_store.get_tile_store(toyz_settings)
+    if store is None:
+        raise ToyzError(
+            "The tile store is disabled, set the 'tile_store_size' web setting first")
+    # Each worker renders its tiles itself, since worker processes cannot start a tile pool
+    toyz_settings.web.tile_workers = 0
+
+    manifest = load_manifest(store.path)
+    signature = json.dumps({
+        'scales': options['scales'],
+        'viewer': options['viewer'],
+        'all_frames': options['all_frames']
+    }, sort_keys=True)
+    images = []
+    for filepath in find_images(os.path.abspath(path), options['recursive']):
+        entry = manifest.get(filepath)
+        if (not options['force'] and entry is not None and
+                entry['mtime']==os.path.getmtime(filepath) and
+                entry['signature']==signature):
+            continue
+        images.append(filepath)
+    print('Rendering tiles for', len(images), 'images')
+
+    start = time.time()
+    pool = multiprocessing.Pool(options['workers'],
+        initializer=init_worker, initargs=(toyz_settings,))
+    try:
+        for n, result in enumerate(pool.imap_unordered(
+                bake_image, [(filepath, options) for filepath in images])):
+            filepath, mtime, tiles, error = result
+            if error is not None:
+                print('Error rendering {0}: {1}'.format(filepath, error))
+                continue
+            print('[{0}/{1}] {2}: {3} tiles'.format(n+1, len(images), filepath, tiles))
+            # Record each image as soon as it is finished so an interrupted run can resume
+            manifest[filepath] = {'mtime': mtime, 'signature': signature}
+            save_manifest(store.path, manifest)
+    finally:
+        pool.terminate()
+        pool.join()
+    store.enforce_quota()
+    print('Finished in {0:.1f}s'.format(time.time()-start))
+
+def main():
+    """
+    Run the tile pre-baking tool from the command line
+    """
+    import argparse
+    from toyz.web.prefetch import zoom_scales
+    parser = argparse.ArgumentParser(
+        description='Render the viewer tiles for a directory of images into the tile store')
+    parser.add_argument('path', help='directory of images')
+    parser.add_argument('--root_path', default=None,
+        help='Use root_path as the root directory for a Toyz instance')
+    parser.add_argument('--scales', default=None,
+        help='comma separated list of scales to render (default is every zoom level '
+            'at or below full resolution)')
+    parser.add_argument('--viewer', default=None,
+        help='size of the client viewer (for example 1200x800), to render the tiles '
+            'shown when an image is first opened')
+    parser.add_argument('--all_frames', action='store_true',
+        help='render every frame (and cube plane) instead of the default frame')
+    parser.add_argument('--no_recursive', action='store_true',
+        help='do not render images in subdirectories')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+        help='number of worker processes')
+    parser.add_argument('--force', action='store_true',
+        help='render all images, even if they have not changed since the last run')
+    args = parser.parse_args()
+
+    if args.scales is None:
+        scales = [scale for scale in zoom_scales if scale<=1]
+    else:
+        scales = [float(scale) for scale in args.scales.split(',')]
+    viewer = None
+    if args.viewer is not None:
+        viewer = [int(size) for size in args.viewer.lower().split('x')]
+    options = {
+        'scales': scales,
+        'viewer': viewer,
+        'all_frames': args.all_frames,
+        'recursive': not args.no_recursive,
+        'workers': max(1, args.workers),
+        'force': args.force
+    }
+    toyz_settings = core.ToyzSettings(args.root_path)
+    prebake(toyz_settings, args.path, options)
+
+if __name__ == "__main__":
+    main()
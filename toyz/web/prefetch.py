@@ -0,0 +1,184 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Predictive tile prefetching for the image viewer. After the tiles in the viewer have been
+requested, a background thread renders a ring of tiles around the viewer (biased in the
+direction the user has been panning) and the tiles for the next and previous zoom levels
+into the tile cache. Prefetching only runs while the session is not running a job and is
+cancelled as soon as the viewer moves again.
+"""
+from __future__ import print_function, division
+import math
+import os
+import threading
+import time
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Zoom levels available in the viewer client (``Toyz.Viewer.scales`` )
+zoom_scales = [0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+
+# Set the default values for the sessions global variables if they have not already been set
+prefetch_variables = {
+    'jobs_running': 0
+}
+for v in prefetch_variables:
+    if not hasattr(session_vars, v):
+        setattr(session_vars, v, prefetch_variables[v])
+
+class TilePrefetcher(threading.Thread):
+    """
+    Thread that renders a list of tiles into the tile cache until it is cancelled
+    """
+    def __init__(self, file_info, tiles):
+        """
+        Parameters
+            - file_info (*dict* ): File info for the image
+            - tiles (*list* ): List of ``(img_info, tile_info)`` for each tile, in the order
+              they will be rendered
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.file_info = file_info
+        self.tiles = tiles
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        import toyz.web.viewer as viewer
+        from toyz.web import tile_cache
+        file_stat = os.stat(self.file_info['filepath'])
+        for img_info, tile_info in self.tiles:
+            # Wait for any jobs sent by the client to finish
+            while session_vars.jobs_running>0 and not self.cancelled.is_set():
+                time.sleep(.01)
+            if self.cancelled.is_set():
+                return
+            tile_key = viewer.get_tile_key(
+                self.file_info, img_info, tile_info, file_stat)
+            if tile_cache.get_cached_tile(tile_key) is not None:
+                continue
+            try:
+                encoded = viewer.encode_tiles(
+                    self.file_info, img_info, {tile_info['idx']: tile_info})
+            except Exception as error:
+                print('Prefetch failed:', error)
+                return
+            if tile_info['idx'] in encoded:
+                tile_cache.cache_tile(tile_key, encoded[tile_info['idx']])
+
+def cancel_prefetch():
+    """
+    Cancel the current prefetch thread (if one is running)
+    """
+    session = session_vars.get_session()
+    if session.prefetch_thread is not None:
+        session.prefetch_thread.cancel()
+        session.prefetch_thread = None
+
+def get_pan_direction(file_info, img_info):
+    """
+    Get the direction (unit vector) the viewer has moved since the last time tiles were
+    prefetched for the current image. If the scale changed or the viewer has not moved,
+    ``(0, 0)`` is returned.
+    """
+    key = (file_info['filepath'], str(img_info['frame']))
+    viewer = img_info['viewer']
+    center = (viewer['x_center'], viewer['y_center'], img_info['scale'])
+    prefetch_centers = session_vars.get_session().prefetch_centers
+    last_center = prefetch_centers.get(key, center)
+    prefetch_centers[key] = center
+    if last_center[2]!=center[2]:
+        return 0, 0
+    dx = center[0]-last_center[0]
+    dy = center[1]-last_center[1]
+    # The tile rows are flipped from the viewer coordinates when the image is inverted
+    if img_info['invert_x']:
+        dx = -dx
+    if img_info['invert_y']:
+        dy = -dy
+    distance = math.sqrt(dx**2+dy**2)
+    if distance==0:
+        return 0, 0
+    return dx/distance, dy/distance
+
+def get_ring_tiles(file_info, img_info, ring, direction):
+    """
+    Get the tiles in a ring ``ring`` tiles wide around the viewer. The ring is extended
+    by another ``ring`` tiles in the pan ``direction`` and tiles are sorted so that the
+    ones closest to the viewer and in the pan direction are rendered first.
+    """
+    import toyz.web.viewer as viewer
+    min_col, max_col, min_row, max_row = viewer.get_tile_bounds(file_info, img_info)
+    col_range = [min_col-ring, max_col+ring]
+    row_range = [min_row-ring, max_row+ring]
+    dx, dy = direction
+    if dx>0:
+        col_range[1] += ring
+    elif dx<0:
+        col_range[0] -= ring
+    if dy>0:
+        row_range[1] += ring
+    elif dy<0:
+        row_range[0] -= ring
+    center_col = (min_col+max_col-1)/2
+    center_row = (min_row+max_row-1)/2
+    tiles = []
+    for row in range(max(0, row_range[0]), min(img_info['rows'], row_range[1])):
+        for col in range(max(0, col_range[0]), min(img_info['columns'], col_range[1])):
+            if min_col<=col<max_col and min_row<=row<max_row:
+                continue
+            vx = col-center_col
+            vy = row-center_row
+            priority = math.sqrt(vx**2+vy**2)-(vx*dx+vy*dy)
+            tiles.append((priority, viewer.get_tile(file_info, img_info, col, row)))
+    tiles.sort(key=lambda tile: tile[0])
+    return [tile for priority, tile in tiles]
+
+def get_zoom_tiles(file_info, img_info):
+    """
+    Get the tiles in the viewer for the next and previous zoom levels
+    """
+    import toyz.web.viewer as viewer
+    scales = [s for s in zoom_scales if s<img_info['scale']][-1:]
+    scales += [s for s in zoom_scales if s>img_info['scale']][:1]
+    tiles = []
+    for scale in scales:
+        zoom_info = dict(img_info)
+        zoom_info['viewer'] = dict(img_info['viewer'])
+        zoom_info['viewer']['x_center'] *= scale/img_info['scale']
+        zoom_info['viewer']['y_center'] *= scale/img_info['scale']
+        zoom_info['viewer']['scale'] = scale
+        zoom_info['scale'] = scale
+        zoom_info['tiles'] = {}
+        zoom_info = viewer.get_img_info(file_info, zoom_info)
+        min_col, max_col, min_row, max_row = viewer.get_tile_bounds(file_info, zoom_info)
+        for row in range(min_row, max_row):
+            for col in range(min_col, max_col):
+                tiles.append((zoom_info, viewer.get_tile(file_info, zoom_info, col, row)))
+    return tiles
+
+def start_prefetch(file_info, img_info):
+    """
+    Cancel any tiles still being prefetched and start prefetching tiles around the
+    current viewer. The number of tiles around the viewer is set by the
+    ``prefetch_ring`` web setting (0 disables prefetching) and zoom levels are
+    prefetched if the ``prefetch_zoom`` setting is *True*.
+    """
+    cancel_prefetch()
+    toyz_settings = getattr(session_vars, 'toyz_settings', None)
+    ring = int(core.get_setting(toyz_settings, 'web', 'prefetch_ring'))
+    if ring<1:
+        return
+    img_info = dict(img_info)
+    img_info['tiles'] = {}
+    direction = get_pan_direction(file_info, img_info)
+    tiles = [(img_info, tile) for tile in get_ring_tiles(file_info, img_info, ring, direction)]
+    if core.get_setting(toyz_settings, 'web', 'prefetch_zoom'):
+        tiles += get_zoom_tiles(file_info, img_info)
+    session = session_vars.get_session()
+    session.prefetch_thread = TilePrefetcher(dict(file_info), tiles)
+    session.prefetch_thread.start()
@@ -0,0 +1,202 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Multi-resolution image pyramids used by the viewer when an image is zoomed out.
+Each level of the pyramid is half the width and height of the previous level, so a
+tile at scale < 1 only needs to read and resample data from the nearest level at or
+above the requested scale instead of the full resolution image. The levels count
+against the size of the file cache (see :py:class:`toyz.web.file_cache.FileCache` ),
+so the pyramids of an image are removed when the image is closed by the cache.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import math
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Set the default values for the sessions global variables if they have not already been set
+if not hasattr(session_vars, 'pyramids'):
+    session_vars.pyramids = OrderedDict()
+
+# Maximum number of pyramids stored for a session (for example when stepping through the
+# planes of a data cube). The least recently used pyramids are removed first.
+max_pyramids = 16
+
+# Pyramids are requested by every job (and the prefetch thread) running in the process
+pyramids_lock = threading.Lock()
+
+class ImagePyramid:
+    """
+    Power of two downsampled levels of a single image frame. Levels are built lazily the
+    first time they are needed, each from the level above it.
+    """
+    def __init__(self, filepath, data):
+        """
+        Initialize the pyramid with the full resolution data (level 0) of the image at
+        ``filepath``
+        """
+        self.filepath = filepath
+        self.levels = [data]
+        # Open file (in the file cache) and number of bytes the levels are counted against
+        self.charges = []
+        # Levels may be requested by more than one thread (for example when prefetching)
+        self.lock = threading.Lock()
+
+    def get_level(self, level):
+        """
+        Get the data for a given level, building it (and any levels above it) if they have
+        not been created yet. If the image is too small to downsample any further, the
+        smallest available level is returned.
+        """
+        new_bytes = 0
+        with self.lock:
+            while len(self.levels) <= level:
+                data = self.levels[-1]
+                if data.shape[0]<2 or data.shape[1]<2:
+                    break
+                self.levels.append(downsample(data))
+                new_bytes += self.levels[-1].nbytes
+            level = min(level, len(self.levels)-1)
+            data = self.levels[level]
+        if new_bytes>0:
+            from toyz.web.file_cache import get_file_cache
+            open_file = get_file_cache().add_size(self.filepath, new_bytes)
+            self.charges.append((open_file, new_bytes))
+        return level, data
+
+    def release(self):
+        """
+        Stop counting the levels against the size of the file cache (when the pyramid is
+        removed). This must not be called with the ``pyramids_lock`` held.
+        """
+        from toyz.web.file_cache import get_file_cache
+        file_cache = get_file_cache()
+        for open_file, nbytes in self.charges:
+            file_cache.release_size(self.filepath, open_file, nbytes)
+        self.charges = []
+
+def downsample(data, block_rows=256):
+    """
+    Average the finite pixels in each 2x2 block of pixels in ``data`` (blocks where every
+    pixel is NaN stay NaN). The image is read ``2*block_rows`` rows at a time, so memory
+    mapped or section based images are never fully loaded into memory.
+    """
+    height = data.shape[0]//2
+    width = data.shape[1]//2
+    level = np.empty((height, width), dtype=np.float32)
+    for y0 in range(0, height, block_rows):
+        yf = min(y0+block_rows, height)
+        block = np.array(data[y0*2:yf*2, :width*2], dtype=np.float32)
+        block = block.reshape(yf-y0, 2, width, 2)
+        bad = np.isnan(block)
+        block[bad] = 0
+        count = 4-bad.sum(axis=(1,3))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            level[y0:yf] = block.sum(axis=(1,3))/count
+    return level
+
+def get_level_number(scale):
+    """
+    Get the pyramid level with the smallest size that is still at or above ``scale``
+    """
+    if scale >= 1 or scale <= 0:
+        return 0
+    return int(math.floor(math.log(1/scale, 2)+1e-9))
+
+def get_pyramid(file_info, frame, data):
+    """
+    Get the pyramid for a given frame of an image, creating it if necessary
+    """
+    key = (file_info['filepath'], str(frame))
+    removed = []
+    with pyramids_lock:
+        pyramid = session_vars.pyramids.pop(key, None)
+        if pyramid is None:
+            pyramid = ImagePyramid(file_info['filepath'], data)
+            while len(session_vars.pyramids) >= max_pyramids:
+                removed.append(session_vars.pyramids.popitem(last=False)[1])
+        session_vars.pyramids[key] = pyramid
+    # The file cache may be waiting for the pyramids_lock to remove pyramids
+    for old_pyramid in removed:
+        old_pyramid.release()
+    return pyramid
+
+def clear_pyramids(filepath=None):
+    """
+    Remove the pyramids stored for the image at ``filepath`` or, if no ``filepath`` is
+    given, all of the pyramids stored for the current session
+    """
+    with pyramids_lock:
+        removed = [pyramid for key, pyramid in session_vars.pyramids.items()
+            if filepath is None or key[0]==filepath]
+        session_vars.pyramids = OrderedDict([(key, pyramid) for key, pyramid
+            in session_vars.pyramids.items() if filepath is not None and key[0]!=filepath])
+    for pyramid in removed:
+        pyramid.release()
+
+def get_level(file_info, img_info, data):
+    """
+    Get the data from the nearest pyramid level at or above the scale of the image, along
+    with a copy of ``img_info`` converted to the scale of the pyramid level. If pyramids
+    are disabled (using the ``image_pyramid`` web setting), the image is not zoomed out or
+    the resampling method is not ``NEAREST`` or ``MEAN`` the full resolution data and
+    ``img_info`` are returned.
+
+    Returns
+        - data (*numpy array* ): Data for the pyramid level
+        - img_info (*dict* ): Image info with ``width``, ``height`` and ``scale`` for the
+          pyramid level
+    """
+    toyz_settings = getattr(session_vars, 'toyz_settings', None)
+    level = get_level_number(img_info['scale'])
+    if level==0 or not core.get_setting(toyz_settings, 'web', 'image_pyramid'):
+        return data, img_info
+    # Pyramid levels are averages, so the MAX and MEDIAN resampling methods must use the
+    # full resolution data
+    if file_info['resampling'] not in ['NEAREST', 'MEAN']:
+        return data, img_info
+    pyramid = get_pyramid(file_info, img_info['frame'], data)
+    level, data = pyramid.get_level(level)
+    height, width = data.shape
+    img_info = dict(img_info)
+    img_info['width'] = width
+    img_info['height'] = height
+    img_info['scale'] = img_info['scale']*2**level
+    img_info['pyramid_level'] = level
+    return data, img_info
+
+def get_level_data(file_info, img_info, tile_info, data):
+    """
+    Get the data and image info for the nearest pyramid level (see
+    :py:func:`toyz.web.pyramid.get_level` ), along with a copy of ``tile_info`` with the
+    pixel indices of the tile in the pyramid level.
+
+    Returns
+        - data (*numpy array* ): Data for the pyramid level
+        - img_info (*dict* ): Image info with ``width``, ``height`` and ``scale`` for the
+          pyramid level
+        - tile_info (*dict* ): Tile info with the pixel indices in the pyramid level
+    """
+    data, img_info = get_level(file_info, img_info, data)
+    return data, img_info, get_level_tile(img_info, tile_info)
+
+def get_level_tile(level_info, tile_info):
+    """
+    Convert the pixel indices of a tile in the full resolution image into indices in the
+    pyramid level described by ``level_info`` (the ``img_info`` returned by 
+    :py:func:`toyz.web.pyramid.get_level_data` ).
+    """
+    if level_info.get('pyramid_level', 0)==0:
+        return tile_info
+    factor = 2**level_info['pyramid_level']
+    width = level_info['width']
+    height = level_info['height']
+    tile_info = dict(tile_info)
+    tile_info['x0_idx'] = min(tile_info['x0_idx']//factor, width)
+    tile_info['y0_idx'] = min(tile_info['y0_idx']//factor, height)
+    tile_info['xf_idx'] = min(int(math.ceil(tile_info['xf_idx']/factor)), width)
+    tile_info['yf_idx'] = min(int(math.ceil(tile_info['yf_idx']/factor)), height)
+    return tile_info
@@ -0,0 +1,195 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Tile rendering for non-FITS images (PNG, JPEG, TIFF, ...). Each image is decoded once
+into an array that is kept in the file cache (see :py:class:`toyz.web.file_cache.FileCache` ),
+so tiles are cropped from memory instead of decoding the image again for every tile.
+When the viewer is zoomed out, JPEG images are decoded at a reduced size (using the
+JPEG draft mode, which skips most of the decompression) and tiles are reduced by block
+averaging instead of resampling the full resolution image.
+"""
+from __future__ import print_function, division
+import math
+import numpy as np
+
+from toyz.utils.errors import ToyzJobError
+
+# Reduction factors available when decoding a JPEG image in draft mode
+draft_factors = [8, 4, 2]
+
+# PIL image modes that are kept in the decoded array, so the pixel values returned by
+# ``get_img_data`` are the values stored in the image. Images with other modes (for
+# example palette images) are converted to RGB or RGBA.
+native_modes = ['L', 'RGB', 'RGBA', 'I', 'I;16', 'I;16B', 'I;16L', 'F']
+
+def import_pil():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ToyzJobError(
+            "You must have PIL (Python Imaging Library) installed to "
+            "open files of this type"
+        )
+    return Image
+
+def get_draft_factor(img, scale):
+    """
+    Get the largest factor a JPEG image can be reduced by when it is decoded, while still
+    having at least as many pixels as the tiles at the given ``scale`` . Other image
+    formats are always decoded at full resolution (factor 1).
+    """
+    if img.format!='JPEG' or scale<=0:
+        return 1
+    for factor in draft_factors:
+        if factor <= 1/scale:
+            return factor
+    return 1
+
+def decode_image(filepath, factor=1):
+    """
+    Decode an image into an array with 1 (grayscale), 3 (RGB) or 4 (RGBA) channels. 
+    Grayscale images keep their native type (for example 16 bit integers or floats). If
+    ``factor`` is larger than 1 the image must be a JPEG, which is decoded in draft mode
+    with its width and height reduced by ``factor`` .
+    """
+    Image = import_pil()
+    img = Image.open(filepath)
+    try:
+        if factor>1:
+            width, height = img.size
+            img.draft(img.mode,
+                (int(math.ceil(width/factor)), int(math.ceil(height/factor))))
+        if img.mode not in native_modes:
+            if 'A' in img.mode or 'transparency' in img.info:
+                img = img.convert('RGBA')
+            else:
+                img = img.convert('RGB')
+        data = np.array(img)
+        # Big endian 16 bit images are stored in the native byte order
+        if not data.dtype.isnative:
+            data = data.astype(data.dtype.newbyteorder('='))
+    finally:
+        if hasattr(img, 'close'):
+            img.close()
+    return data
+
+def get_raster(file_info, scale=1):
+    """
+    Get the decoded data for an image, decoding the image if it is not in the file cache.
+
+    Parameters
+        - file_info (*dict* ): File info for the image
+        - scale (*float* ): Scale of the tiles that will be cut from the data. JPEG images
+          are decoded at a reduced size if the scale is 0.5 or smaller.
+
+    Returns
+        - data (*numpy array* ): Decoded image
+        - factor (*int* ): Factor the width and height of the image were reduced by
+    """
+    from toyz.web.viewer import get_file
+    from toyz.web.file_cache import get_file_cache
+    img = get_file(file_info)
+    factor = get_draft_factor(img, scale)
+    file_cache = get_file_cache()
+    frame = 'raster.{0}'.format(factor)
+    data = file_cache.get_frame(file_info['filepath'], frame)
+    if data is None:
+        data = decode_image(file_info['filepath'], factor)
+        file_cache.set_frame(file_info['filepath'], frame, data)
+    return data, factor
+
+def get_display_range(file_info, data, factor):
+    """
+    Get the range of pixel values mapped to 0-255 when a tile is rendered from an image
+    that is not 8 bit. 16 bit images use the full 16 bit range and other images (32 bit
+    integers or floats) use the minimum and maximum of the image, which is stored in the
+    file cache along with the decoded data.
+    """
+    from toyz.web.file_cache import get_file_cache
+    if data.dtype==np.uint16:
+        return 0, 65535
+    file_cache = get_file_cache()
+    frame = 'raster.{0}.range'.format(factor)
+    px_range = file_cache.get_frame(file_info['filepath'], frame)
+    if px_range is None:
+        finite = data[np.isfinite(data)]
+        if finite.size==0:
+            px_range = np.array([0, 1], dtype=np.float64)
+        else:
+            px_range = np.array([finite.min(), finite.max()], dtype=np.float64)
+        file_cache.set_frame(file_info['filepath'], frame, px_range)
+    return px_range[0], px_range[1]
+
+def to_display(data, px_min, px_max):
+    """
+    Convert the pixels in a tile from an image that is not 8 bit to 8 bit values
+    """
+    if px_max<=px_min:
+        px_max = px_min+1
+    data = (data.astype(np.float64)-px_min)*(255/(px_max-px_min))
+    data[~np.isfinite(data)] = 0
+    return np.uint8(np.clip(np.round(data), 0, 255))
+
+def resize(data, shape, resampling):
+    """
+    Resize a block of decoded image data to ``shape`` (height, width). When reducing the
+    image the ``MEAN``, ``MAX`` and ``MEDIAN`` resampling methods use block reduction
+    (see :py:func:`toyz.web.resample.block_reduce` ), which reshapes the data when the
+    reduction is an integer factor, and ``NEAREST`` samples the data without filtering.
+    Other resampling methods use the PIL filter with the same name.
+    """
+    from toyz.web import resample
+    if tuple(data.shape[:2])==tuple(shape):
+        return data
+    reduce = data.shape[0]>=shape[0] and data.shape[1]>=shape[1]
+    if reduce and resampling in resample.methods:
+        dtype = data.dtype
+        data = resample.block_reduce(data.astype(np.float32), shape, resampling)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            data = np.clip(np.round(data), info.min, info.max)
+        return data.astype(dtype)
+    if reduce and resampling=='NEAREST':
+        y_idx = (np.arange(shape[0])*(data.shape[0]/shape[0])).astype(int)
+        x_idx = (np.arange(shape[1])*(data.shape[1]/shape[1])).astype(int)
+        return data[y_idx[:,None], x_idx[None,:]]
+    Image = import_pil()
+    if resampling in resample.methods:
+        resampling = 'NEAREST'
+    dtype = data.dtype
+    # PIL can only resample 16 bit images with the NEAREST filter
+    if dtype==np.uint16:
+        data = data.astype(np.int32)
+    img = Image.fromarray(data).resize((shape[1], shape[0]), getattr(Image, resampling))
+    return np.asarray(img).astype(dtype)
+
+def render_tile(file_info, img_info, tile_info, raster=None):
+    """
+    Crop and scale a tile from a decoded image and return it as an 8 bit PIL image
+
+    Parameters
+        - file_info (*dict* ): File info for the image
+        - img_info (*dict* ): Image info for the frame
+        - tile_info (*dict* ): Tile info with the indices of the tile in the full
+          resolution image
+        - raster (*tuple*, optional): ``(data, factor)`` returned by
+          :py:func:`toyz.web.raster.get_raster` . If ``raster`` is not given it is loaded
+          from the file cache.
+    """
+    Image = import_pil()
+    if raster is None:
+        raster = get_raster(file_info, img_info['scale'])
+    data, factor = raster
+    height, width = data.shape[:2]
+    x0 = min(tile_info['x0_idx']//factor, width)
+    y0 = min(tile_info['y0_idx']//factor, height)
+    xf = min(int(math.ceil(tile_info['xf_idx']/factor)), width)
+    yf = min(int(math.ceil(tile_info['yf_idx']/factor)), height)
+    data = data[y0:yf, x0:xf]
+    if data.size==0 or tile_info['width']<=0 or tile_info['height']<=0:
+        return Image.new('L', (0, 0))
+    data = resize(data, (tile_info['height'], tile_info['width']), file_info['resampling'])
+    # The decoded image keeps its native type, tiles are always 8 bit
+    if data.dtype!=np.uint8:
+        data = to_display(data, *get_display_range(file_info, raster[0], factor))
+    return Image.fromarray(np.ascontiguousarray(data))
@@ -0,0 +1,129 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Vectorized block reduction used to downsample image data when the viewer is zoomed out.
+Each output pixel is the mean, max or median of the block of input pixels it covers,
+which avoids the aliasing caused by nearest neighbor sampling.
+"""
+from __future__ import print_function, division
+import numpy as np
+
+from toyz.utils.errors import ToyzJobError
+
+# Resampling methods (``file_info['resampling']`` ) implemented by block reduction
+methods = ['MEAN', 'MAX', 'MEDIAN']
+
+def area_sum(values, size_out, axis):
+    """
+    Sum ``values`` along one axis into ``size_out`` pixels. Each output pixel covers
+    ``size_in/size_out`` input pixels, so pixels on the edge of a block are split between
+    the two output pixels that overlap them. The whole pixels in each block are summed
+    (by adding the first, second, ... pixel of every block at once) and the parts of the
+    edge pixels outside of the block are corrected afterwards, so the cost is linear in
+    the number of pixels.
+
+    Returns
+        - sums (*numpy array* ): ``values`` with ``size_out`` pixels along ``axis``
+    """
+    size_in = values.shape[axis]
+    edges = np.arange(size_out+1)*(size_in/size_out)
+    edges[-1] = size_in
+    starts = np.ceil(edges).astype(int)
+    widths = np.diff(starts)
+    shape = [1, 1]
+    shape[axis] = size_out
+    sums = 0
+    for offset in range(int(widths.max())):
+        pixels = np.minimum(starts[:-1]+offset, size_in-1)
+        in_block = (offset<widths).astype(np.float32).reshape(shape)
+        sums = sums+in_block*np.take(values, pixels, axis=axis)
+    # Pixel containing each edge and the part of that pixel before the next whole pixel
+    edge_pixels = np.minimum(np.floor(edges).astype(int), size_in-1)
+    shape[axis] = size_out+1
+    weights = (starts-edges).astype(np.float32).reshape(shape)
+    corrections = weights*np.take(values, edge_pixels, axis=axis)
+    if axis==0:
+        return sums-corrections[1:]+corrections[:-1]
+    return sums-corrections[:,1:]+corrections[:,:-1]
+
+def reduce_mean(data, shape):
+    """
+    Average ``data`` into an array with the given ``shape`` . Integer factors are
+    reduced by reshaping the array, fractional factors by summing the area covered by
+    each output pixel along each axis (see :py:func:`toyz.web.resample.area_sum` ).
+    Pixels that are not finite are ignored.
+    """
+    height, width = data.shape
+    if height%shape[0]==0 and width%shape[1]==0:
+        y_factor = height//shape[0]
+        x_factor = width//shape[1]
+        reduce_sum = lambda values: values.reshape(
+            shape[0], y_factor, shape[1], x_factor).sum(axis=(1,3))
+    else:
+        reduce_sum = lambda values: area_sum(area_sum(values, shape[0], 0), shape[1], 1)
+    valid = np.isfinite(data)
+    if valid.all():
+        # Every output pixel covers the same area
+        return reduce_sum(np.asarray(data, dtype=np.float32))/(
+            (height/shape[0])*(width/shape[1]))
+    values = reduce_sum(np.where(valid, data, 0).astype(np.float32))
+    valid = reduce_sum(valid.astype(np.float32))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid>0, values/valid, np.nan)
+
+def reduce_max(data, shape):
+    """
+    Take the maximum of each block of ``data`` covered by a pixel in an array with the
+    given ``shape`` , one axis at a time. Pixels that are not finite are ignored.
+    """
+    y_starts = (np.arange(shape[0])*(data.shape[0]/shape[0])).astype(int)
+    x_starts = (np.arange(shape[1])*(data.shape[1]/shape[1])).astype(int)
+    data = np.fmax.reduceat(data, y_starts, axis=0)
+    return np.fmax.reduceat(data, x_starts, axis=1)
+
+def reduce_median(data, shape):
+    """
+    Take the median of each block of ``data`` . The median is not separable, so the data
+    is reduced by the nearest integer factor and then sampled to the given ``shape`` .
+    """
+    y_factor = max(1, int(round(data.shape[0]/shape[0])))
+    x_factor = max(1, int(round(data.shape[1]/shape[1])))
+    height = data.shape[0]//y_factor
+    width = data.shape[1]//x_factor
+    if height==0 or width==0:
+        return reduce_mean(data, shape)
+    blocks = data[:height*y_factor, :width*x_factor].reshape(height, y_factor, width, x_factor)
+    blocks = blocks.transpose(0, 2, 1, 3).reshape(height, width, y_factor*x_factor)
+    if hasattr(np, 'nanmedian'):
+        data = np.nanmedian(blocks, axis=2)
+    else:
+        data = np.median(blocks, axis=2)
+    y_idx = (np.arange(shape[0])*(height/shape[0])).astype(int)
+    x_idx = (np.arange(shape[1])*(width/shape[1])).astype(int)
+    return data[y_idx[:,None], x_idx[None,:]]
+
+def block_reduce(data, shape, method='MEAN'):
+    """
+    Downsample an image by reducing the block of pixels covered by each output pixel.
+
+    Parameters
+        - data (*numpy array* ): 2D (or 3D, with the channels in the last axis) image data
+        - shape (*tuple* ): ``(height, width)`` of the output array. This must not be
+          larger than the input array
+        - method (*string* ): ``MEAN``, ``MAX`` or ``MEDIAN``
+
+    Returns
+        - data (*numpy array* ): Downsampled data
+    """
+    shape = (max(1, min(shape[0], data.shape[0])), max(1, min(shape[1], data.shape[1])))
+    if method=='MEAN':
+        reduce_func = reduce_mean
+    elif method=='MAX':
+        reduce_func = reduce_max
+    elif method=='MEDIAN':
+        reduce_func = reduce_median
+    else:
+        raise ToyzJobError("Unrecognized resampling method '{0}'".format(method))
+    if data.ndim==3:
+        return np.dstack([reduce_func(data[:,:,c], shape) for c in range(data.shape[2])])
+    return reduce_func(data, shape)
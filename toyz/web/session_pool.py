@@ -0,0 +1,350 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Bounded pool of worker processes shared by all of the sessions (websocket connections)
+of the application, used instead of a separate job process for each session when the
+``session_workers`` web setting is larger than 0. Each session is assigned to a single
+worker, so its variables (see :py:mod:`toyz.web.session_vars` ) and the files and tiles
+cached by the worker stay in memory between jobs. Sessions are identified by their
+``(user_id, session_id)`` key. Workers are only started when all of
+the existing workers are busy, and a worker is stopped when it no longer has any
+sessions, so the number of processes depends on the load instead of the number of
+open browser tabs.
+
+When a session sends a job while every thread of its worker (see the ``job_workers``
+web setting) has been busy running jobs for other sessions for longer than the
+``session_move_delay`` web setting, the session (with its variables) is moved to an
+idle worker. The files and tiles cached by a worker are shared by all of its sessions
+and are not moved, so sessions are only moved when a worker is overloaded, not when it
+is briefly busy. The variables of a moved session are sent through the application's
+event loop, so sessions with variables larger than the ``session_move_size`` web setting
+stay on their worker. New sessions are always assigned to an idle worker (starting a new
+worker if necessary) when one is available.
+"""
+from __future__ import print_function, division
+import multiprocessing
+import pickle
+import time
+
+import tornado.ioloop
+
+from toyz.utils import core
+
+def worker_process(worker_id, pipe, app_pipe):
+    """
+    Process that runs the jobs for all of the sessions assigned to a worker. Besides jobs
+    the application may send the messages ``toyz_settings`` (sent when the worker starts
+    and when the settings change), ``cancel`` , ``close_session`` (remove the variables
+    for a session), ``export_session`` (send the variables for a session back to the
+    application so it can be moved to another worker) and ``import_session`` .
+    """
+    from toyz.web import session_vars
+    from toyz.web.job_executor import JobExecutor
+    from toyz.web import tile_pool
+    app_pipe.close()
+    executor = None
+    toyz_settings = None
+    while True:
+        try:
+            msg = pipe.recv()
+        except EOFError:
+            break
+        if 'toyz_settings' in msg:
+            toyz_settings = msg['toyz_settings']
+            # The tile pool is forked before the job threads are started
+            if executor is None:
+                tile_pool.start_tile_pool(toyz_settings)
+        elif 'cancel' in msg:
+            if executor is not None:
+                executor.cancel(msg['user_id'], msg['session_id'], msg['cancel'])
+        elif 'job' in msg:
+            if executor is None:
+                workers = core.get_setting(toyz_settings, 'web', 'job_workers')
+                executor = JobExecutor(pipe, workers)
+            executor.submit(toyz_settings, msg['job'])
+        elif 'close_session' in msg:
+            session_vars.remove_session(msg['close_session'])
+        elif 'export_session' in msg:
+            session_key = msg['export_session']
+            session = session_vars.remove_session(session_key)
+            state = None
+            moved = True
+            if session is not None:
+                max_size = core.get_setting(toyz_settings, 'web', 'session_move_size')
+                try:
+                    state = pickle.dumps(session, pickle.HIGHEST_PROTOCOL)
+                except Exception as error:
+                    # Keep the session in this worker if its variables cannot be copied
+                    print('Unable to move session {0}: {1}'.format(session_key, error))
+                    moved = False
+                else:
+                    if len(state)>max_size*1024*1024:
+                        # Large variables would block the application while they are sent
+                        print('Session {0} is too large to move ({1} bytes)'.format(
+                            session_key, len(state)))
+                        moved = False
+                if not moved:
+                    state = None
+                    session_vars.add_session(session)
+            result = {
+                'session_state': session_key,
+                'session': state,
+                'moved': moved
+            }
+            if executor is not None:
+                executor.send(result)
+            else:
+                pipe.send(result)
+        elif 'import_session' in msg:
+            session_vars.add_session(pickle.loads(msg['session']))
+    if executor is not None:
+        executor.close()
+    tile_pool.close_tile_pool()
+    print('worker_process {0} finished'.format(worker_id))
+
+class Worker:
+    """
+    Worker process in a :py:class:`toyz.web.session_pool.SessionPool`
+    """
+    def __init__(self, worker_id, on_result, settings_msg):
+        """
+        Parameters
+            - worker_id (*int* ): Id of the worker
+            - on_result (*function* ): Function called with the worker and each result it
+              sends to the application
+            - settings_msg (*dict* ): Message with the current settings
+              (see :py:meth:`toyz.web.app.ToyzWebApp.get_settings_msg` )
+        """
+        self.worker_id = worker_id
+        self.sessions = set()
+        # Number of jobs sent to the worker that have not finished
+        self.jobs = 0
+        # Time when every thread of the worker became busy (``None`` if a thread is idle)
+        self.busy_since = None
+        self.on_result = on_result
+        self.pipe, remote_pipe = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=worker_process, args=(worker_id, remote_pipe, self.pipe))
+        self.process.start()
+        remote_pipe.close()
+        self.send(settings_msg)
+        process_events = (tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
+        tornado.ioloop.IOLoop.current().add_handler(
+            self.pipe, self.rx_result, process_events)
+
+    def rx_result(self, pipe, events, error=None):
+        if events & tornado.ioloop.IOLoop.READ:
+            self.on_result(self, self.pipe.recv())
+        elif events & tornado.ioloop.IOLoop.ERROR:
+            print("ERROR: ", error)
+
+    def send(self, msg):
+        self.pipe.send(msg)
+
+    def close(self):
+        """
+        Stop the worker. The worker finishes any jobs it is running before it exits.
+        """
+        tornado.ioloop.IOLoop.current().remove_handler(self.pipe)
+        self.pipe.close()
+
+class SessionState:
+    """
+    Worker and jobs for a session in a :py:class:`toyz.web.session_pool.SessionPool`
+    """
+    def __init__(self, session_key, worker):
+        self.session_key = session_key
+        self.worker = worker
+        # Number of jobs sent by the session that have not finished
+        self.jobs = 0
+        # Worker the session is being moved to and the jobs received while it is moved
+        self.target = None
+        self.pending = []
+        # Sessions that cannot be moved (their variables are too large or cannot be
+        # copied) always stay on their worker
+        self.movable = True
+
+class SessionPool:
+    """
+    Pool of worker processes that run the jobs for all of the sessions in the application
+    """
+    def __init__(self, application, max_workers):
+        """
+        Parameters
+            - application ( :py:class:`toyz.web.app.ToyzWebApp` ): Application that
+              receives the results
+            - max_workers (*int* ): Maximum number of worker processes
+        """
+        self.application = application
+        self.max_workers = max(1, int(max_workers))
+        self.workers = []
+        self.sessions = {}
+        self.next_worker_id = 0
+
+    def get_worker(self, exclude=None):
+        """
+        Get the worker with the fewest unfinished jobs (and sessions). If every worker is
+        busy and the pool is not full a new worker is started.
+        """
+        workers = [worker for worker in self.workers if worker is not exclude]
+        if len(workers)>0:
+            worker = min(workers, key=lambda w: (w.jobs, len(w.sessions)))
+            if worker.jobs==0 or len(self.workers)>=self.max_workers:
+                return worker
+        if len(self.workers)>=self.max_workers:
+            return None
+        worker = Worker(self.next_worker_id, self.rx_result, 
+            self.application.get_settings_msg())
+        self.next_worker_id += 1
+        self.workers.append(worker)
+        return worker
+
+    def add_session(self, session_key):
+        """
+        Assign a new session to a worker
+        """
+        worker = self.get_worker()
+        worker.sessions.add(session_key)
+        self.sessions[session_key] = SessionState(session_key, worker)
+
+    def remove_session(self, session_key):
+        """
+        Remove a session from its worker and stop the worker if it has no other sessions
+        """
+        state = self.sessions.pop(session_key)
+        if state.target is None:
+            state.worker.send({'close_session': session_key})
+        else:
+            self.release(state.target, session_key)
+        self.release(state.worker, session_key)
+
+    def release(self, worker, session_key):
+        """
+        Remove a session from a worker, stopping the worker if it has no other sessions
+        """
+        worker.sessions.discard(session_key)
+        if len(worker.sessions)==0 and worker in self.workers:
+            self.workers.remove(worker)
+            worker.close()
+
+    def send_job(self, session_key, msg):
+        """
+        Send a job from a session to its worker. If the worker has been busy with jobs
+        from other sessions for longer than the ``session_move_delay`` web setting and
+        the session is not running any jobs, the session is moved to an idle worker first.
+        """
+        state = self.sessions[session_key]
+        if state.target is not None:
+            state.pending.append(msg)
+            return
+        worker = state.worker
+        toyz_settings = self.application.toyz_settings
+        move_delay = core.get_setting(toyz_settings, 'web', 'session_move_delay')
+        if (state.movable and state.jobs==0 and worker.busy_since is not None and
+                time.time()-worker.busy_since>=move_delay):
+            target = self.get_worker(exclude=worker)
+            if target is not None and target.jobs==0:
+                state.target = target
+                target.sessions.add(session_key)
+                state.pending.append(msg)
+                worker.send({'export_session': session_key})
+                return
+        self.dispatch(state, msg)
+
+    def update_settings(self, msg):
+        """
+        Send new settings to every worker
+        """
+        for worker in self.workers:
+            worker.send(msg)
+
+    def cancel_jobs(self, session_key, msg):
+        """
+        Cancel jobs sent by a session. Jobs waiting for the session to be moved to another
+        worker are cancelled immediately.
+        """
+        from toyz.web.job_executor import cancelled_result
+        state = self.sessions[session_key]
+        if state.target is not None:
+            request_ids = set(msg['cancel'])
+            websocket = self.application.get_websocket(*session_key)
+            pending = []
+            for job_msg in state.pending:
+                if job_msg['job']['id']['request_id'] in request_ids:
+                    if websocket is not None:
+                        websocket.write_result(cancelled_result(job_msg['job']['id']))
+                else:
+                    pending.append(job_msg)
+            state.pending = pending
+        state.worker.send(msg)
+
+    def dispatch(self, state, msg):
+        state.jobs += 1
+        state.worker.jobs += 1
+        self.update_busy(state.worker)
+        state.worker.send(msg)
+
+    def update_busy(self, worker):
+        """
+        Track how long every thread of a worker has been busy
+        """
+        threads = core.get_setting(self.application.toyz_settings, 'web', 'job_workers')
+        if worker.jobs<threads:
+            worker.busy_since = None
+        elif worker.busy_since is None:
+            worker.busy_since = time.time()
+
+    def move_session(self, worker, result):
+        """
+        Finish moving a session to another worker (after its variables are received from
+        its old worker) and send the jobs received while it was moved
+        """
+        session_key = result['session_state']
+        state = self.sessions.get(session_key, None)
+        if state is None:
+            # The session was closed while it was moved
+            if not result['moved'] and worker in self.workers:
+                worker.send({'close_session': session_key})
+            return
+        target = state.target
+        state.target = None
+        if result['moved']:
+            if result['session'] is not None:
+                target.send({'import_session': session_key, 'session': result['session']})
+            state.worker = target
+            self.release(worker, session_key)
+        else:
+            state.movable = False
+            self.release(target, session_key)
+        pending = state.pending
+        state.pending = []
+        for msg in pending:
+            self.dispatch(state, msg)
+
+    def rx_result(self, worker, result):
+        """
+        Send a result from a worker to the websocket of the session that sent the job
+        """
+        if 'session_state' in result:
+            self.move_session(worker, result)
+            return
+        job_id = result['id']
+        state = self.sessions.get((job_id['user_id'], job_id['session_id']), None)
+        if result.get('job_finished', False):
+            worker.jobs -= 1
+            self.update_busy(worker)
+            if state is not None:
+                state.jobs -= 1
+        websocket = self.application.get_websocket(job_id['user_id'], job_id['session_id'])
+        if websocket is not None:
+            websocket.write_result(result)
+
+    def get_stats(self):
+        """
+        Get the number of sessions and unfinished jobs for each worker
+        """
+        return [{
+            'worker_id': worker.worker_id,
+            'sessions': len(worker.sessions),
+            'jobs': worker.jobs
+        } for worker in self.workers]
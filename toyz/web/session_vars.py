@@ -1,3 +1,74 @@
 """
-Empty module used to store variables shared in a single Toyz session (websocket connection).
-""" 
\ No newline at end of file
+Module used to store variables shared in a single Toyz session (websocket connection).
+
+Caches stored as attributes of this module are shared by every session run in the same
+process. When several sessions share a worker process (see the ``session_workers`` web
+setting) the variables that belong to a single session, like its data sources and
+viewers, are stored in the :py:class:`toyz.web.session_vars.Session` returned by
+:py:func:`toyz.web.session_vars.get_session` .
+"""
+import threading
+
+class Session:
+    """
+    Variables that belong to a single session, identified by its
+    ``(user_id, session_id)`` key
+    """
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.data_sources = {}
+        self.viewports = {}
+        self.prefetch_thread = None
+        self.prefetch_centers = {}
+
+    def __getstate__(self):
+        # The prefetch thread is not copied when a session is moved to another process
+        state = dict(self.__dict__)
+        state['prefetch_thread'] = None
+        return state
+
+sessions = {}
+sessions_lock = threading.Lock()
+# Lock used to create the caches shared by every job running in a process
+cache_lock = threading.Lock()
+# Keys (see :py:func:`toyz.utils.core.get_job_key` ) of running jobs that were cancelled
+cancelled_jobs = set()
+# Session of the job running in the current thread
+current = threading.local()
+
+def set_session(session_id):
+    """
+    Set the session of the job running in the current thread
+    """
+    current.session_id = session_id
+
+def get_session(session_id=None):
+    """
+    Get the variables for a session (by default the session of the job running in the
+    current thread), creating them the first time they are needed
+    """
+    if session_id is None:
+        session_id = getattr(current, 'session_id', None)
+    with sessions_lock:
+        if session_id not in sessions:
+            sessions[session_id] = Session(session_id)
+        return sessions[session_id]
+
+def add_session(session):
+    """
+    Add the variables for a session moved from another process
+    """
+    with sessions_lock:
+        sessions[session.session_id] = session
+
+def remove_session(session_id):
+    """
+    Remove the variables for a session and stop its prefetch thread. Returns the
+    removed session (or ``None`` if the session did not exist).
+    """
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is not None and session.prefetch_thread is not None:
+        session.prefetch_thread.cancel()
+        session.prefetch_thread = None
+    return session
@@ -133,6 +133,7 @@ Toyz.Core.Websocket.prototype.send_task = function(request){
         this.requests[task.id.request_id.toString()]=request;
         //console.log('sending', task);
         this.ws.send(JSON.stringify(task));
+        return task.id.request_id;
     }else if(this.ws.readyState>1){
         // TODO: Warn user connection was lost and give the option to reconnect
         if(this.logger){
@@ -150,6 +151,22 @@ Toyz.Core.Websocket.prototype.send_task = function(request){
         this.queue.push(request);
     };
 };
+// Cancel tasks sent to the server that are no longer needed. Tasks that have not started
+// are removed from the servers queue and running tasks are asked to stop. 
+Toyz.Core.Websocket.prototype.cancel_tasks = function(request_ids){
+    request_ids = request_ids.filter(function(request_id){
+        return request_id!==undefined;
+    });
+    if(this.ws.readyState==1 && request_ids.length>0){
+        this.ws.send(JSON.stringify({
+            id: {
+                user_id: this.user_id,
+                session_id: this.session_id
+            },
+            cancel: request_ids
+        }));
+    };
+};
 Toyz.Core.Websocket.prototype.connect_ws = function(options){
     options = $.extend(true, {}, options);
     var url="ws://"+location.host+this.job_url;
@@ -157,6 +174,7 @@ Toyz.Core.Websocket.prototype.connect_ws = function(options){
         url = url + options.session_id
     };
     this.ws = new WebSocket(url);
+    this.ws.binaryType = 'arraybuffer';
         
     if(this.hasOwnProperty('onopen')){
         this.ws.onopen = this.onopen;
@@ -202,12 +220,24 @@ Toyz.Core.Websocket.prototype.connect_ws = function(options){
     }
 	this.ws.onmessage=function(event){
         //console.log('event', event);
+        if(event.data instanceof ArrayBuffer){
+            this.rx_binary_frame(event.data);
+            return;
+        };
 		var result = JSON.parse(event.data);
         var request = this.requests[result.request_id];
         // For initialization, there won't be a request stored
         if(request===undefined){
             request = {};
         };
+        // The server cancelled the request, so no more responses will be received
+        if(result.id=='cancelled'){
+            if(request.hasOwnProperty('cancelled')){
+                request.cancelled(result);
+            };
+            delete this.requests[result.request_id];
+            return;
+        };
         // Special cases of responses from the server
         var responses = {
             ERROR: 'rx_error',
@@ -240,6 +270,21 @@ Toyz.Core.Websocket.prototype.connect_ws = function(options){
         };
 	}.bind(this);
 };
+// Binary messages from the server start with a little-endian uint32 header length,
+// followed by a JSON header and the binary payload. The header and payload are sent
+// to the rx_binary function of the request that created them.
+Toyz.Core.Websocket.prototype.rx_binary_frame = function(data){
+    var header_length = new DataView(data).getUint32(0, true);
+    var header = JSON.parse(String.fromCharCode.apply(
+        null, new Uint8Array(data, 4, header_length)));
+    var payload = data.slice(4+header_length);
+    var request = this.requests[header.request_id];
+    if(request!==undefined && request.hasOwnProperty('rx_binary')){
+        request.rx_binary(header, payload);
+    }else{
+        console.log('No request found for binary message', header);
+    };
+};
 Toyz.Core.Websocket.prototype.init_ws = function(result){
     this.user_id = result.user_id;
     this.session_id = result.session_id;
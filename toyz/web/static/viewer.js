@@ -519,15 +519,24 @@ Toyz.Viewer.Controls = function(options){
                     y: y,
                     width: 400,
                     height: 200,
-                    scale: true
+                    scale: true,
+                    encoding: 'binary',
+                    dtype: 'float32'
                 };
+                var region = {};
                 websocket.send_task({
                     task: {
                         module: 'toyz.web.tasks',
                         task: 'get_img_data',
                         parameters: params
                     },
-                    callback: function(options, params, result){
+                    rx_binary: function(region, header, payload){
+                        region.data = Toyz.Viewer.decode_data(header, payload);
+                    }.bind(this, region),
+                    callback: function(options, params, region, result){
+                        if(result.encoding=='binary'){
+                            result.data = region.data;
+                        };
                         if(!this.workspace.hasOwnProperty('colorpad')){
                             this.workspace.colorpad = new Toyz.Viewer.Colorpad({
                                 img_info: params.img_info,
@@ -559,7 +568,7 @@ Toyz.Viewer.Controls = function(options){
                                 data: result.data
                             });
                         };
-                    }.bind(this, options, params)
+                    }.bind(this, options, params, region)
                 });
             }.bind(options.parent)
         }
@@ -1020,27 +1029,80 @@ Toyz.Viewer.Contents.prototype.rx_img_info = function(viewer_frame, file_frame,
         });
     };
 };
+// Move the viewer and load the tiles that entered it. The server keeps track of the 
+// tiles in each viewer, so the file and image info are only sent when the viewer is
+// registered or the image info has changed, otherwise only the viewer position is sent.
 Toyz.Viewer.Contents.prototype.get_tile_map = function(viewer_frame, file_frame){
-    var file_info = $.extend(true, {}, this.frames[viewer_frame].file_info);
-    //console.log('viewer frame in get_tile_map', viewer_frame,file_info);
-    delete file_info['images'];
+    var frame = this.frames[viewer_frame];
+    var img_info = frame.file_info.images[file_frame];
+    var params = {
+        viewer_id: viewer_frame+':'+file_frame,
+        viewer: img_info.viewer
+    };
+    if(frame.viewport_info!==img_info){
+        var file_info = $.extend(true, {}, frame.file_info);
+        delete file_info['images'];
+        params.file_info = file_info;
+        params.img_info = $.extend(true, {}, img_info);
+        delete params.img_info['tiles'];
+        params.loaded = [];
+        for(var tile_idx in img_info.tiles){
+            if(img_info.tiles.hasOwnProperty(tile_idx) && img_info.tiles[tile_idx].loaded){
+                params.loaded.push(tile_idx);
+            };
+        };
+        frame.viewport_info = img_info;
+    };
+    var sources = {};
+    var placed = {};
     websocket.send_task({
         task: {
             module: 'toyz.web.tasks',
-            task: 'get_tile_info',
-            parameters: {
-                file_info: file_info,
-                img_info: this.frames[viewer_frame].file_info.images[file_frame]
-            }
+            task: 'update_viewport',
+            parameters: params
         },
-        callback: function(viewer_frame, file_frame, result){
-            this.frames[viewer_frame].file_info.images[file_frame].tiles = $.extend(
-                true, 
-                this.frames[viewer_frame].file_info.images[file_frame].tiles,
-                result.new_tiles
-            );
-            this.get_img_tiles(viewer_frame, file_frame, result.new_tiles)
-        }.bind(this, viewer_frame, file_frame)
+        rx_binary: function(sources, header, payload){
+            var blob = new Blob([payload], {type: 'image/'+header.format});
+            sources[header.idx] = {
+                src: URL.createObjectURL(blob),
+                col: header.col,
+                row: header.row
+            };
+        }.bind(this, sources),
+        callback: function(viewer_frame, file_frame, sources, placed, result){
+            var file_info = this.frames[viewer_frame].file_info;
+            var tiles = {};
+            // Streamed tiles are positioned using their column and row
+            for(var tile_idx in sources){
+                if(sources.hasOwnProperty(tile_idx)){
+                    var x = sources[tile_idx].col*file_info.tile_width;
+                    var y = sources[tile_idx].row*file_info.tile_height;
+                    tiles[tile_idx] = {
+                        idx: tile_idx,
+                        col: sources[tile_idx].col,
+                        row: sources[tile_idx].row,
+                        left: x,
+                        right: x,
+                        top: y,
+                        bottom: y,
+                        src: sources[tile_idx].src,
+                        loaded: false
+                    };
+                };
+            };
+            if(result.hasOwnProperty('tiles')){
+                $.extend(tiles, result.tiles);
+            };
+            for(var tile_idx in tiles){
+                if(tiles.hasOwnProperty(tile_idx) && !placed.hasOwnProperty(tile_idx)){
+                    placed[tile_idx] = true;
+                    this.rx_tile_info(viewer_frame, file_frame, tile_idx, {
+                        success: true,
+                        tile_info: tiles[tile_idx]
+                    });
+                };
+            };
+        }.bind(this, viewer_frame, file_frame, sources, placed)
     });
 };
 Toyz.Viewer.Contents.prototype.get_img_tiles = function(viewer_frame, file_frame, tiles){
@@ -1057,22 +1119,51 @@ Toyz.Viewer.Contents.prototype.get_img_tiles = function(viewer_frame, file_frame
         this.$tile_div.scrollLeft(img_info.viewer.left);
     };
     
-    for(var tile_idx in tiles){
-        if(tiles.hasOwnProperty(tile_idx)){
-            //console.log('tile', tiles[tile_idx]);
-            websocket.send_task({
-                task: {
-                    module: 'toyz.web.tasks',
-                    task: 'get_img_tile',
-                    parameters: {
-                        file_info: file_info,
-                        img_info: img_info,
-                        tile_info: tiles[tile_idx]
-                    }
-                },
-                callback: this.rx_tile_info.bind(this, viewer_frame, file_frame, tile_idx)
-            });
-        }
+    if($.isEmptyObject(tiles)){
+        return;
+    };
+    // Request all of the new tiles in a single job. If the tiles are streamed, each tile
+    // is received as a binary message before the response
+    var frame = this.frames[viewer_frame];
+    var tile_key = [file_info.filepath, file_frame, img_info.scale].join(':');
+    // Tiles still being loaded for a different image, frame or scale are no longer needed
+    if(frame.tile_request!==undefined && frame.tile_request.key!=tile_key){
+        websocket.cancel_tasks([frame.tile_request.request_id]);
+    };
+    var sources = {};
+    var request_id = websocket.send_task({
+        task: {
+            module: 'toyz.web.tasks',
+            task: 'get_img_tiles',
+            parameters: {
+                file_info: file_info,
+                img_info: img_info,
+                tiles: tiles,
+                stream: file_info.stream_tiles===true
+            }
+        },
+        rx_binary: function(sources, header, payload){
+            var blob = new Blob([payload], {type: 'image/'+header.format});
+            sources[header.idx] = URL.createObjectURL(blob);
+        }.bind(this, sources),
+        callback: function(viewer_frame, file_frame, sources, result){
+            for(var tile_idx in result.tiles){
+                if(result.tiles.hasOwnProperty(tile_idx)){
+                    var tile_info = result.tiles[tile_idx];
+                    if(sources.hasOwnProperty(tile_idx)){
+                        tile_info.src = sources[tile_idx];
+                    };
+                    this.rx_tile_info(viewer_frame, file_frame, tile_idx, {
+                        success: true,
+                        tile_info: tile_info
+                    });
+                };
+            };
+        }.bind(this, viewer_frame, file_frame, sources)
+    });
+    frame.tile_request = {
+        key: tile_key,
+        request_id: request_id
     };
 };
 Toyz.Viewer.Contents.prototype.rx_tile_info = function(
@@ -1100,8 +1191,16 @@ Toyz.Viewer.Contents.prototype.rx_tile_info = function(
                 .css(tile_pos);
             this.frames[viewer_frame].$viewer.append($img);
             tile.loaded = true;
+            if(tile.hasOwnProperty('src')){
+                URL.revokeObjectURL(tile.src);
+                delete tile.src;
+            };
         }.bind(this, viewer_frame, img, img_info, tile_idx);
-        img.src = '/file'+img_info.tiles[tile_idx].new_filepath;
+        if(img_info.tiles[tile_idx].hasOwnProperty('src')){
+            img.src = img_info.tiles[tile_idx].src;
+        }else{
+            img.src = '/file'+img_info.tiles[tile_idx].new_filepath;
+        };
         img.ondragstart = function(){return false;};
     }else{
         console.log('tile did not need to be created');
@@ -1383,6 +1482,35 @@ Toyz.Viewer.set_pixel = function(image_data, x, y, r, g, b, a){
     image_data.data[index+2] = b;
     image_data.data[index+3] = a;
 };
+// Decode a region of an image sent as a binary message into an array of rows.
+// Quantized (integer) data is converted back to pixel values, with NaN pixels restored.
+Toyz.Viewer.decode_data = function(header, payload){
+    var types = {
+        float64: Float64Array,
+        float32: Float32Array,
+        uint16: Uint16Array,
+        uint8: Uint8Array
+    };
+    var values = new types[header.dtype](payload);
+    if(header.hasOwnProperty('scale')){
+        var pixels = new Float32Array(values.length);
+        for(var i=0; i<values.length; i++){
+            if(values[i]==header.nan_value){
+                pixels[i] = NaN;
+            }else{
+                pixels[i] = header.offset+header.scale*values[i];
+            };
+        };
+        values = pixels;
+    };
+    var height = header.shape[0];
+    var row_length = values.length/height;
+    var data = [];
+    for(var row=0; row<height; row++){
+        data.push(values.subarray(row*row_length, (row+1)*row_length));
+    };
+    return data;
+};
 // Map a 2D image to a canvas context imageData object
 Toyz.Viewer.map_image=function(image, ctx, img_info){
     var image_data = ctx.createImageData(image[0].length, image.length);
@@ -219,7 +219,9 @@ def update_toyz_settings(toyz_settings, tid, params):
     response = {
         'id': 'notification',
         'msg': 'Settings saved successfully',
-        'func': 'update_toyz_settings'
+        'func': 'update_toyz_settings',
+        # Reload the settings in the application and send them to every session
+        'update_app': ['toyz_settings']
     }
     
     return response
@@ -455,9 +457,7 @@ def load_data_file(toyz_settings, tid, params):
         if hasattr(config, 'src_types'):
             src_types.update(config.src_types)
     
-    # If this is the first data source, define variable to keep track of data sources
-    if not hasattr(session_vars, 'data_sources'):
-        session_vars.data_sources = {}
+    data_sources = session_vars.get_session().data_sources
     
     # Load the data into a data object
     src_id = params['src_id']
@@ -472,14 +472,14 @@ def load_data_file(toyz_settings, tid, params):
     else:
         data_type = None
     
-    session_vars.data_sources[src_id] = src_types[src_type](
+    data_sources[src_id] = src_types[src_type](
         user_id=tid['user_id'], data_type=data_type, paths=params['paths'])
-    session_vars.data_sources[src_id].src_id = src_id
-    session_vars.data_sources[src_id].name = src_id
+    data_sources[src_id].src_id = src_id
+    data_sources[src_id].name = src_id
     
     response = {
         'id': 'data_file',
-        'columns': session_vars.data_sources[src_id].columns,
+        'columns': data_sources[src_id].columns,
     }
     return response
 
@@ -487,7 +487,7 @@ def save_data_file(toyz_settings, tid ,params):
     """
     Save a data source.
     """
-    src = session_vars.data_sources[params['src_id']]
+    src = session_vars.get_session().data_sources[params['src_id']]
     new_file_options = src.save(params['save_paths'])
     response = {
         'id': 'save_data_file',
@@ -501,8 +501,9 @@ def get_src_columns(toyz_settings, tid, params):
     Get column information from multiple sources and return to a workspace
     """
     sources = {}
+    data_sources = session_vars.get_session().data_sources
     for src_id, src in params.items():
-        if not hasattr(session_vars, 'data_sources') or src_id not in session_vars.data_sources:
+        if src_id not in data_sources:
             print('loading data source')
             load_data_file(toyz_settings, tid, params['params'])
         if len(src['columns'])>0:
@@ -510,7 +511,7 @@ def get_src_columns(toyz_settings, tid, params):
                 'data_type': 'columns',
                 'data': {}
             }
-            sources[src_id]['data'] = session_vars.data_sources[src_id].to_dict(src['columns'])
+            sources[src_id]['data'] = data_sources[src_id].to_dict(src['columns'])
     response = {
         'id': 'src_columns',
         'sources': sources
@@ -521,7 +522,7 @@ def remove_datapoints(toyz_settings, tid, params):
     """
     Remove a point from a data source
     """
-    src = session_vars.data_sources[params['src_id']]
+    src = session_vars.get_session().data_sources[params['src_id']]
     src.remove_rows(params['points'])
     response = {
         'id': 'notification',
@@ -789,6 +790,10 @@ def get_tile_info(toyz_settings, tid, params):
     
     all_tiles, new_tiles = viewer.get_tile_info(params['file_info'], params['img_info'])
     
+    # Render the tiles surrounding the viewer in the background
+    from toyz.web import prefetch
+    prefetch.start_prefetch(params['file_info'], params['img_info'])
+    
     #print('all tile:', all_tiles)
     
     response = {
@@ -798,6 +803,105 @@ def get_tile_info(toyz_settings, tid, params):
     }
     return response
 
+def update_viewport(toyz_settings, tid, params):
+    """
+    Move an image viewer and render the tiles that entered it. The server keeps the state
+    of each viewer (see :py:mod:`toyz.web.viewport` ), so after the viewer is registered 
+    the client only sends its new position.
+    
+    Params
+        - viewer_id (*string* ): Unique id of the viewer in the client
+        - viewer (*dict* ): Position of the viewer (``x_center``, ``y_center``, ``width``,
+          ``height``, ``left``, ``right``, ``top`` and ``bottom`` )
+        - file_info (*dict*, optional): File info for the image. This is required
+          (along with ``img_info`` ) to register a viewer or reset it when the image, frame,
+          scale or colormap change.
+        - img_info (*dict*, optional): Image info for the frame
+        - loaded (*list*, optional): Indices (``'col,row'`` ) of the tiles the client has
+          already loaded when the viewer is registered
+    
+    Response
+        - id: 'viewport'
+        - viewer_id (*string* ): Id of the viewer
+        - entered (*list* ): Flat list ``[col0, row0, col1, row1, ...]`` of the tiles that 
+          entered the viewer. If the file streams tiles, each tile is sent as a binary 
+          message (see :py:func:`toyz.web.tasks.get_img_tiles` ) and rendered tiles are 
+          sent in batches (with the id ``viewport tiles`` ) as they are finished
+        - left (*list* ): Flat list of the tiles that are no longer visible
+        - tiles (*dict* ): Tile info for the entered tiles if the file does not stream tiles
+    
+    If the job is cancelled (or superseded by a newer update of the same viewer) before all
+    of the tiles are rendered, the finished tiles are sent and the response has the id
+    ``cancelled`` . The remaining tiles are sent by the next update of the viewer.
+    """
+    import toyz.web.viewer as viewer
+    from toyz.web import viewport
+    from toyz.web import prefetch
+    
+    core.check4keys(params, ['viewer_id', 'viewer'])
+    if 'img_info' in params:
+        core.check4keys(params, ['file_info'])
+        if tid['user_id']!='admin':
+            permissions = file_access.get_parent_permissions(
+                toyz_settings.db, params['file_info']['filepath'], user_id=tid['user_id'])
+            if permissions is None or 'r' not in permissions:
+                raise ToyzJobError(
+                    'You do not have permission to view the requested file.'
+                    'Please contact your network administrator if you believe this is an error.')
+        state = viewport.set_viewport(params['viewer_id'], params['file_info'], 
+            params['img_info'], params.get('loaded', []))
+    else:
+        state = viewport.get_viewport(params['viewer_id'])
+        if state is None:
+            raise ToyzJobError("Viewer '{0}' has not been registered".format(
+                params['viewer_id']))
+    entered, left = state.update(params['viewer'])
+    stream = state.file_info.get('stream_tiles', False)
+    
+    def build_response(tiles, encoded):
+        response = {'id': 'viewport tiles'}
+        if stream:
+            response['binary_frames'] = [({
+                'id': 'tile',
+                'idx': tile_idx,
+                'row': tiles[tile_idx]['row'],
+                'col': tiles[tile_idx]['col'],
+                'format': state.file_info['tile_format']
+            }, tile) for tile_idx, tile in encoded.items()]
+        else:
+            response['tiles'] = tiles
+        return response
+    
+    # Send each batch of tiles as soon as it is finished. The last batch is sent with
+    # the response to the task
+    response = None
+    all_tiles = {}
+    for tiles, encoded in viewer.iter_tiles(
+            state.file_info, state.img_info, state.get_tiles(entered), stream):
+        if response is not None:
+            core.send_response(tid, response)
+        response = build_response(tiles, encoded)
+        all_tiles.update(tiles)
+        if core.job_cancelled(tid):
+            core.send_response(tid, response)
+            state.unload([(col, row) for col, row in entered 
+                if '{0},{1}'.format(col, row) not in all_tiles])
+            return {'id': 'cancelled'}
+    if response is None:
+        response = build_response({}, {})
+    response.update({
+        'id': 'viewport',
+        'viewer_id': params['viewer_id'],
+        'entered': viewport.flatten(entered),
+        'left': viewport.flatten(left)
+    })
+    if not stream:
+        response['tiles'] = all_tiles
+    
+    # Render the tiles surrounding the viewer in the background
+    prefetch.start_prefetch(state.file_info, state.img_info)
+    return response
+
 def get_img_tile(toyz_settings, tid, params):
     """
     Load a tile from a larger image and notify the client it has been created
@@ -824,6 +928,75 @@ def get_img_tile(toyz_settings, tid, params):
     
     return response
 
+def get_img_tiles(toyz_settings, tid, params):
+    """
+    Load a set of tiles (usually all of the ``new_tiles`` returned by 
+    :py:func:`toyz.web.tasks.get_tile_info` ) from a larger image in a single job
+    
+    Params
+        - file_info (*dict* ): File info for the image
+        - img_info (*dict* ): Image info for the frame
+        - tiles (*dict* ): Dictionary of ``tile_idx: tile_info`` for each tile to load
+        - stream (*bool*, optional): If *True* each tile is sent to the client as a 
+          binary websocket message (with a header containing the tile ``idx``, ``row`` 
+          and ``col`` ) instead of being saved to the sessions temp directory
+    
+    Response
+        - id: 'tiles created'
+        - tiles (*dict* ): Dictionary of ``tile_idx: tile_info`` for each tile created.
+          If the tiles are rendered in batches (for example by a tile pool) a response 
+          is sent for each batch.
+        - timings (*dict* ): Dictionary of ``tile_idx: timings`` with the time (in seconds)
+          spent decoding (non-FITS images only), cropping and encoding each new tile
+    
+    If the job is cancelled by the client, the tiles that are finished are sent and the 
+    response has the id ``cancelled`` .
+    """
+    import toyz.web.viewer as viewer
+    
+    core.check4keys(params, ['img_info', 'file_info', 'tiles'])
+    if tid['user_id']!='admin':
+        permissions = file_access.get_parent_permissions(
+            toyz_settings.db, params['file_info']['filepath'], user_id=tid['user_id'])
+        if 'r' not in permissions:
+            raise ToyzJobError(
+                'You do not have permission to view the requested file.'
+                'Please contact your network administrator if you believe this is an error.')
+    
+    stream = 'stream' in params and params['stream']
+    
+    def build_response(tiles, encoded):
+        response = {
+            'id': 'tiles created',
+            'tiles': tiles,
+            'timings': {tile_idx: timings[tile_idx] for tile_idx in tiles 
+                if tile_idx in timings}
+        }
+        if stream:
+            response['binary_frames'] = [({
+                'id': 'tile',
+                'idx': tile_idx,
+                'row': tiles[tile_idx]['row'],
+                'col': tiles[tile_idx]['col'],
+                'format': params['file_info']['tile_format']
+            }, tile) for tile_idx, tile in encoded.items()]
+        return response
+    
+    # Send each batch of tiles to the client as soon as it is finished. The last batch
+    # is returned as the response to the task
+    timings = {}
+    response = build_response({}, {})
+    for tiles, encoded in viewer.iter_tiles(
+            params['file_info'], params['img_info'], params['tiles'], stream, timings):
+        if len(response['tiles'])>0:
+            core.send_response(tid, response)
+        response = build_response(tiles, encoded)
+        if core.job_cancelled(tid):
+            core.send_response(tid, response)
+            return {'id': 'cancelled'}
+    
+    return response
+
 def get_img_data(toyz_settings, tid, params):
     """
     Get data from an image or FITS file
@@ -833,4 +1006,47 @@ def get_img_data(toyz_settings, tid, params):
     
     response = viewer.get_img_data(**params)
     #print('response:', response)
-    return response
\ No newline at end of file
+    return response
+
+def get_viewer_stats(toyz_settings, tid, params):
+    """
+    Get performance statistics for the image viewer in the current session
+    
+    Parameters
+        - toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings`): Settings for the toyz 
+          application
+        - tid (*string* ): Task ID of the client user running the task
+        - params (*dict* ): Any parameters sent by the client (**None** for this function)
+    
+    Response
+        - id: 'viewer_stats'
+        - tile_cache (*dict* ): hits, misses, evictions, number of tiles, size and maximum
+          size (in bytes) of the tile cache
+        - tile_store (*dict* ): hits, misses (for the current session), number of tiles,
+          size and maximum size (in bytes) of the persistent tile store, or ``None`` if
+          the tile store is disabled
+        - file_cache (*dict* ): hits, misses, evictions, number of open files, size and
+          maximum size (in bytes) of the session's cache of open files
+        - decompressed_cache (*dict* ): hits, misses, number of blocks, size and maximum
+          size (in bytes) of the session's cache of decompressed blocks
+        - memory (*int* ): Resident memory (in bytes) of the session's job process
+        - fits_access (*string* ): Method used to read FITS files
+    """
+    import toyz.web.viewer as viewer
+    from toyz.web.tile_cache import get_tile_cache
+    from toyz.web.tile_store import get_tile_store
+    from toyz.web.file_cache import get_file_cache
+    from toyz.web.compressed import get_block_cache
+    tile_store = get_tile_store(toyz_settings)
+    if tile_store is not None:
+        tile_store = tile_store.get_stats()
+    response = {
+        'id': 'viewer_stats',
+        'tile_cache': get_tile_cache().get_stats(),
+        'tile_store': tile_store,
+        'file_cache': get_file_cache().get_stats(),
+        'decompressed_cache': get_block_cache().get_stats(),
+        'memory': core.get_memory_usage(),
+        'fits_access': viewer.get_fits_access()
+    }
+    return response
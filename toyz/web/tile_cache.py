@@ -0,0 +1,130 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+In-memory cache of encoded image tiles. Tiles are stored by the parameters used to
+render them, so any request for a tile that has already been rendered by the process
+is served from memory instead of slicing, colormapping and encoding the image again.
+The cache belongs to a process, so it is shared by all of the sessions assigned to the
+same worker when the ``session_workers`` web setting is larger than 0, but each session
+has its own cache otherwise. Tiles are shared by every session (and across restarts)
+through the persistent tile store (see :py:mod:`toyz.web.tile_store` ).
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import threading
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+class TileCache:
+    """
+    Least recently used (LRU) cache of encoded tiles with a maximum size in bytes.
+    """
+    def __init__(self, max_bytes):
+        """
+        Initialize an empty cache
+
+        Parameters
+            - max_bytes (*int* ): Maximum number of bytes stored in the cache. When a new
+              tile exceeds this budget the least recently used tiles are removed.
+        """
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get an encoded tile from the cache. Returns ``None`` if the tile is not cached.
+        """
+        with self.lock:
+            if key in self.tiles:
+                tile = self.tiles.pop(key)
+                self.tiles[key] = tile
+                self.hits += 1
+                return tile
+            self.misses += 1
+        return None
+
+    def set(self, key, tile):
+        """
+        Add an encoded tile (*bytes* ) to the cache, removing the least recently used
+        tiles if the cache is full. Tiles larger than the cache are not stored.
+        """
+        tile_size = len(tile)
+        if tile_size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.tiles:
+                self.size -= len(self.tiles.pop(key))
+            while self.size+tile_size > self.max_bytes and len(self.tiles)>0:
+                old_key, old_tile = self.tiles.popitem(last=False)
+                self.size -= len(old_tile)
+                self.evictions += 1
+            self.tiles[key] = tile
+            self.size += tile_size
+
+    def clear(self):
+        """
+        Remove all tiles from the cache
+        """
+        with self.lock:
+            self.tiles = OrderedDict()
+            self.size = 0
+
+    def get_stats(self):
+        """
+        Get the hit/miss counters and current size of the cache
+        """
+        with self.lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'tiles': len(self.tiles),
+                'size': self.size,
+                'max_size': self.max_bytes
+            }
+        return stats
+
+def get_tile_cache():
+    """
+    Get the tile cache for the current process, creating it the first time it is needed.
+    The size of the cache is set by the ``tile_cache_size`` web setting (in MB).
+    """
+    with session_vars.cache_lock:
+        if getattr(session_vars, 'tile_cache', None) is None:
+            toyz_settings = getattr(session_vars, 'toyz_settings', None)
+            cache_size = core.get_setting(toyz_settings, 'web', 'tile_cache_size')
+            session_vars.tile_cache = TileCache(int(cache_size*1024*1024))
+    return session_vars.tile_cache
+
+def get_cached_tile(tile_key):
+    """
+    Load an encoded tile from the tile cache or, if it is not in the cache, the persistent
+    tile store (see :py:mod:`toyz.web.tile_store` ). Returns ``None`` if the tile has not
+    been rendered.
+    """
+    from toyz.web.tile_store import get_tile_store
+    tile_cache = get_tile_cache()
+    tile = tile_cache.get(tile_key)
+    if tile is None:
+        tile_store = get_tile_store()
+        if tile_store is not None:
+            tile = tile_store.get(tile_key)
+            if tile is not None:
+                tile_cache.set(tile_key, tile)
+    return tile
+
+def cache_tile(tile_key, tile):
+    """
+    Add an encoded tile to the tile cache and the persistent tile store
+    """
+    from toyz.web.tile_store import get_tile_store
+    get_tile_cache().set(tile_key, tile)
+    tile_store = get_tile_store()
+    if tile_store is not None:
+        tile_store.set(tile_key, tile)
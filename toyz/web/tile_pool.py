@@ -0,0 +1,173 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Pool of worker processes used by a session to render viewer tiles in parallel.
+Each worker opens the image itself, so FITS files should be read using the ``memmap`` or
+``section`` ``fits_access`` setting to share the image through the operating system's
+page cache instead of loading a copy of the image into every worker. When the image is
+zoomed out the pyramid level used by the tiles (see :py:mod:`toyz.web.pyramid` ) is
+built once in the session's process and written to a temporary file that every worker
+memory maps, instead of each worker building its own copy of the pyramid.
+
+The workers are forked from the session's process, so the pool is started (by
+:py:func:`toyz.web.tile_pool.start_tile_pool` ) when the process receives its settings,
+before it starts the threads that run jobs.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+# Pyramid levels shared with the workers, keyed by (filepath, frame, level). Each entry
+# contains the data for the level and the path of the file it was written to.
+shared_levels = OrderedDict()
+shared_lock = threading.Lock()
+
+def init_worker(toyz_settings):
+    """
+    Initialize a worker process with the settings of the session that created it
+    """
+    session_vars.toyz_settings = toyz_settings
+
+def encode_chunk(args):
+    """
+    Render and encode a chunk of tiles in a worker process
+    (see :py:func:`toyz.web.viewer.encode_tiles` ). Returns the encoded tiles and the
+    time spent rendering each tile.
+    """
+    import toyz.web.viewer as viewer
+    file_info, img_info, tiles, level_path = args
+    data = None
+    if level_path is not None:
+        data = np.load(level_path, mmap_mode='r')
+    timings = {}
+    encoded = viewer.encode_tiles(file_info, img_info, tiles, timings, data)
+    return encoded, timings
+
+def start_tile_pool(toyz_settings):
+    """
+    Start the tile rendering pool for the current process. The number of workers is set
+    by the ``tile_workers`` web setting. If ``tile_workers`` is less than 2 no pool is
+    started and tiles are rendered in the session's job process. This must be called
+    before the process starts any other threads, since a lock held by another thread when
+    the workers are forked would never be released in the workers.
+    """
+    workers = int(core.get_setting(toyz_settings, 'web', 'tile_workers'))
+    if workers < 2 or getattr(session_vars, 'tile_pool', None) is not None:
+        return
+    session_vars.tile_pool = multiprocessing.Pool(
+        workers, initializer=init_worker, initargs=(toyz_settings,))
+    session_vars.tile_pool_size = workers
+
+def get_tile_pool():
+    """
+    Get the tile rendering pool for the current process, or ``None`` if the pool was not
+    started (see :py:func:`toyz.web.tile_pool.start_tile_pool` )
+    """
+    return getattr(session_vars, 'tile_pool', None)
+
+def close_tile_pool():
+    """
+    Stop all of the workers in the current session's tile pool and remove the pyramid
+    levels shared with them
+    """
+    if getattr(session_vars, 'tile_pool', None) is not None:
+        session_vars.tile_pool.terminate()
+        session_vars.tile_pool.join()
+        session_vars.tile_pool = None
+    with shared_lock:
+        shared_levels.clear()
+        if getattr(session_vars, 'shared_level_path', None) is not None:
+            shutil.rmtree(session_vars.shared_level_path, ignore_errors=True)
+            session_vars.shared_level_path = None
+
+def write_level(data):
+    """
+    Write the data for a pyramid level to a temporary file that can be memory mapped by
+    the workers, and return the path of the file. This must be called with the
+    ``shared_lock`` held.
+    """
+    if getattr(session_vars, 'shared_level_path', None) is None:
+        session_vars.shared_level_path = tempfile.mkdtemp(prefix='toyz-levels-')
+    fd, level_path = tempfile.mkstemp(suffix='.npy', dir=session_vars.shared_level_path)
+    os.close(fd)
+    np.save(level_path, data)
+    return level_path
+
+def share_level(file_info, img_info):
+    """
+    Get the pyramid level used by the tiles of a FITS image, writing it to a file shared
+    with the workers if it has not been shared yet (or the level was rebuilt).
+
+    Returns
+        - level_path (*string* ): Path of the shared level, or ``None`` if the tiles are
+          rendered from the full resolution image
+        - img_info (*dict* ): Image info for the pyramid level
+          (see :py:func:`toyz.web.pyramid.get_level` )
+    """
+    from toyz.web import pyramid
+    from toyz.web.viewer import get_frame_data
+    if file_info['ext']!='fits' or pyramid.get_level_number(img_info['scale'])==0:
+        return None, img_info
+    data, level_info = pyramid.get_level(
+        file_info, img_info, get_frame_data(file_info, img_info['frame']))
+    level = level_info.get('pyramid_level', 0)
+    if level==0:
+        return None, img_info
+    key = (file_info['filepath'], str(img_info['frame']), level)
+    with shared_lock:
+        shared = shared_levels.pop(key, None)
+        if shared is not None and shared[0] is not data:
+            os.remove(shared[1])
+            shared = None
+        if shared is None:
+            shared = (data, write_level(data))
+            while len(shared_levels) >= pyramid.max_pyramids:
+                os.remove(shared_levels.popitem(last=False)[1][1])
+        shared_levels[key] = shared
+    return shared[1], level_info
+
+def split_tiles(tiles, chunks):
+    """
+    Split a dictionary of tiles into (at most) ``chunks`` dictionaries of neighboring tiles,
+    so that each worker renders a compact block of the image.
+    """
+    tile_idx = sorted(tiles.keys(), key=lambda idx: (tiles[idx]['row'], tiles[idx]['col']))
+    chunk_size = int(math.ceil(len(tile_idx)/chunks))
+    return [{idx: tiles[idx] for idx in tile_idx[n:n+chunk_size]}
+        for n in range(0, len(tile_idx), chunk_size)]
+
+def iter_encoded_tiles(file_info, img_info, tiles, timings=None):
+    """
+    Render and encode tiles using the tile pool. If a ``timings`` dictionary is given
+    the time spent rendering each tile is stored in it.
+
+    Returns
+        - Generator that yields a dictionary of ``tile_idx: tile`` for each chunk of
+          tiles, in the order the chunks are completed
+    """
+    from toyz.web import pyramid
+    pool = get_tile_pool()
+    level_path, level_info = share_level(file_info, img_info)
+    if level_path is not None:
+        # The workers render the tiles from the shared level, using its pixel indices.
+        # The level is the full resolution data for the workers, so the tile indices must
+        # not be converted to the pyramid level a second time.
+        tiles = {tile_idx: pyramid.get_level_tile(level_info, tile_info)
+            for tile_idx, tile_info in tiles.items()}
+        img_info = dict(level_info)
+        del img_info['pyramid_level']
+    chunks = split_tiles(tiles, session_vars.tile_pool_size)
+    for encoded, chunk_timings in pool.imap_unordered(encode_chunk,
+            [(file_info, img_info, chunk, level_path) for chunk in chunks]):
+        if timings is not None:
+            timings.update(chunk_timings)
+        yield encoded
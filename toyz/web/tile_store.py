@@ -0,0 +1,158 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Persistent on-disk store of encoded viewer tiles shared by all sessions. Tiles are stored
+by a hash of the image path, its modification time and size, and the parameters used to
+render the tile, so tiles survive server restarts and are reused by any session that views
+the same image with the same settings. The total size of the store is limited by the
+``tile_store_size`` web setting (in MB) and the least recently used tiles are removed
+when the store is full.
+"""
+from __future__ import print_function, division
+import os
+import hashlib
+import uuid
+
+from toyz.utils import core
+from toyz.web import session_vars
+
+class TileStore:
+    """
+    Directory of encoded tiles with a maximum size in bytes
+    """
+    def __init__(self, path, max_bytes):
+        """
+        Parameters
+            - path (*string* ): Directory used to store the tiles
+            - max_bytes (*int* ): Maximum size of all of the tiles in the store
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Number of bytes written by this process since the size of the store was checked
+        self.bytes_written = 0
+        core.create_paths([path])
+
+    def get_tile_path(self, tile_key):
+        """
+        Get the path of a tile in the store. The tile key includes the image's
+        modification time and size (see :py:func:`toyz.web.viewer.get_tile_key` ), so
+        tiles are not reused if the image changes.
+        """
+        key = repr(tuple(tile_key)).encode('utf-8')
+        tile_hash = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.path, tile_hash[:2], tile_hash)
+
+    def get(self, tile_key):
+        """
+        Load an encoded tile from the store. Returns ``None`` if the tile is not stored.
+        """
+        tile_path = self.get_tile_path(tile_key)
+        try:
+            with open(tile_path, 'rb') as f:
+                tile = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        # The modification time of a tile is used to track when it was last used
+        try:
+            os.utime(tile_path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return tile
+
+    def set(self, tile_key, tile):
+        """
+        Add an encoded tile to the store. The tile is written to a temporary file and
+        renamed, so other processes never read a partially written tile.
+        """
+        tile_path = self.get_tile_path(tile_key)
+        core.create_paths([os.path.dirname(tile_path)])
+        temp_path = tile_path+'.'+uuid.uuid4().hex+'.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(tile)
+        os.rename(temp_path, tile_path)
+        self.bytes_written += len(tile)
+        # Only scan the store after a significant amount of data has been written
+        if self.bytes_written > self.max_bytes/20:
+            self.enforce_quota()
+
+    def get_tiles(self):
+        """
+        Get the path, size and last access time of every tile in the store. Tiles are
+        stored in subdirectories, so other files in the store directory (for example the
+        manifest used by :py:mod:`toyz.web.prebake` ) are ignored.
+        """
+        tiles = []
+        for root, dirs, files in os.walk(self.path):
+            if os.path.normpath(root)==os.path.normpath(self.path):
+                continue
+            for filename in files:
+                tile_path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(tile_path)
+                except OSError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, tile_path))
+        return tiles
+
+    def enforce_quota(self):
+        """
+        Remove the least recently used tiles until the store is 90% of its maximum size
+        """
+        self.bytes_written = 0
+        tiles = self.get_tiles()
+        size = sum([tile[1] for tile in tiles])
+        if size <= self.max_bytes:
+            return
+        tiles.sort()
+        for mtime, tile_size, tile_path in tiles:
+            if size <= .9*self.max_bytes:
+                break
+            try:
+                os.remove(tile_path)
+                size -= tile_size
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """
+        Get the hit/miss counters and current size of the store
+        """
+        tiles = self.get_tiles()
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'tiles': len(tiles),
+            'size': sum([tile[1] for tile in tiles]),
+            'max_size': self.max_bytes
+        }
+        return stats
+
+def get_store_path(toyz_settings):
+    """
+    Get the directory of the tile store, set by the ``tile_store_path`` web setting.
+    By default this is the *tile_store* directory in the Toyz root path.
+    """
+    path = core.get_setting(toyz_settings, 'web', 'tile_store_path')
+    if path=='':
+        path = os.path.join(toyz_settings.config.root_path, 'tile_store')
+    return path
+
+def get_tile_store(toyz_settings=None):
+    """
+    Get the tile store, creating it the first time it is needed. If the
+    ``tile_store_size`` web setting is 0 the store is disabled and ``None`` is returned.
+    """
+    if toyz_settings is None:
+        toyz_settings = getattr(session_vars, 'toyz_settings', None)
+    store_size = core.get_setting(toyz_settings, 'web', 'tile_store_size')
+    if toyz_settings is None or store_size<=0:
+        return None
+    with session_vars.cache_lock:
+        if getattr(session_vars, 'tile_store', None) is None:
+            session_vars.tile_store = TileStore(
+                get_store_path(toyz_settings), int(store_size*1024*1024))
+    return session_vars.tile_store
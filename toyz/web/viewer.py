@@ -5,19 +5,11 @@ from collections import OrderedDict
 from toyz.utils.errors import ToyzJobError
 import math
 import os
+import time
 import numpy as np
 from toyz.utils import core
 from toyz.web import session_vars
 
-# Set the default values for the sessions global variables if they have not already been set
-viewer_variables = {
-    'filepath': None,
-    'img_file': None,
-}
-for v in viewer_variables:
-    if not hasattr(session_vars, v):
-        setattr(session_vars, v, viewer_variables[v])
-
 # It may be desirabe in the future to allow users to choose what type of image they
 # want to send to the client. For now the default is sent to jpg, since it is the
 # smallest image type.
@@ -53,17 +45,21 @@ def import_fits():
 
 def get_file(file_info):
     """
-    If the image has already been loaded into memory, access it here.
-    Otherwise, store the image for later use
+    If the image is already open (see :py:class:`toyz.web.file_cache.FileCache` ),
+    access it here. Otherwise, open the image and store it for later use
     """
-    if session_vars.filepath == file_info['filepath']:
-        img_file = session_vars.img_file
+    from toyz.web.file_cache import get_file_cache
+    file_cache = get_file_cache()
+    open_file = file_cache.get(file_info['filepath'])
+    if open_file is not None:
+        img_file = open_file.img_file
     else:
         print('loading', file_info['filepath'])
         if file_info['ext']=='fits':
             print('Detected fits image type')
             pyfits = import_fits()
-            img_file = pyfits.open(file_info['filepath'])
+            memmap = get_fits_access()!='load'
+            img_file = pyfits.open(file_info['filepath'], memmap=memmap)
         else:
             try:
                 from PIL import Image
@@ -73,10 +69,107 @@ def get_file(file_info):
                     "open files of this type"
                 )
             img_file = Image.open(file_info['filepath'])
-        session_vars.filepath = file_info['filepath']
-        session_vars.img_file = img_file
+        file_cache.set(file_info['filepath'], img_file)
     return img_file
 
+def get_fits_access():
+    """
+    Get the method used to read FITS data, set by the ``fits_access`` web setting:
+    
+        - ``load``: the entire HDU is loaded into memory
+        - ``memmap``: the file is memory mapped and pages are read as they are accessed
+        - ``section``: only the rows and columns needed for a tile or region are read 
+          from the file (using ``hdu.section`` )
+    """
+    toyz_settings = getattr(session_vars, 'toyz_settings', None)
+    fits_access = core.get_setting(toyz_settings, 'web', 'fits_access')
+    if fits_access not in ['load', 'memmap', 'section']:
+        raise ToyzJobError("Unrecognized fits_access setting '{0}'".format(fits_access))
+    return fits_access
+
+class FitsSection:
+    """
+    Array-like wrapper for an image HDU that only reads the section of the image that
+    is sliced from the file, without loading the full HDU into memory. For data cubes
+    the indices of the ``plane`` in the leading axes are prepended to each slice.
+    """
+    def __init__(self, hdu, plane=()):
+        self.hdu = hdu
+        self.plane = tuple(plane)
+        self.shape = tuple(hdu.shape)[len(self.plane):]
+        self.ndim = len(self.shape)
+    
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.hdu.section[self.plane+key]
+
+def parse_frame(frame):
+    """
+    Split a frame into the index of its HDU and the indices of the plane in a data cube.
+    Frames of 2D images are the HDU index (for example ``'1'`` ), frames of 3D and 4D 
+    cubes also include the index of the plane along each leading axis (for example
+    ``'1.12'`` or ``'1.0.12'`` ).
+    """
+    indices = [int(idx) for idx in str(frame).split('.')]
+    return indices[0], tuple(indices[1:])
+
+def get_fits_frames(hdulist):
+    """
+    Get the frames of all the images in a FITS file. Each plane of a data cube is a
+    separate frame (see :py:func:`toyz.web.viewer.parse_frame` ).
+    """
+    frames = []
+    for n, hdu in enumerate(hdulist):
+        if len(hdulist)>1 and 'imagehdu' not in hdu.__class__.__name__.lower():
+            continue
+        shape = tuple(hdu.shape)
+        if len(shape)>2:
+            frames += ['.'.join([str(n)]+[str(idx) for idx in plane]) 
+                for plane in np.ndindex(*shape[:-2])]
+        else:
+            frames.append(str(n))
+    return frames
+
+def get_frame_data(file_info, frame):
+    """
+    Get the data for a frame in a FITS file. Depending on the ``fits_access`` setting 
+    (see :py:func:`toyz.web.viewer.get_fits_access` ) this is either the HDU's data array 
+    or a :py:class:`toyz.web.viewer.FitsSection` that reads only the sliced pixels.
+    Tile compressed images are read using a 
+    :py:class:`toyz.web.compressed.CompressedSection` unless the entire HDU is loaded.
+    
+    Only the requested plane of a data cube is read from the file (unless the entire
+    HDU is loaded). Recently used planes are kept in the file cache
+    (see :py:class:`toyz.web.file_cache.FileCache` ).
+    """
+    from toyz.web.file_cache import get_file_cache
+    from toyz.web import compressed
+    file_cache = get_file_cache()
+    hdulist = get_file(file_info)
+    hdu_idx, plane = parse_frame(frame)
+    hdu = hdulist[hdu_idx]
+    fits_access = get_fits_access()
+    if len(plane)>0:
+        if fits_access=='section' or compressed.is_compressed(hdu):
+            return FitsSection(hdu, plane)
+        data = file_cache.get_frame(file_info['filepath'], str(frame))
+        if data is None:
+            if fits_access=='load':
+                data = hdu.data[plane]
+            else:
+                # The section only reads (and scales) the pixels in the plane
+                data = np.array(hdu.section[plane])
+            file_cache.set_frame(file_info['filepath'], str(frame), data)
+        return data
+    if compressed.is_compressed(hdu) and fits_access!='load':
+        return compressed.CompressedSection(hdu, file_info['filepath'], frame)
+    if fits_access=='section':
+        return FitsSection(hdu)
+    data = hdu.data
+    file_cache.set_frame(file_info['filepath'], str(frame), data)
+    return data
+
 def get_file_info(file_info):
     file_split = file_info['filepath'].split('.')
     file_info['filename'] = os.path.basename(file_split[0])
@@ -97,14 +190,8 @@ def get_file_info(file_info):
         hdulist = get_file(file_info)
         file_info['hdulist'] = [hdu.__class__.__name__ for hdu in hdulist]
         if 'images' not in file_info:
-            if len(hdulist)>1:
-                file_info['images'] = OrderedDict(
-                    [[str(n), {'frame': str(n)}] for n, hdu in enumerate(hdulist)
-                    if 'imagehdu' in hdu.__class__.__name__.lower()])
-            else:
-                file_info['images'] = {
-                    '0': {'frame': '0'}
-                }
+            file_info['images'] = OrderedDict(
+                [[frame, {'frame': frame}] for frame in get_fits_frames(hdulist)])
         if len(file_info['images']) == 0:
             raise ToyzJobError("FITS file does not contain any recognized image hdu's")
     else:
@@ -113,10 +200,12 @@ def get_file_info(file_info):
     
     file_defaults = {
         'frame': next(iter(file_info['images'])),
-        'resampling': 'NEAREST',
+        'resampling': 'MEAN' if file_info['ext']=='fits' else 'NEAREST',
         'invert_x': False,
         'invert_y': False,
         'tile_format': 'png',
+        'stream_tiles': core.get_setting(
+            getattr(session_vars, 'toyz_settings', None), 'web', 'stream_tiles'),
         'colormap': {
             'name': 'Spectral',
             'color_scale': 'linear',
@@ -153,21 +242,24 @@ def get_best_fit(data_width, data_height, img_viewer):
 
 def get_img_info(file_info, img_info):
     if file_info['ext']=='fits':
-        hdulist = get_file(file_info)
-        data = hdulist[int(img_info['frame'])].data
+        from toyz.web import frame_stats
+        data = get_frame_data(file_info, img_info['frame'])
         height, width = data.shape
+        # Statistics are cached, so the frame is only scanned the first time it is opened
+        stats = frame_stats.get_frame_stats(file_info, img_info['frame'], data)
+        img_info['stats'] = stats
         
         if('colormap' not in img_info):
             if(file_info['colormap']['set_bounds']):
                 px_min = file_info['px_min']
                 px_max = file_info['px_max']
             else:
-                px_min = float(data.min())
-                px_max = float(data.max())
+                px_min = stats['min']
+                px_max = stats['max']
             img_info['colormap'] = file_info['colormap']
             if not file_info['colormap']['set_bounds']:
-                img_info['colormap']['px_min'] = float(data.min())
-                img_info['colormap']['px_max'] = float(data.max())
+                img_info['colormap']['px_min'] = px_min
+                img_info['colormap']['px_max'] = px_max
     else:
         # For non-FITS formats, only a single large image is loaded, which 
         try:
@@ -224,18 +316,44 @@ def get_tile_filename(file_info, img_info, x0_idx, xf_idx, y0_idx, yf_idx):
         "{0:.3f}".format(img_info['scale']), img_info['colormap']['name'], 
         "{0:.2f}".format(img_info['colormap']['px_min']),
         "{0:.2f}".format(img_info['colormap']['px_max']), 
-        str(img_info['colormap']['invert_color'])]
+        str(img_info['colormap']['invert_color']),
+        img_info['colormap'].get('color_scale', 'linear')]
     new_filename = '_'.join([str(f) for f in filename_params])
     new_filepath = os.path.join(img_info['save_path'], new_filename+'.'+file_info['tile_format'])
     return new_filepath
 
-def get_tile_info(file_info, img_info):
+def get_tile_key(file_info, img_info, tile_info, file_stat=None):
     """
-    Get info for all tiles available in the viewer. If the tile has not been loaded yet,
-    it is added to the new_tiles array.
+    Key used to identify a rendered tile in the tile cache. This uses the same parameters
+    as :py:func:`toyz.web.viewer.get_tile_filename` but with the full path of the image,
+    along with any other settings that change the encoded tile. The modification time
+    and size of the image are included so tiles are not reused if the image changes.
+    When the keys for a set of tiles are created, the result of ``os.stat`` for the
+    image should be passed as ``file_stat`` so that the file is only checked once.
+    """
+    if file_stat is None:
+        file_stat = os.stat(file_info['filepath'])
+    tile_key = (file_info['filepath'], file_stat.st_mtime, file_stat.st_size,
+        str(img_info['frame']),
+        tile_info['x0_idx'], tile_info['xf_idx'], tile_info['y0_idx'], tile_info['yf_idx'],
+        tile_info['width'], tile_info['height'],
+        "{0:.3f}".format(img_info['scale']), img_info['colormap']['name'],
+        "{0:.2f}".format(img_info['colormap']['px_min']),
+        "{0:.2f}".format(img_info['colormap']['px_max']),
+        str(img_info['colormap']['invert_color']),
+        img_info['colormap'].get('color_scale', 'linear'),
+        img_info['invert_x'], img_info['invert_y'],
+        file_info['resampling'], file_info['tile_format'])
+    return tile_key
+
+def get_tile_bounds(file_info, img_info):
+    """
+    Get the range of tile columns and rows visible in the viewer
+    
+    Returns
+        - min_col, max_col, min_row, max_row (*int* ): The viewer contains all of the 
+          tiles in ``range(min_col, max_col)`` and ``range(min_row, max_row)``
     """
-    all_tiles = []
-    new_tiles = {}
     if img_info['invert_x']:
         xmin = img_info['width']*img_info['scale'] - img_info['viewer']['right']
         xmax = img_info['width']*img_info['scale'] - img_info['viewer']['left']
@@ -252,63 +370,85 @@ def get_tile_info(file_info, img_info):
     maxCol=int(min(img_info['columns'],math.ceil(xmax/file_info['tile_width'])))
     minRow = int(max(1,math.floor(ymin/file_info['tile_height'])))-1
     maxRow = int(min(img_info['rows'],math.ceil(ymax/file_info['tile_height'])))
-    
+    return minCol, maxCol, minRow, maxRow
+
+def get_tile(file_info, img_info, col, row):
+    """
+    Get the info for the tile in a given column and row of the scaled image
+    """
     block_width = int(math.ceil(file_info['tile_width']/img_info['scale']))
     block_height = int(math.ceil(file_info['tile_height']/img_info['scale']))
+    tile_idx = str(col)+','+str(row)
+    y0 = row*file_info['tile_height']
+    yf = (row+1)*file_info['tile_height']
+    y0_idx = int(y0/img_info['scale'])
+    yf_idx = min(y0_idx + block_height, img_info['height'])
+    x0 = col*file_info['tile_width']
+    xf = (col+1)*file_info['tile_width']
+    x0_idx = int(x0/img_info['scale'])
+    xf_idx = min(x0_idx+block_width, img_info['width'])
+    tile_width = int((xf_idx-x0_idx)*img_info['scale'])
+    tile_height = int((yf_idx-y0_idx)*img_info['scale'])
+    new_filepath = get_tile_filename(
+        file_info, img_info, x0_idx, xf_idx, y0_idx, yf_idx)
+    tile = {
+        'idx': tile_idx,
+        'left': x0,
+        'right': xf,
+        'top': y0,
+        'bottom': yf,
+        'y0_idx': y0_idx,
+        'yf_idx': yf_idx,
+        'x0_idx': x0_idx,
+        'xf_idx': xf_idx,
+        'new_filepath': new_filepath,
+        'loaded': False,
+        'row': row,
+        'col': col,
+        'x': col*file_info['tile_width'],
+        'y': row*file_info['tile_height'],
+        'width': tile_width,
+        'height': tile_height
+    }
+    if img_info['invert_y']:
+        tile['top'] = yf
+        tile['bottom'] = y0
+    if img_info['invert_x']:
+        tile['left'] = xf
+        tile['right'] = x0
+    return tile
+
+def get_tile_info(file_info, img_info):
+    """
+    Get info for all tiles available in the viewer. If the tile has not been loaded yet,
+    it is added to the new_tiles array.
+    """
+    all_tiles = []
+    new_tiles = {}
+    minCol, maxCol, minRow, maxRow = get_tile_bounds(file_info, img_info)
     
     for row in range(minRow,maxRow):
-        y0 = row*file_info['tile_height']
-        yf = (row+1)*file_info['tile_height']
-        y0_idx = int(y0/img_info['scale'])
-        yf_idx = min(y0_idx + block_height, img_info['height'])
         for col in range(minCol,maxCol):
             all_tiles.append(str(col)+','+str(row))
             tile_idx = str(col)+','+str(row)
             if (tile_idx not in img_info['tiles'] or 
                     'loaded' not in img_info['tiles'][tile_idx] or
                     not img_info['tiles'][tile_idx]['loaded']):
-                x0 = col*file_info['tile_width']
-                xf = (col+1)*file_info['tile_width']
-                x0_idx = int(x0/img_info['scale'])
-                xf_idx = min(x0_idx+block_width, img_info['width'])
-                tile_width = int((xf_idx-x0_idx)*img_info['scale'])
-                tile_height = int((yf_idx-y0_idx)*img_info['scale'])
-                new_filepath = get_tile_filename(
-                    file_info, img_info, x0_idx, xf_idx, y0_idx, yf_idx)
-                tile = {
-                    'idx': tile_idx,
-                    'left': x0,
-                    'right': xf,
-                    'top': y0,
-                    'bottom': yf,
-                    'y0_idx': y0_idx,
-                    'yf_idx': yf_idx,
-                    'x0_idx': x0_idx,
-                    'xf_idx': xf_idx,
-                    'new_filepath': new_filepath,
-                    'loaded': False,
-                    'row': row,
-                    'col': col,
-                    'x': col*file_info['tile_width'],
-                    'y': row*file_info['tile_height'],
-                    'width': tile_width,
-                    'height': tile_height
-                }
-                if img_info['invert_y']:
-                    tile['top'] = yf
-                    tile['bottom'] = y0
-                if img_info['invert_x']:
-                    tile['left'] = xf
-                    tile['right'] = x0
-                new_tiles[tile_idx] = tile
-    print('viewer:', img_info['viewer'])
-    print('new tiles', new_tiles.keys())
+                new_tiles[tile_idx] = get_tile(file_info, img_info, col, row)
     return all_tiles, new_tiles
 
 def scale_data(file_info, img_info, tile_info, data):
+    from toyz.web import resample
     if img_info['scale']==1:
         data = data[tile_info['y0_idx']:tile_info['yf_idx'],
             tile_info['x0_idx']:tile_info['xf_idx']]
+    elif img_info['scale']<1 and file_info['resampling'] in resample.methods:
+        # Average (or take the max/median of) each block of pixels to avoid aliasing
+        data = np.asarray(data[tile_info['y0_idx']:tile_info['yf_idx'],
+            tile_info['x0_idx']:tile_info['xf_idx']])
+        shape = (int(round(data.shape[0]*img_info['scale'])),
+            int(round(data.shape[1]*img_info['scale'])))
+        data = resample.block_reduce(data, shape, file_info['resampling'])
     else:
         try:
             import scipy.ndimage
@@ -319,7 +459,9 @@ def scale_data(file_info, img_info, tile_info, data):
             if img_info['scale']>1:
                 data = data[tile_info['y0_idx']:tile_info['yf_idx'],
                     tile_info['x0_idx']:tile_info['xf_idx']]
-                data = np.kron(data, np.ones((img_info['scale'],img_info['scale'])))
+                # Keep the type of the data, since LUT indices must stay integers
+                scale = int(img_info['scale'])
+                data = np.kron(data, np.ones((scale, scale), dtype=data.dtype))
                 #data = zoom(data, img_info['scale'], order=0)
             elif img_info['scale']<1 and img_info['scale']>0:
                 tile_width = min(file_info['tile_width'],
@@ -330,16 +472,281 @@ def scale_data(file_info, img_info, tile_info, data):
                 xmax = min(img_info['width']-1, tile_info['xf_idx'])
                 ymax = min(img_info['height']-1, tile_info['yf_idx'])
         
-                xIdx=np.linspace(tile_info['x0_idx'], xmax, tile_width)
-                yIdx=np.linspace(tile_info['y0_idx'], ymax, tile_height)
-                xIdx=np.array(xIdx,np.int)
-                yIdx=np.reshape(np.array(yIdx,np.int),(yIdx.size,1))
+                # Only read the block of data containing the tile
+                data = data[tile_info['y0_idx']:ymax+1, tile_info['x0_idx']:xmax+1]
+                xIdx=np.linspace(0, xmax-tile_info['x0_idx'], tile_width)
+                yIdx=np.linspace(0, ymax-tile_info['y0_idx'], tile_height)
+                xIdx=np.array(xIdx,int)
+                yIdx=np.reshape(np.array(yIdx,int),(yIdx.size,1))
                 data = data[yIdx,xIdx]
             else:
                 raise ToyzJobError('Scale must be a positive number')
     return data
 
+def save_tile(tile_info, tile):
+    """
+    Write an encoded tile to the location the client will load it from
+    """
+    path = os.path.dirname(tile_info['new_filepath'])
+    core.create_paths([path])
+    with open(tile_info['new_filepath'], 'wb') as f:
+        f.write(tile)
+
 def create_tile(file_info, img_info, tile_info):
+    """
+    Create a tile from a larger image. If the tile has already been rendered by the
+    current process it is loaded from the tile cache
+    (see :py:class:`toyz.web.tile_cache.TileCache` ) or the persistent tile store, 
+    otherwise the tile is rendered and added to the cache.
+    """
+    from toyz.web import tile_cache
+    tile_key = get_tile_key(file_info, img_info, tile_info)
+    tile = tile_cache.get_cached_tile(tile_key)
+    if tile is not None:
+        save_tile(tile_info, tile)
+        return True, tile_info
+    
+    img = render_tile(file_info, img_info, tile_info)
+    tile = encode_tile(file_info, img)
+    if tile is None:
+        return False, ''
+    tile_cache.cache_tile(tile_key, tile)
+    save_tile(tile_info, tile)
+    return True, tile_info
+
+def encode_tile(file_info, img):
+    """
+    Encode a PIL image in the tile format of the file. Returns ``None`` if the image is empty.
+    """
+    import io
+    width, height = img.size
+    if width==0 or height==0:
+        return None
+    tile_buffer = io.BytesIO()
+    img.save(tile_buffer, format=img_formats[file_info['tile_format']])
+    return tile_buffer.getvalue()
+
+def create_tiles(file_info, img_info, tiles, stream=False):
+    """
+    Create a set of tiles (for example all of the new tiles in a viewport). 
+    See :py:func:`toyz.web.viewer.iter_tiles` .
+    
+    Parameters
+        - file_info (*dict* ): File info for the image
+        - img_info (*dict* ): Image info for the frame
+        - tiles (*dict* ): Dictionary of ``tile_idx: tile_info`` for each tile to create
+        - stream (*bool*, optional): If ``stream`` is *True* the encoded tiles are returned
+          instead of being saved to the sessions temp directory
+    
+    Returns
+        - created (*dict* ): Dictionary of ``tile_idx: tile_info`` for all of the tiles 
+          that were created
+        - encoded (*dict* ): Dictionary of ``tile_idx: tile`` with the encoded tiles
+          if ``stream`` is *True*, otherwise an empty dictionary
+    """
+    created = {}
+    encoded = {}
+    for new_created, new_encoded in iter_tiles(file_info, img_info, tiles, stream):
+        created.update(new_created)
+        encoded.update(new_encoded)
+    return created, encoded
+
+def iter_tiles(file_info, img_info, tiles, stream=False, timings=None):
+    """
+    Create a set of tiles, one batch at a time. Tiles in the tile cache (or the persistent
+    tile store) are returned in the first batch. The remaining tiles are rendered together using 
+    :py:func:`toyz.web.viewer.render_tiles` or, if the session has a tile pool 
+    (see :py:mod:`toyz.web.tile_pool` ), split between the workers in the pool and 
+    returned as each worker finishes.
+    
+    Parameters are the same as :py:func:`toyz.web.viewer.create_tiles` . If a ``timings``
+    dictionary is given the time spent rendering each new tile is stored in it (see
+    :py:func:`toyz.web.viewer.encode_tiles` ).
+    
+    Returns
+        - Generator that yields ``created, encoded`` (see 
+          :py:func:`toyz.web.viewer.create_tiles` ) for each batch of tiles
+    """
+    from toyz.web import tile_cache
+    from toyz.web import tile_pool
+    
+    def tile_batch(encoded):
+        created = {tile_idx: tiles[tile_idx] for tile_idx in encoded}
+        if not stream:
+            for tile_idx, tile in encoded.items():
+                save_tile(created[tile_idx], tile)
+            encoded = {}
+        return created, encoded
+    
+    # The image is only checked for changes once for all of the tiles
+    file_stat = os.stat(file_info['filepath'])
+    tile_keys = {tile_idx: get_tile_key(file_info, img_info, tile_info, file_stat)
+        for tile_idx, tile_info in tiles.items()}
+    cached = {}
+    new_tiles = {}
+    for tile_idx, tile_info in tiles.items():
+        tile = tile_cache.get_cached_tile(tile_keys[tile_idx])
+        if tile is None:
+            new_tiles[tile_idx] = tile_info
+        else:
+            cached[tile_idx] = tile
+    if len(cached)>0:
+        yield tile_batch(cached)
+    
+    if len(new_tiles)>1 and tile_pool.get_tile_pool() is not None:
+        batches = tile_pool.iter_encoded_tiles(file_info, img_info, new_tiles, timings)
+    else:
+        batches = [encode_tiles(file_info, img_info, new_tiles, timings)]
+    for encoded in batches:
+        for tile_idx, tile in encoded.items():
+            tile_cache.cache_tile(tile_keys[tile_idx], tile)
+        if len(encoded)>0:
+            yield tile_batch(encoded)
+
+def encode_tiles(file_info, img_info, tiles, timings=None, data=None):
+    """
+    Render and encode a set of tiles. Empty tiles are skipped.
+    
+    Parameters
+        - file_info (*dict* ): File info for the image
+        - img_info (*dict* ): Image info for the frame
+        - tiles (*dict* ): Dictionary of ``tile_idx: tile_info`` for each tile to render
+        - timings (*dict*, optional): If ``timings`` is given, the time (in seconds) spent
+          decoding the image (non-FITS images only), cropping and scaling the data 
+          (``crop``) and encoding each tile is stored in ``timings[tile_idx]``
+        - data (*numpy array*, optional): Data for the frame of a FITS image
+          (see :py:func:`toyz.web.viewer.render_tiles` )
+    
+    Returns
+        - encoded (*dict* ): Dictionary of ``tile_idx: tile`` with the encoded tiles
+    """
+    encoded = {}
+    start = time.time()
+    for tile_idx, img in render_tiles(file_info, img_info, tiles, timings, data):
+        rendered = time.time()
+        tile = encode_tile(file_info, img)
+        if tile is not None:
+            encoded[tile_idx] = tile
+        if timings is not None:
+            tile_timings = timings.setdefault(tile_idx, {})
+            tile_timings['crop'] = rendered-start-tile_timings.get('decode', 0)
+            tile_timings['encode'] = time.time()-rendered
+        start = time.time()
+    return encoded
+
+class DataRegion:
+    """
+    Block of data read from a larger image that can be sliced using the pixel indices
+    of the full image.
+    """
+    def __init__(self, data, x0, y0, shape):
+        self.data = data
+        self.x0 = x0
+        self.y0 = y0
+        self.shape = shape
+        self.ndim = len(shape)
+    
+    def __getitem__(self, key):
+        rows, cols = key
+        return self.data[rows.start-self.y0:rows.stop-self.y0,
+            cols.start-self.x0:cols.stop-self.x0]
+
+def render_tiles(file_info, img_info, tiles, timings=None, data=None):
+    """
+    Render a set of tiles from a single pass over the data. The region of a FITS image 
+    covering all of the tiles is read and colormapped once, then cut into tiles. 
+    Other image types are decoded once (see :py:mod:`toyz.web.raster` ) and rendered
+    one tile at a time. If a ``timings`` dictionary is given, the time spent decoding
+    the image for each non-FITS tile is stored in ``timings[tile_idx]['decode']``.
+    If ``data`` is given (for example a pyramid level shared by the tile pool, see
+    :py:mod:`toyz.web.tile_pool` ) it is used instead of loading the frame of a FITS
+    image, and ``img_info`` and the tiles must use the pixel indices of ``data`` .
+    
+    Returns
+        - Generator that yields a ``(tile_idx, img)`` for each tile, where ``img`` is 
+          a PIL image
+    """
+    if len(tiles)==0:
+        return
+    if file_info['ext']!='fits':
+        from toyz.web import raster
+        for tile_idx, tile_info in tiles.items():
+            start = time.time()
+            raster_data = raster.get_raster(file_info, img_info['scale'])
+            if timings is not None:
+                timings[tile_idx] = {'decode': time.time()-start}
+            yield tile_idx, raster.render_tile(file_info, img_info, tile_info, raster_data)
+        return
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ToyzJobError(
+            "You must have PIL (Python Imaging Library) installed to "
+            "open files of this type"
+        )
+    from toyz.web import colormaps
+    from toyz.web import pyramid
+    from toyz.web import resample
+    
+    if data is None:
+        data = get_frame_data(file_info, img_info['frame'])
+    region = {
+        'x0_idx': min([t['x0_idx'] for t in tiles.values()]),
+        'y0_idx': min([t['y0_idx'] for t in tiles.values()]),
+        'xf_idx': max([t['xf_idx'] for t in tiles.values()]),
+        'yf_idx': max([t['yf_idx'] for t in tiles.values()]),
+    }
+    if file_info['resampling'] == 'NEAREST':
+        # Convert the region into colormap indices once, then scale the indices for each tile
+        data, level_info, region = pyramid.get_level_data(file_info, img_info, region, data)
+        region_data = colormaps.quantize(
+            data[region['y0_idx']:region['yf_idx'], region['x0_idx']:region['xf_idx']],
+            img_info['colormap'])
+        region_data = DataRegion(region_data, region['x0_idx'], region['y0_idx'], data.shape)
+        lut = colormaps.get_colormap_lut(img_info['colormap'])
+        for tile_idx, tile_info in tiles.items():
+            level_tile = pyramid.get_level_tile(level_info, tile_info)
+            tile = scale_data(file_info, level_info, level_tile, region_data)
+            if img_info['invert_y']:
+                tile = np.flipud(tile)
+            if img_info['invert_x']:
+                tile = np.fliplr(tile)
+            yield tile_idx, Image.fromarray(lut[tile])
+    elif file_info['resampling'] in resample.methods:
+        # Read the region once, then reduce and colormap the data for each tile
+        data, level_info, region = pyramid.get_level_data(file_info, img_info, region, data)
+        region_data = np.asarray(
+            data[region['y0_idx']:region['yf_idx'], region['x0_idx']:region['xf_idx']])
+        region_data = DataRegion(region_data, region['x0_idx'], region['y0_idx'], data.shape)
+        for tile_idx, tile_info in tiles.items():
+            level_tile = pyramid.get_level_tile(level_info, tile_info)
+            tile = scale_data(file_info, level_info, level_tile, region_data)
+            if img_info['invert_y']:
+                tile = np.flipud(tile)
+            if img_info['invert_x']:
+                tile = np.fliplr(tile)
+            yield tile_idx, Image.fromarray(colormaps.colorize(tile, img_info['colormap']))
+    else:
+        # Colormap the full resolution region once, then crop and resample each tile
+        region_data = colormaps.colorize(
+            data[region['y0_idx']:region['yf_idx'], region['x0_idx']:region['xf_idx']],
+            img_info['colormap'])
+        region_data = DataRegion(region_data, region['x0_idx'], region['y0_idx'], data.shape)
+        for tile_idx, tile_info in tiles.items():
+            tile = region_data[tile_info['y0_idx']:tile_info['yf_idx'],
+                tile_info['x0_idx']:tile_info['xf_idx']]
+            if img_info['invert_y']:
+                tile = np.flipud(tile)
+            if img_info['invert_x']:
+                tile = np.fliplr(tile)
+            img = Image.fromarray(np.ascontiguousarray(tile))
+            yield tile_idx, img.resize((tile_info['width'], tile_info['height']),
+                getattr(Image, file_info['resampling']))
+
+def render_tile(file_info, img_info, tile_info):
+    """
+    Slice, scale and colormap the data for a tile and return it as a PIL image
+    """
     try:
         from PIL import Image
     except ImportError:
@@ -349,18 +756,17 @@ def create_tile(file_info, img_info, tile_info):
         )
     
     if file_info['ext']=='fits':
-        try:
-            from matplotlib import cm as cmap
-            from matplotlib.colors import Normalize, LinearSegmentedColormap
-        except ImportError:
-            raise ToyzJobError("You must have matplotlib installed to load FITS images")
-        
-        hdulist = get_file(file_info)
-        data = hdulist[int(img_info['frame'])].data
-        # If no advanced resampling algorithm is used, scale the data as quickly as possible.
+        from toyz.web import colormaps
+        from toyz.web import pyramid
+        from toyz.web import resample
+        data = get_frame_data(file_info, img_info['frame'])
+        # If no advanced resampling algorithm is used, scale the data as quickly as possible
+        # (using the nearest pyramid level if the image is zoomed out).
         # Otherwise crop the data.
-        if file_info['resampling'] == 'NEAREST':
-            data = scale_data(file_info, img_info, tile_info, data)
+        if file_info['resampling'] == 'NEAREST' or file_info['resampling'] in resample.methods:
+            data, level_info, level_tile = pyramid.get_level_data(
+                file_info, img_info, tile_info, data)
+            data = scale_data(file_info, level_info, level_tile, data)
         else:
             data = data[
                 tile_info['y0_idx']:tile_info['yf_idx'],
@@ -371,52 +777,191 @@ def create_tile(file_info, img_info, tile_info):
         if img_info['invert_x']:
             data = np.fliplr(data)
         
-        norm = Normalize(img_info['colormap']['px_min'], img_info['colormap']['px_max'], True)
-        colormap_name = img_info['colormap']['name']
-        if img_info['colormap']['invert_color']:
-            colormap_name = colormap_name + '_r'
-        colormap = getattr(cmap, colormap_name)
-        cm = cmap.ScalarMappable(norm, colormap)
-        img = np.uint8(cm.to_rgba(data)*255)
+        img = colormaps.colorize(data, img_info['colormap'])
         img = Image.fromarray(img)
-        if file_info['resampling'] != 'NEAREST':
+        if file_info['resampling'] != 'NEAREST' and file_info['resampling'] not in resample.methods:
             img = img.resize(
                 (tile_info['width'], tile_info['height']), 
                 getattr(Image, file_info['resampling']))
     else:
-        img = get_file(file_info)
-        img = img.crop((
-            tile_info['x0_idx'], tile_info['y0_idx'], 
-            tile_info['xf_idx'], 
-            tile_info['yf_idx']))
-        img = img.resize(
-            (tile_info['width'], tile_info['height']), getattr(Image, file_info['resampling']))
-    width, height = img.size
-    if width>0 and height>0:
-        path = os.path.dirname(tile_info['new_filepath'])
-        core.create_paths([path])
-        img.save(tile_info['new_filepath'], format=img_formats[file_info['tile_format']])
+        from toyz.web import raster
+        img = raster.render_tile(file_info, img_info, tile_info)
+    return img
+
+# Data types available for binary region data. Integer types are quantized between the
+# minimum and maximum of the region, with the largest value reserved for NaN pixels.
+region_dtypes = ['float64', 'float32', 'uint16', 'uint8']
+
+def get_region_stats(data):
+    """
+    Get the min, max, mean, median and standard deviation of the finite pixels in a
+    region. A single partition of the values gives the min, max and median, and the
+    mean and standard deviation are calculated from the sum and sum of squares of the
+    values (shifted by the median for numerical stability).
+    """
+    values = np.array(data, dtype=np.float64).ravel()
+    values = values[np.isfinite(values)]
+    npix = values.size
+    if npix==0:
+        return {'min': 0., 'max': 0., 'mean': 0., 'median': 0., 'std_dev': 0.}
+    mid = npix//2
+    kth = set([0, mid, npix-1])
+    if npix%2==0:
+        kth.add(mid-1)
+    values.partition(sorted(kth))
+    if npix%2==0:
+        median = (values[mid-1]+values[mid])/2
     else:
-        return False, ''
-    return True, tile_info
+        median = values[mid]
+    values -= median
+    offset = values.sum()/npix
+    variance = max(np.dot(values, values)/npix-offset**2, 0)
+    return {
+        'min': float(values[0]+median),
+        'max': float(values[-1]+median),
+        'mean': float(median+offset),
+        'median': float(median),
+        'std_dev': float(np.sqrt(variance))
+    }
+
+def encode_region(data, dtype, stats):
+    """
+    Encode a region of an image as a binary message (see
+    :py:func:`toyz.utils.core.encode_binary_frame` ).
+
+    Parameters
+        - data (*numpy array* ): Region of the image
+        - dtype (*string* ): Data type of the payload (one of ``region_dtypes`` )
+        - stats (*dict* ): Statistics of the region (from
+          :py:func:`toyz.web.viewer.get_region_stats` ), used to quantize integer types
+
+    Returns
+        - header (*dict* ): ``id``, ``shape``, ``dtype`` and ``byteorder`` (always 
+          ``little``) of the payload. Quantized data also has an ``offset`` and ``scale``
+          (the pixel value is ``offset+scale*value``) and the ``nan_value`` used for
+          pixels that are not finite.
+        - payload (*bytes* ): Raw little-endian array
+    """
+    if dtype not in region_dtypes:
+        raise ToyzJobError("Unrecognized data type '{0}'".format(dtype))
+    header = {
+        'id': 'data',
+        'shape': list(data.shape),
+        'dtype': dtype,
+        'byteorder': 'little'
+    }
+    if dtype.startswith('float'):
+        payload = np.ascontiguousarray(data, dtype='<f{0}'.format(int(dtype[5:])//8))
+    else:
+        nan_value = np.iinfo(dtype).max
+        scale = (stats['max']-stats['min'])/(nan_value-1)
+        if scale==0:
+            scale = 1.
+        data = np.asarray(data, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            values = np.round((data-stats['min'])/scale)
+            values = np.where(np.isfinite(values), np.clip(values, 0, nan_value-1), nan_value)
+        payload = values.astype('<u{0}'.format(np.dtype(dtype).itemsize))
+        header.update({
+            'offset': stats['min'],
+            'scale': scale,
+            'nan_value': int(nan_value)
+        })
+    return header, payload.tobytes()
+
+def get_pixels(data, x_idx, y_idx, block_rows=512):
+    """
+    Get the values of the pixels at integer indices ``(x_idx, y_idx)`` in one vectorized
+    lookup. If ``data`` is not an array (for example a 
+    :py:class:`toyz.web.viewer.FitsSection` ) the points are sorted by row and only the 
+    blocks of ``block_rows`` rows that contain points are read.
+    """
+    if isinstance(data, np.ndarray):
+        return data[y_idx, x_idx]
+    values = np.empty(x_idx.shape+tuple(data.shape[2:]), dtype=np.float64)
+    if x_idx.size==0:
+        return values
+    order = np.argsort(y_idx, kind='mergesort')
+    sorted_y = y_idx[order]
+    for block in np.unique(sorted_y//block_rows):
+        y0 = block*block_rows
+        lo, hi = np.searchsorted(sorted_y, [y0, y0+block_rows])
+        idx = order[lo:hi]
+        block_data = np.asarray(data[y0:y0+block_rows])
+        values[idx] = block_data[y_idx[idx]-y0, x_idx[idx]]
+    return values
+
+def sample_pixels(data, x, y, interpolation='nearest'):
+    """
+    Sample an image at many coordinates at once. Pixel centers are at integer
+    coordinates and points outside the image are ``NaN`` .
+
+    Parameters
+        - data (*array-like* ): Image data
+        - x, y (*array-like* ): Coordinates of the points
+        - interpolation (*string* ): ``nearest`` uses the value of the pixel that contains
+          each point, ``bilinear`` interpolates between the four nearest pixels 
+          (sub-pixel coordinates)
+
+    Returns
+        - values (*numpy array* ): Pixel value at each point
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    if x.shape!=y.shape:
+        raise ToyzJobError("x and y must have the same number of points")
+    height, width = data.shape[:2]
+    extra_dims = tuple(data.shape[2:])
+    values = np.empty(x.shape+extra_dims, dtype=np.float64)
+    values[:] = np.nan
+    if interpolation=='nearest':
+        x_idx = np.floor(x+.5)
+        y_idx = np.floor(y+.5)
+        inside = (x_idx>=0) & (x_idx<width) & (y_idx>=0) & (y_idx<height)
+        values[inside] = get_pixels(data, 
+            x_idx[inside].astype(np.intp), y_idx[inside].astype(np.intp))
+    elif interpolation=='bilinear':
+        inside = (x>=0) & (x<=width-1) & (y>=0) & (y<=height-1)
+        x = x[inside]
+        y = y[inside]
+        x0 = np.minimum(np.floor(x).astype(np.intp), max(width-2, 0))
+        y0 = np.minimum(np.floor(y).astype(np.intp), max(height-2, 0))
+        x1 = np.minimum(x0+1, width-1)
+        y1 = np.minimum(y0+1, height-1)
+        fx = (x-x0).reshape((-1,)+(1,)*len(extra_dims))
+        fy = (y-y0).reshape((-1,)+(1,)*len(extra_dims))
+        values[inside] = (
+            get_pixels(data, x0, y0)*(1-fx)*(1-fy)+
+            get_pixels(data, x1, y0)*fx*(1-fy)+
+            get_pixels(data, x0, y1)*(1-fx)*fy+
+            get_pixels(data, x1, y1)*fx*fy)
+    else:
+        raise ToyzJobError("Unrecognized interpolation '{0}'".format(interpolation))
+    return values
 
 def get_img_data(data_type, file_info, img_info, **kwargs):
     """
     Get data from an image or FITS file
+
+    For ``data_type='datapoints'`` the pixel values at the coordinates in the lists ``x``
+    and ``y`` are returned in one vectorized lookup, using the ``interpolation`` given
+    (see :py:func:`toyz.web.viewer.sample_pixels` ). With ``encoding='binary'`` the values
+    are sent as a binary message, otherwise as the list ``px_values`` .
+
+    For ``data_type='region_stats'`` the sum, mean and standard deviation of the pixels in
+    the rectangle ``[y0:yf, x0:xf]`` are returned (see 
+    :py:func:`toyz.web.integral.get_region_stats` ).
+
+    For ``data_type='data'`` the region is returned as a list of lists in the response
+    unless ``encoding='binary'`` is given, in which case the region is sent to the client
+    as a binary message with a payload of type ``dtype`` (default is ``float32``, see 
+    :py:func:`toyz.web.viewer.encode_region` ).
     """
     if file_info['ext']=='fits':
-        hdulist = get_file(file_info)
-        data = hdulist[int(img_info['frame'])].data
+        data = get_frame_data(file_info, img_info['frame'])
     else:
-        try:
-            from PIL import Image
-        except ImportError:
-            raise ToyzJobError(
-                "You must have PIL (Python Imaging Library) installed to "
-                "open files of this type"
-            )
-        img = get_file(file_info)
-        data = np.array(img)
+        from toyz.web import raster
+        data, factor = raster.get_raster(file_info)
     
     if data_type == 'data':
         if 'scale' in kwargs:
@@ -436,18 +981,45 @@ def get_img_data(data_type, file_info, img_info, **kwargs):
                 'xf_idx': xf,
                 'yf_idx': yf
             }
+            if file_info['ext']=='fits':
+                from toyz.web import pyramid
+                data, img_info, tile_data = pyramid.get_level_data(
+                    file_info, img_info, tile_data, data)
             data = scale_data(file_info, img_info, tile_data, data)
         else:
             data = data[y0:yf, x0:xf]
-        response = {
-            'id': 'data',
-            'min': float(data.min()),
-            'max': float(data.max()),
-            'mean': float(data.mean()),
-            'median': float(np.median(data)),
-            'std_dev': float(np.std(data)),
-            'data': data.tolist()
-        }
+        response = {'id': 'data'}
+        response.update(get_region_stats(data))
+        if kwargs.get('encoding', 'json')=='binary':
+            header, payload = encode_region(data, kwargs.get('dtype', 'float32'), response)
+            response['encoding'] = 'binary'
+            response['binary_frames'] = [(header, payload)]
+        else:
+            response['data'] = data.tolist()
+    elif data_type == 'datapoints':
+        core.check4keys(kwargs, ['x', 'y'])
+        values = sample_pixels(data, kwargs['x'], kwargs['y'], 
+            kwargs.get('interpolation', 'nearest'))
+        response = {'id': 'datapoints'}
+        if kwargs.get('encoding', 'json')=='binary':
+            header, payload = encode_region(values, kwargs.get('dtype', 'float32'), {
+                'min': float(np.nanmin(values)) if np.isfinite(values).any() else 0.,
+                'max': float(np.nanmax(values)) if np.isfinite(values).any() else 0.
+            })
+            header['id'] = 'datapoints'
+            response['encoding'] = 'binary'
+            response['binary_frames'] = [(header, payload)]
+        else:
+            # Points outside the image (NaN) are sent as null
+            px_values = values.astype(object)
+            px_values[~np.isfinite(values)] = None
+            response['px_values'] = px_values.tolist()
+    elif data_type == 'region_stats':
+        from toyz.web import integral
+        core.check4keys(kwargs, ['x0', 'y0', 'xf', 'yf'])
+        response = {'id': 'region_stats'}
+        response.update(integral.get_region_stats(file_info, img_info['frame'], data,
+            kwargs['x0'], kwargs['y0'], kwargs['xf'], kwargs['yf']))
     elif data_type == 'datapoint':
         if (kwargs['x']<data.shape[1] and kwargs['y']<data.shape[0] and
                 kwargs['x']>=0 and kwargs['y']>=0):
@@ -0,0 +1,96 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Server side state of each image viewer, used to send the client only the changes to the
+tiles visible in a viewer as it is moved. The client registers the file info and image
+info for a viewer once (and whenever the image, frame, scale or colormap change) and
+after that only sends the position of the viewer. The tiles are identified by their
+column and row, sent as a flat list ``[col0, row0, col1, row1, ...]`` .
+"""
+from __future__ import print_function, division
+
+from toyz.web import session_vars
+
+# Keys in the viewer position sent by the client
+viewer_keys = ['x_center', 'y_center', 'width', 'height', 'left', 'right', 'top', 'bottom']
+
+class Viewport:
+    """
+    Tiles visible in (and already sent to) a single viewer
+    """
+    def __init__(self, file_info, img_info, loaded=[]):
+        """
+        Parameters
+            - file_info (*dict* ): File info for the image (without ``images`` )
+            - img_info (*dict* ): Image info for the frame (without ``tiles`` )
+            - loaded (*list* ): Tile indices (``'col,row'`` ) the client has already loaded
+        """
+        self.file_info = file_info
+        self.img_info = img_info
+        self.visible = set()
+        self.loaded = set([tuple(int(n) for n in idx.split(',')) for idx in loaded])
+
+    def update(self, viewer):
+        """
+        Move the viewer and get the tiles that entered and left it.
+
+        Parameters
+            - viewer (*dict* ): New position of the viewer
+
+        Returns
+            - entered (*list* ): ``(col, row)`` of the visible tiles that have not been
+              sent to the client
+            - left (*list* ): ``(col, row)`` of the tiles that are no longer visible
+        """
+        import toyz.web.viewer as viewer_module
+        self.img_info['viewer'].update({k: viewer[k] for k in viewer_keys if k in viewer})
+        min_col, max_col, min_row, max_row = viewer_module.get_tile_bounds(
+            self.file_info, self.img_info)
+        visible = set([(col, row) for row in range(min_row, max_row)
+            for col in range(min_col, max_col)])
+        entered = sorted(visible-self.loaded, key=lambda tile: (tile[1], tile[0]))
+        left = sorted(self.visible-visible, key=lambda tile: (tile[1], tile[0]))
+        self.visible = visible
+        self.loaded.update(entered)
+        return entered, left
+
+    def unload(self, tiles):
+        """
+        Mark a list of ``(col, row)`` tiles as not sent to the client (for example when
+        the job sending them was cancelled), so they are sent the next time the viewer
+        is updated
+        """
+        self.loaded.difference_update(tiles)
+
+    def get_tiles(self, tiles):
+        """
+        Get the tile info for a list of ``(col, row)`` tiles
+        """
+        import toyz.web.viewer as viewer_module
+        return {'{0},{1}'.format(col, row): viewer_module.get_tile(
+            self.file_info, self.img_info, col, row) for col, row in tiles}
+
+def flatten(tiles):
+    """
+    Convert a list of ``(col, row)`` tiles into the flat list sent to the client
+    """
+    return [n for tile in tiles for n in tile]
+
+def set_viewport(viewer_id, file_info, img_info, loaded=[]):
+    """
+    Register (or reset) the state of a viewer
+    """
+    file_info = dict(file_info)
+    file_info.pop('images', None)
+    img_info = dict(img_info)
+    img_info.pop('tiles', None)
+    img_info['viewer'] = dict(img_info['viewer'])
+    session = session_vars.get_session()
+    session.viewports[viewer_id] = Viewport(file_info, img_info, loaded)
+    return session.viewports[viewer_id]
+
+def get_viewport(viewer_id):
+    """
+    Get the state of a viewer, or ``None`` if the viewer has not been registered
+    """
+    return session_vars.get_session().viewports.get(viewer_id)